@@ -1,8 +1,7 @@
-import io
-import os
 import struct
 
 import sys
+import threading
 
 # Python 2 compat
 try:
@@ -11,14 +10,53 @@ try:
 except NameError:
     num_types = (int, float)
 
+from fitparse.bulk import _fork, decode_chunks, decode_columns, decode_tables
+from fitparse.columns import build_chunks, build_columns, build_tables, numpy
+from fitparse.definitions import (
+    DEV_DATA_MESSAGES, NO_FIELD_PLAN, get_definition, is_selected, is_skippable, project_definition,
+    resolve_subfield,
+)
+from fitparse.frames import table_to_arrow, table_to_dataframe
+from fitparse.index import build_index
 from fitparse.processors import FitFileDataProcessor
-from fitparse.profile import FIELD_TYPE_TIMESTAMP, MESSAGE_TYPES
+from fitparse.profile import FIELD_TYPE_TIMESTAMP
+from fitparse.spill import spill_columns, spill_tables
+from fitparse.store import CompactMessageStore
 from fitparse.records import (
-    DataMessage, FieldData, FieldDefinition, DevFieldDefinition, DefinitionMessage, MessageHeader,
-    BASE_TYPES, BASE_TYPE_BYTE, DevField,
+    DataMessage, FieldData, DevFieldDefinition, DefinitionMessage, MESSAGE_HEADERS, RecordPool,
     add_dev_data_id, add_dev_field_description, get_dev_type
 )
-from fitparse.utils import calc_crc, FitParseError, FitEOFError, FitCRCError, FitHeaderError
+from fitparse.utils import (
+    buffered, calc_crc, open_fileish, FitParseError, FitEOFError, FitCRCError, FitHeaderError,
+)
+
+DEFAULT_CHUNK_SIZE = 4096
+
+# Messages FitFile.probe() looks for by default
+PROBE_MESSAGES = ('file_id', 'session')
+
+
+def message_names(name):
+    # The set of message names (and numbers) to filter by
+    if isinstance(name, (tuple, list)):
+        names = name
+    else:
+        names = [name]
+
+    # Convert any string numbers in names to ints
+    # TODO: Revisit Python2/3 str/bytes typecheck issues
+    return set([
+        int(n) if (isinstance(n, str) and n.isdigit()) else n
+        for n in names
+    ])
+
+def field_names(fields):
+    # The set of field names to decode, None for all
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        return frozenset([fields])
+    return frozenset(fields)
 
 def get_field(message, is_dev, def_nums):
     if type(def_nums) is not list:
@@ -45,6 +83,17 @@ def copy_dev_to_native(message, dev_ids, n_id):
     nat_field = get_field(message, False, n_id)
     copy_field(dev_field, nat_field)
 
+def project_message(message, fields):
+    """Returns a DataMessage of the fields of a data message named in a set
+    of field names (see fitparse.definitions.is_selected()).
+    """
+    return DataMessage(
+        header=message.header, def_mesg=message.def_mesg,
+        fields=[field_data for field_data in message.fields
+                if is_selected(field_data.field or field_data.field_def, field_data.parent_field, fields)],
+    )
+
+
 def adjust_message(msg):
     #print msg.mesg_num
     #if msg.type == 'data' and msg.mesg_num == 20: # Record
@@ -62,34 +111,69 @@ def adjust_message(msg):
         copy_dev_to_native(msg, 21, 14)     # avg_speed
 
 
+class ParseContext(object):
+    """The mutable state of parsing a FIT file: CRCs, bytes left, definition
+    messages by local message number, accumulators and developer fields.
+
+    Everything else needed to decode messages is immutable and shared
+    between files (see fitparse.definitions).
+    """
+    __slots__ = (
+        'accumulators', 'bytes_left', 'complete', 'compressed_ts_accumulator',
+        'crc', 'out_crc', 'local_mesgs', 'dev_types',
+    )
+
+    def __init__(self, dev_types=None):
+        self.accumulators = {}
+        self.bytes_left = -1
+        self.complete = False
+        self.compressed_ts_accumulator = 0
+        self.crc = 0
+        self.out_crc = 0
+        self.local_mesgs = {}
+        # Developer fields by developer data index, kept across chained files
+        self.dev_types = {} if dev_types is None else dev_types
+
+    def restart(self):
+        # A context at the same position, without any definition messages,
+        # accumulators or developer fields seen so far
+        context = ParseContext()
+        context.bytes_left = self.bytes_left
+        context.complete = self.complete
+        context.crc = self.crc
+        context.out_crc = self.out_crc
+        return context
+
+
 class FitFile(object):
-    def __init__(self, fileish, check_crc=True, data_processor=None, out=None):
+    def __init__(self, fileish, check_crc=True, data_processor=None, out=None, compact=False):
         self._verbose = False
-        print("HELLO")
-
-        if hasattr(fileish, 'read'):
-            # BytesIO-like object
-            self._file = fileish
-            self._out = out
-        elif isinstance(fileish, str):
-            # Python2 - file path, file contents in the case of a TypeError
-            # Python3 - file path
-            try:
-                self._file = open(fileish, 'rb')
-            except TypeError:
-                self._file = io.BytesIO(fileish)
-        else:
-            # Python 3 - file contents
-            self._file = io.BytesIO(fileish)
+        self._out = out
+        self._context = None
+        # Serializes parsing, so messages can be iterated from several threads
+        self._lock = threading.RLock()
+        # Parsed messages (of all chained files), kept for repeated iteration
+        self._messages = CompactMessageStore() if compact else []
+        # MessageIndex of the data messages, see get_last_messages()
+        self._index = None
+        # Names of the fields to decode (None for all) and the
+        # FieldProjections of the definition messages, see get_messages()
+        self._fields = None
+        self._projections = None
+        # Predicate data messages are filtered by and its tests of the raw
+        # values of each definition message, see get_messages()
+        self._where = None
+        self._predicates = None
+        # RecordPool data messages are built from, see get_messages()
+        self._pool = None
+
+        # Stream-decompress gzip, bz2 and xz compressed files, and read them
+        # in large blocks
+        self._file = buffered(open_fileish(fileish))
 
         self.check_crc = check_crc
         self._processor = data_processor or FitFileDataProcessor()
 
-        # Get total filesize
-        self._file.seek(0, os.SEEK_END)
-        self._filesize = self._file.tell()
-        self._file.seek(0, os.SEEK_SET)
-
         # Start off by parsing the file header (sets initial attribute values)
         self._parse_file_header()
 
@@ -117,14 +201,14 @@ class FitFile(object):
         if size <= 0:
             return None
         data = self._file.read(size)
-        self._crc = calc_crc(data, self._crc)
-        self._bytes_left -= len(data)
+        self._context.crc = calc_crc(data, self._context.crc)
+        self._context.bytes_left -= len(data)
         return data
 
     def _write(self, data):
         if self._out and data:
             self._out.write(data)
-            self._out_crc = calc_crc(data, self._out_crc)
+            self._context.out_crc = calc_crc(data, self._context.out_crc)
 
     def _read_struct(self, fmt, endian='<', data=None, always_tuple=False):
         fmt_with_endian = "%s%s" % (endian, fmt)
@@ -159,7 +243,7 @@ class FitFile(object):
 
     def _read_and_assert_crc(self, allow_zero=False):
         # CRC Calculation is little endian from SDK
-        crc_expected, crc_actual = self._crc, self._read_struct('H')
+        crc_expected, crc_actual = self._context.crc, self._read_struct('H')
 
         if (crc_actual != crc_expected) and not (allow_zero and (crc_actual == 0)):
             if self.check_crc:
@@ -167,24 +251,20 @@ class FitFile(object):
                     crc_expected, crc_actual))
 
     def _write_crc(self):
-        self._write_struct((self._out_crc,), 'H')
+        self._write_struct((self._context.out_crc,), 'H')
 
     ##########
     # Private Data Parsing Methods
 
-    def _parse_file_header(self):
+    def _parse_file_header(self, header_data=None):
 
         # Initialize data
-        self._accumulators = {}
-        self._bytes_left = -1
-        self._complete = False
-        self._compressed_ts_accumulator = 0
-        self._crc = 0
-        self._out_crc = 0
-        self._local_mesgs = {}
-        self._messages = []
-
-        header_data = self._read(12)
+        self._context = ParseContext(dev_types=self._context.dev_types if self._context else None)
+
+        if header_data is None:
+            header_data = self._read(12)
+        else:
+            self._context.crc = calc_crc(header_data)
         if header_data[8:12] != b'.FIT':
             raise FitHeaderError("Invalid .FIT File Header")
 
@@ -214,22 +294,25 @@ class FitFile(object):
             self._write(unknown)
 
         # After we've consumed the header, set the bytes left to be read
-        self._bytes_left = data_size
+        self._context.bytes_left = data_size
 
     def _parse_message(self):
         # When done, calculate the CRC and return None
-        if self._bytes_left <= 0:
-            if not self._complete:
+        if self._context.bytes_left <= 0:
+            if not self._context.complete:
                 self._read_and_assert_crc()
                 self._write_crc()
 
-            if self._file.tell() >= self._filesize:
-                self._complete = True
+            # Detect the end of the data by reading, so the file doesn't
+            # need to be seekable
+            header_data = self._file.read(12)
+            if not header_data:
+                self._context.complete = True
                 self.close()
                 return None
 
             # Still have data left in the file - assuming chained fit files
-            self._parse_file_header()
+            self._parse_file_header(header_data)
             return self._parse_message()
 
         header = self._parse_message_header()
@@ -240,88 +323,59 @@ class FitFile(object):
             self._write_definition_message(message)
         else:
             message = self._parse_data_message(header)
-            adjust_message(message)
+            if message is None:
+                # Rejected by the predicate, see get_messages()
+                return None
             self._write_data_message(message)
             if message.mesg_type is not None:
                 if message.mesg_type.name == 'developer_data_id':
-                    add_dev_data_id(message)
+                    add_dev_data_id(message, self._context.dev_types)
                 elif message.mesg_type.name == 'field_description':
-                    add_dev_field_description(message)
+                    add_dev_field_description(message, self._context.dev_types)
+                if message.mesg_type.name in DEV_DATA_MESSAGES:
+                    # Decoded completely for the developer fields
+                    if self._where is not None and not self._where.matches(message):
+                        return None
+                    if self._fields is not None:
+                        message = project_message(message, self._fields)
 
         self._messages.append(message)
         return message
 
     def _parse_message_header(self):
-        header = self._read_struct('B')
-
-        if header & 0x80:  # bit 7: Is this record a compressed timestamp?
-            return MessageHeader(
-                is_definition=False,
-                is_developer_data=False,
-                local_mesg_num=(header >> 5) & 0x3,  # bits 5-6
-                time_offset=header & 0x1F,  # bits 0-4
-            )
-        else:
-            return MessageHeader(
-                is_definition=bool(header & 0x40),  # bit 6
-                is_developer_data=bool(header & 0x20), # bit 5
-                local_mesg_num=header & 0xF,  # bits 0-3
-                time_offset=None,
-            )
+        # Headers are shared, one per header byte (see
+        # fitparse.records.MESSAGE_HEADERS)
+        data = self._read(1)
+        if not data:
+            raise FitEOFError("Tried to read 1 bytes from .FIT file but got 0")
+        return MESSAGE_HEADERS[ord(data)]
 
     def _write_message_header(self, header):
-        data = 0
-        if header.time_offset is not None:
-            data |= 0x80
-            data |= header.local_mesg_num << 5
-            data |= header.time_offset
-        else:
-            data |= 0x40 if header.is_definition else 0
-            data |= 0x20 if header.is_developer_data else 0
-            data |= header.local_mesg_num
-        self._write_struct((data,), 'B')
+        self._write_struct((header.code,), 'B')
 
     def _parse_definition_message(self, header):
-        # Read reserved byte and architecture byte to resolve endian
-        endian = '>' if self._read_struct('xB') else '<'
-        # Read rest of header with endian awareness
-        global_mesg_num, num_fields = self._read_struct('HB', endian=endian)
-        mesg_type = MESSAGE_TYPES.get(global_mesg_num)
-        field_defs = []
-
-        for n in range(num_fields):
-            field_def_num, field_size, base_type_num = self._read_struct('3B', endian=endian)
-            # Try to get field from message type (None if unknown)
-            field = mesg_type.fields.get(field_def_num) if mesg_type else None
-            base_type = BASE_TYPES.get(base_type_num, BASE_TYPE_BYTE)
-
-            if (field_size % base_type.size) != 0:
-                # NOTE: we could fall back to byte encoding if there's any
-                # examples in the wild. For now, just throw an exception
-                raise FitParseError("Invalid field size %d for type '%s' (expected a multiple of %d)" % (
-                    field_size, base_type.name, base_type.size))
-
-            # If the field has components that are accumulators
-            # start recording their accumulation at 0
-            if field and field.components:
-                for component in field.components:
-                    if component.accumulate:
-                        accumulators = self._accumulators.setdefault(global_mesg_num, {})
-                        accumulators[component.def_num] = 0
-
-            field_defs.append(FieldDefinition(
-                field=field,
-                def_num=field_def_num,
-                base_type=base_type,
-                size=field_size,
-            ))
+        # Skip the reserved byte. Architecture, global message number and field
+        # definitions are compiled once per process (see fitparse.definitions)
+        data = self._read_struct('x4s')
+        num_fields = ord(data[3:4])
+        if num_fields:
+            data += self._read_struct('%ds' % (num_fields * 3))
+        definition = get_definition(data)
+        endian = definition.endian
+
+        # If the fields have components that are accumulators
+        # start recording their accumulation at 0
+        if definition.accumulated:
+            accumulators = self._context.accumulators.setdefault(definition.mesg_num, {})
+            for def_num in definition.accumulated:
+                accumulators[def_num] = 0
 
         dev_field_defs = []
         if header.is_developer_data:
             num_dev_fields = self._read_struct('B', endian=endian)
             for n in range(num_dev_fields):
                 field_def_num, field_size, dev_data_index = self._read_struct('3B', endian=endian)
-                field = get_dev_type(dev_data_index, field_def_num)
+                field = get_dev_type(dev_data_index, field_def_num, self._context.dev_types)
                 dev_field_defs.append(DevFieldDefinition(
                     field=field,
                     dev_data_index=dev_data_index,
@@ -332,14 +386,15 @@ class FitFile(object):
         def_mesg = DefinitionMessage(
             header=header,
             endian=endian,
-            mesg_type=mesg_type,
-            mesg_num=global_mesg_num,
-            field_defs=field_defs,
+            mesg_type=definition.mesg_type,
+            mesg_num=definition.mesg_num,
+            field_defs=definition.field_defs,
             dev_field_defs=dev_field_defs,
+            compiled=definition,
         )
-        self._local_mesgs[header.local_mesg_num] = def_mesg
+        self._context.local_mesgs[header.local_mesg_num] = def_mesg
         if self._verbose:
-            print("DefinitionMessage", num_fields,len(dev_field_defs))
+            print("DefinitionMessage", num_fields, len(dev_field_defs))
         return def_mesg
 
     def _write_definition_message(self, msg):
@@ -353,9 +408,24 @@ class FitFile(object):
 
 
     def _parse_raw_values_from_data_message(self, def_mesg):
-        # Go through mesg's field defs and read them
+        compiled = def_mesg.compiled
+        if compiled.struct is None or self._verbose:
+            return self._read_raw_values(def_mesg, def_mesg.field_defs + def_mesg.dev_field_defs)
+
+        # Read all fields at once with the compiled struct
+        size = compiled.struct.size
+        data = self._read(size) if size else b''
+        if size != len(data):
+            raise FitEOFError("Tried to read %d bytes from .FIT file but got %d" % (size, len(data)))
+        raw_values = compiled.decode(data)
+        if def_mesg.dev_field_defs:
+            raw_values.extend(self._read_raw_values(def_mesg, def_mesg.dev_field_defs))
+        return raw_values
+
+    def _read_raw_values(self, def_mesg, field_defs):
+        # Go through field defs and read them
         raw_values = []
-        for field_def in def_mesg.field_defs + def_mesg.dev_field_defs:
+        for field_def in field_defs:
             base_type = field_def.base_type
             is_byte = base_type.name == 'byte'
             # Struct to read n base types (field def size / base type size)
@@ -384,6 +454,8 @@ class FitFile(object):
         return raw_values
 
     def _write_raw_values_from_data_message(self, def_mesg, raw_values):
+        if self._out is None:
+            return
         for field_def, raw_value in zip(def_mesg.field_defs + def_mesg.dev_field_defs, raw_values):
             base_type = field_def.base_type
             is_byte = base_type.name == 'byte'
@@ -405,21 +477,6 @@ class FitFile(object):
                 print(sys.exc_info()[0])
                 raise
 
-    @staticmethod
-    def _resolve_subfield(field, def_mesg, raw_values):
-        # Resolve into (field, parent) ie (subfield, field) or (field, None)
-        if field.subfields:
-            for sub_field in field.subfields:
-                # Go through reference fields for this sub field
-                for ref_field in sub_field.ref_fields:
-                    # Go through field defs AND their raw values
-                    for field_def, raw_value in zip(def_mesg.field_defs, raw_values):
-                        # If there's a definition number AND raw value match on the
-                        # reference field, then we return this subfield
-                        if (field_def.def_num == ref_field.def_num) and (ref_field.raw_value == raw_value):
-                            return sub_field, field
-        return field, None
-
     def _apply_scale_offset(self, field, raw_value):
         # Apply numeric transformations (scale+offset)
         if isinstance(raw_value, tuple):
@@ -444,69 +501,124 @@ class FitFile(object):
         return base_value
 
     def _parse_data_message(self, header):
-        def_mesg = self._local_mesgs.get(header.local_mesg_num)
+        def_mesg = self._context.local_mesgs.get(header.local_mesg_num)
         if not def_mesg:
             raise FitParseError('Got data message with invalid local message type %d' % (
                 header.local_mesg_num))
 
-        raw_values = self._parse_raw_values_from_data_message(def_mesg)
+        # Only the fields named in fields are decoded, if set (messages
+        # defining developer fields are kept whole)
+        fields = self._fields
+        projection = None
+        if fields is not None:
+            if def_mesg.name in DEV_DATA_MESSAGES:
+                fields = None
+            elif not self._verbose:
+                projection = self._projections.get(def_mesg, False)
+                if projection is False:
+                    projection = self._projections[def_mesg] = project_definition(def_mesg, fields)
+
+        if projection is not None:
+            size = projection.struct.size
+            data = self._read(size) if size else b''
+            if size != len(data):
+                raise FitEOFError("Tried to read %d bytes from .FIT file but got %d" % (size, len(data)))
+            raw_values = projection.decode(data)
+            field_defs, field_plans = projection.field_defs, projection.field_plans
+        else:
+            raw_values = self._parse_raw_values_from_data_message(def_mesg)
+            field_defs = def_mesg.field_defs + def_mesg.dev_field_defs
+            field_plans = def_mesg.compiled.field_plans + (NO_FIELD_PLAN,) * len(def_mesg.dev_field_defs)
+
+        # Filter by the predicate, on the raw values if it can be (otherwise
+        # once the fields are decoded, before processing them). Messages
+        # defining developer fields are filtered once they're added.
+        where = self._where
+        if where is not None and def_mesg.name in DEV_DATA_MESSAGES:
+            where = None
+        if where is not None:
+            test = self._predicates.get(def_mesg, False)
+            if test is False:
+                test = self._predicates[def_mesg] = where.compile(def_mesg, field_defs, field_plans)
+            if test is not None:
+                timestamp = None
+                if header.time_offset is not None:
+                    timestamp = self._apply_compressed_accumulation(
+                        header.time_offset, self._context.compressed_ts_accumulator, 5,
+                    )
+                if not test(raw_values, timestamp):
+                    self._skip_raw_values(def_mesg, field_defs, raw_values, field_plans, header.time_offset)
+                    return None
+                where = None
+
         field_datas = []  # TODO: I don't love this name, update on DataMessage too
 
+        # The objects of the message are recycled with a pool, if any
+        pool = self._pool
+        make_field_data = pool.field_data if pool is not None else FieldData.make
+
         # TODO: Maybe refactor this and make it simpler (or at least broken
         #       up into sub-functions)
-        for field_def, raw_value in zip(def_mesg.field_defs + def_mesg.dev_field_defs, raw_values):
+        for field_def, raw_value, field_plan in zip(field_defs, raw_values, field_plans):
             field, parent_field = field_def.field, None
             if field:
-                field, parent_field = self._resolve_subfield(field, def_mesg, raw_values)
+                # Subfields and components are resolved with the compiled plan
+                subfields, components = field_plan
+                field, parent_field = resolve_subfield(field, subfields, raw_values)
 
                 # Resolve component fields
-                if field.components:
-                    for component in field.components:
-                        # Render its raw value
-                        cmp_raw_value = component.render(raw_value)
-
-                        # Apply accumulated value
-                        if component.accumulate and cmp_raw_value is not None:
-                            accumulator = self._accumulators[def_mesg.mesg_num]
-                            cmp_raw_value = self._apply_compressed_accumulation(
-                                cmp_raw_value, accumulator[component.def_num], component.bits,
-                            )
-                            accumulator[component.def_num] = cmp_raw_value
-
-                        # Apply scale and offset from component, not from the dynamic field
-                        # as they may differ
-                        cmp_raw_value = self._apply_scale_offset(component, cmp_raw_value)
-
-                        # Extract the component's dynamic field from def_mesg
-                        cmp_field = def_mesg.mesg_type.fields[component.def_num]
-
-                        # Resolve a possible subfield
-                        cmp_field, cmp_parent_field = self._resolve_subfield(cmp_field, def_mesg, raw_values)
-                        cmp_value = cmp_field.render(cmp_raw_value)
-
-                        # Plop it on field_datas
-                        field_datas.append(
-                            FieldData(
-                                field_def=None,
-                                field=cmp_field,
-                                parent_field=cmp_parent_field,
-                                value=cmp_value,
-                                raw_value=cmp_raw_value,
-                            )
+                for component, cmp_field, cmp_subfields in components.get(field, ()):
+                    # Render its raw value
+                    cmp_raw_value = component.render(raw_value)
+
+                    # Apply accumulated value
+                    if component.accumulate and cmp_raw_value is not None:
+                        accumulator = self._context.accumulators[def_mesg.mesg_num]
+                        cmp_raw_value = self._apply_compressed_accumulation(
+                            cmp_raw_value, accumulator[component.def_num], component.bits,
                         )
+                        accumulator[component.def_num] = cmp_raw_value
+
+                    # Apply scale and offset from component, not from the dynamic field
+                    # as they may differ
+                    cmp_raw_value = self._apply_scale_offset(component, cmp_raw_value)
+
+                    # Resolve a possible subfield of the component's dynamic field
+                    cmp_field, cmp_parent_field = resolve_subfield(cmp_field, cmp_subfields, raw_values)
+                    if fields is not None and not is_selected(cmp_field, cmp_parent_field, fields):
+                        continue
+                    cmp_value = cmp_field.render(cmp_raw_value)
+
+                    # Plop it on field_datas
+                    field_datas.append(
+                        make_field_data(
+                            field_def=None,
+                            field=cmp_field,
+                            parent_field=cmp_parent_field,
+                            value=cmp_value,
+                            raw_value=cmp_raw_value,
+                        )
+                    )
+
+            # Update compressed timestamp field
+            if (field_def.def_num == FIELD_TYPE_TIMESTAMP.def_num) and (raw_value is not None):
+                self._context.compressed_ts_accumulator = raw_value
 
+            # Fields only decoded for the timestamp or as a reference field.
+            # Developer fields are left out after adjust_message().
+            if (fields is not None and not isinstance(field_def, DevFieldDefinition) and
+                    not is_selected(field or field_def, parent_field, fields)):
+                continue
+
+            if field:
                 # TODO: Do we care about a base_type and a resolved field mismatch?
                 # My hunch is we don't
                 value = self._apply_scale_offset(field, field.render(raw_value))
             else:
                 value = raw_value
 
-            # Update compressed timestamp field
-            if (field_def.def_num == FIELD_TYPE_TIMESTAMP.def_num) and (raw_value is not None):
-                self._compressed_ts_accumulator = raw_value
-
             field_datas.append(
-                FieldData(
+                make_field_data(
                     field_def=field_def,
                     field=field,
                     parent_field=parent_field,
@@ -517,11 +629,12 @@ class FitFile(object):
 
         # Apply timestamp field if we got a header
         if header.time_offset is not None:
-            ts_value = self._compressed_ts_accumulator = self._apply_compressed_accumulation(
-                header.time_offset, self._compressed_ts_accumulator, 5,
+            ts_value = self._context.compressed_ts_accumulator = self._apply_compressed_accumulation(
+                header.time_offset, self._context.compressed_ts_accumulator, 5,
             )
+        if header.time_offset is not None and (fields is None or FIELD_TYPE_TIMESTAMP.name in fields):
             field_datas.append(
-                FieldData(
+                make_field_data(
                     field_def=None,
                     field=FIELD_TYPE_TIMESTAMP,
                     parent_field=None,
@@ -530,6 +643,11 @@ class FitFile(object):
                 )
             )
 
+        # Developer fields may replace native ones in adjust_message(), so
+        # those messages are filtered once adjusted
+        if where is not None and not def_mesg.dev_field_defs and not where.matches(field_datas):
+            return None
+
         # Apply data processors
         for field_data in field_datas:
             # Apply type name processor
@@ -537,13 +655,137 @@ class FitFile(object):
             self._processor.run_field_processor(field_data)
             self._processor.run_unit_processor(field_data)
 
-        data_message = DataMessage(header=header, def_mesg=def_mesg, fields=field_datas)
+        if pool is not None:
+            data_message = pool.data_message(header, def_mesg, field_datas)
+        else:
+            data_message = DataMessage.make(header, def_mesg, field_datas)
         self._processor.run_message_processor(data_message)
+        adjust_message(data_message)
+        if where is not None and def_mesg.dev_field_defs and not where.matches(data_message):
+            return None
+        if fields is not None and def_mesg.dev_field_defs:
+            data_message = project_message(data_message, fields)
 
         if self._verbose:
             print("DataMessage", len(field_datas))
         return data_message
 
+    def _scan_messages(self, offset=0, parse=None):
+        # Walks through the rest of the messages structurally, for probe(),
+        # fitparse.index and fitparse.parallel: definition and developer field
+        # messages are parsed, data messages are skipped by their size
+        # without decoding them (see is_skippable()), unless parse(def_mesg)
+        # is true. CRCs aren't checked, and messages aren't kept.
+        #
+        # Yields (offset, header, def_mesg, None) before reading a message
+        # past its header (def_mesg is None for definition messages), then
+        # (offset, header, def_mesg, message) once it's parsed, if it is. At
+        # the end of each chained file, yields (offset, None, None, None) with
+        # the offset of its CRC. Offsets count from that of the first message.
+        # Sizes of the data messages to skip by definition, None if parsed
+        sizes = {}
+        end = offset + self._context.bytes_left
+        while True:
+            context = self._context
+            offset = end - context.bytes_left
+            if offset >= end:
+                yield offset, None, None, None
+                # Skip the CRC, then continue with a chained file if any
+                self._file.read(2)
+                header_data = self._file.read(12)
+                if not header_data:
+                    return
+                self._parse_file_header(header_data)
+                end = offset + 2 + ord(header_data[:1]) + self._context.bytes_left
+                continue
+
+            # Read without the CRC, like skipped messages
+            data = self._file.read(1)
+            if not data:
+                raise FitEOFError("Tried to read 1 bytes from .FIT file but got 0")
+            context.bytes_left -= 1
+            header = MESSAGE_HEADERS[ord(data)]
+            if header.is_definition:
+                yield offset, header, None, None
+                def_mesg = self._parse_definition_message(header)
+                yield offset, header, def_mesg, def_mesg
+                continue
+
+            def_mesg = context.local_mesgs.get(header.local_mesg_num)
+            if def_mesg is None:
+                raise FitParseError('Got data message with invalid local message type %d' % (
+                    header.local_mesg_num))
+            yield offset, header, def_mesg, None
+
+            try:
+                size = sizes[def_mesg]
+            except KeyError:
+                size = sizes[def_mesg] = None if (parse is not None and parse(def_mesg)) or not is_skippable(
+                    def_mesg) else def_mesg.compiled.size + sum(field_def.size for field_def in def_mesg.dev_field_defs)
+
+            if size is None:
+                message = self._parse_data_message(header)
+                if message.name == 'developer_data_id':
+                    add_dev_data_id(message, context.dev_types)
+                elif message.name == 'field_description':
+                    add_dev_field_description(message, context.dev_types)
+                yield offset, header, def_mesg, message
+                continue
+
+            data = self._file.read(size)
+            if len(data) != size:
+                raise FitEOFError("Tried to read %d bytes from .FIT file but got %d" % (size, len(data)))
+            context.bytes_left -= size
+            self._skip_data_message(def_mesg, data, header.time_offset)
+
+    def _skip_data_message(self, def_mesg, data, time_offset, offset=0):
+        # Updates the compressed timestamp and component accumulators for a
+        # data message (at offset in data) that's skipped instead of parsed,
+        # the way _parse_data_message() would. See is_skippable().
+        compiled = def_mesg.compiled
+        if compiled.timestamp is not None:
+            field_offset, timestamp_struct, parse = compiled.timestamp
+            raw_value = parse(timestamp_struct.unpack_from(data, offset + field_offset)[0])
+            if raw_value is not None:
+                self._context.compressed_ts_accumulator = raw_value
+        if time_offset is not None:
+            self._context.compressed_ts_accumulator = self._apply_compressed_accumulation(
+                time_offset, self._context.compressed_ts_accumulator, 5,
+            )
+
+        if compiled.accumulated:
+            raw_values = compiled.decode(data[offset:offset + compiled.struct.size])
+            self._accumulate(def_mesg, compiled.field_defs, raw_values, compiled.field_plans)
+
+    def _skip_raw_values(self, def_mesg, field_defs, raw_values, field_plans, time_offset):
+        # Like _skip_data_message(), for a data message whose raw values
+        # (of field_defs) are decoded already
+        for field_def, raw_value in zip(field_defs, raw_values):
+            if field_def.def_num == FIELD_TYPE_TIMESTAMP.def_num and raw_value is not None:
+                self._context.compressed_ts_accumulator = raw_value
+        if time_offset is not None:
+            self._context.compressed_ts_accumulator = self._apply_compressed_accumulation(
+                time_offset, self._context.compressed_ts_accumulator, 5,
+            )
+        if def_mesg.compiled.accumulated:
+            self._accumulate(def_mesg, field_defs, raw_values, field_plans)
+
+    def _accumulate(self, def_mesg, field_defs, raw_values, field_plans):
+        # Updates the accumulators of the accumulated components of a data
+        # message's raw values
+        accumulator = self._context.accumulators[def_mesg.mesg_num]
+        for field_def, raw_value, (subfields, components) in zip(field_defs, raw_values, field_plans):
+            if not components:
+                continue
+            field, _ = resolve_subfield(field_def.field, subfields, raw_values)
+            for component, _, _ in components.get(field, ()):
+                if component.accumulate:
+                    cmp_raw_value = component.render(raw_value)
+                    if cmp_raw_value is not None:
+                        accumulator[component.def_num] = self._apply_compressed_accumulation(
+                            cmp_raw_value, accumulator[component.def_num], component.bits,
+                        )
+
     def _write_data_message(self, msg):
         raw_values = []
         for fld in msg.fields:
@@ -557,23 +799,14 @@ class FitFile(object):
     ##########
     # Public API
 
-    def get_messages(self, name=None, with_definitions=False, as_dict=False, verbose=False):
+    def get_messages(self, name=None, with_definitions=False, as_dict=False, verbose=False, fields=None,
+                     where=None, recycle=False):
         self._verbose=verbose
         if with_definitions:  # with_definitions implies as_dict=False
             as_dict = False
 
         if name is not None:
-            if isinstance(name, (tuple, list)):
-                names = name
-            else:
-                names = [name]
-
-            # Convert any string numbers in names to ints
-            # TODO: Revisit Python2/3 str/bytes typecheck issues
-            names = set([
-                int(n) if (isinstance(n, str) and n.isdigit()) else n
-                for n in names
-            ])
+            names = message_names(name)
 
         def should_yield(message):
             if with_definitions or message.type == 'data':
@@ -585,25 +818,249 @@ class FitFile(object):
                         return True
             return False
 
-        # Yield all parsed messages first
-        for message in self._messages:
+        # With fields, only those fields of data messages are decoded, and
+        # with where, only data messages matching that predicate (see
+        # fitparse.filters). The messages aren't kept, unless they've already
+        # been parsed (then they're filtered and their other fields are left
+        # out). With recycle, the messages of an unparsed file aren't kept
+        # either, and the objects of each data message are reused for the
+        # next one (see fitparse.records.RecordPool).
+        fields = field_names(fields)
+        project = None
+        fork = None
+        if fields is not None or where is not None or recycle:
+            fork = self._fork_unparsed()
+        if fields is None and where is None and not recycle:
+            messages = self._iter_messages()
+        elif fork is not None:
+            if fields is not None and where is not None:
+                # The fields compared are decoded too, then left out
+                messages = self._parse_projected(fork, fields | where.names, where, recycle)
+                project = fields
+            else:
+                messages = self._parse_projected(fork, fields, where, recycle)
+            where = None
+        else:
+            messages = self._iter_messages()
+            project = fields
+
+        for message in messages:
             if should_yield(message):
+                if message.type == 'data':
+                    if where is not None and not where.matches(message):
+                        continue
+                    if project is not None:
+                        message = project_message(message, project)
                 yield message.as_dict() if as_dict else message
 
-        # If there are unparsed messages, yield those too
-        while not self._complete:
-            message = self._parse_message()
-            if message and should_yield(message):
-                yield message.as_dict() if as_dict else message
+    def _iter_messages(self):
+        # Yield all parsed messages, parsing more as needed. Messages parsed
+        # by other iterators (ie in other threads) are yielded too
+        index = 0
+        while True:
+            if index < len(self._messages):
+                message = self._messages[index]
+                index += 1
+                yield message
+            elif not self._parse_next(index):
+                break
+
+    def _parse_projected(self, fork, fields, where=None, recycle=False):
+        # Parses the data of an unparsed file with a parser of its own (see
+        # _fork_unparsed()) that only decodes fields (see
+        # fitparse.definitions.project_definition()) of data messages
+        # matching where, without keeping the messages (and reusing their
+        # objects, with recycle)
+        parser, _ = fork
+        if fields is not None:
+            parser._fields, parser._projections = fields, {}
+        if where is not None:
+            parser._where, parser._predicates = where, {}
+        if recycle:
+            parser._pool = RecordPool()
+        while True:
+            if parser._pool is not None:
+                # The previous message is done with
+                parser._pool.recycle()
+            message = parser._parse_message()
+            if message is None:
+                if parser._context.complete:
+                    return
+                # Rejected by where
+                continue
+            yield message
+
+    def _parse_next(self, count):
+        # Parses a message unless there are more than count already, returns
+        # False once there are no more
+        with self._lock:
+            if len(self._messages) > count:
+                return True
+            if self._context.complete:
+                return False
+            self._parse_message()
+            return True
+
+    def get_columns(self, name, memory_budget=None, spill_dir=None, fields=None):
+        """Returns the data messages named `name` as a ColumnTable of numpy
+        masked arrays, one per field (requires numpy).
+
+        If no messages have been parsed yet, runs of data messages are decoded
+        in bulk (see fitparse.bulk) without creating message objects, and the
+        FitFile stays unparsed.
+
+        With a `memory_budget` (in bytes), messages are decoded in chunks that
+        are spilled to temporary files in `spill_dir`, and the columns are
+        memory-mapped arrays of those (see fitparse.spill).
+
+        With `fields`, only the columns of those field names are decoded (see
+        get_messages()).
+        """
+        fields = field_names(fields)
+        if memory_budget is not None:
+            return spill_columns(self, name, message_names(name), memory_budget, spill_dir, fields)
+        fork = self._fork_unparsed(bulk=True)
+        if fork is not None:
+            return decode_columns(self, name, message_names(name), fields, fork=fork)
+        return build_columns(name, self.get_messages(name=name, fields=fields), self._processor)
+
+    def get_column_tables(self, memory_budget=None, spill_dir=None, fields=None):
+        """Returns a dict of message names to ColumnTables (see
+        get_columns()) for all data messages, built in a single pass.
+        """
+        fields = field_names(fields)
+        if memory_budget is not None:
+            return spill_tables(self, memory_budget, spill_dir, fields)
+        fork = self._fork_unparsed(bulk=True)
+        if fork is not None:
+            return decode_tables(self, fields, fork=fork)
+        return build_tables(self.get_messages(fields=fields), self._processor)
+
+    def get_column_chunks(self, name=None, chunk_size=DEFAULT_CHUNK_SIZE, fields=None):
+        """Yields ColumnTables (see get_columns()) of consecutive data
+        messages of the same type, in file order and of up to about
+        `chunk_size` rows, as the file is parsed. Only data messages named
+        `name` are included, if given, and only the columns of `fields`.
+        """
+        names = message_names(name) if name is not None else None
+        fields = field_names(fields)
+        fork = self._fork_unparsed(bulk=True)
+        if fork is not None:
+            return decode_chunks(self, names, chunk_size, fields, fork=fork)
+        return build_chunks(self.get_messages(name=name, fields=fields), self._processor, chunk_size)
+
+    def get_last_messages(self, name, count=1):
+        """Returns the last `count` data messages named `name` (ie the
+        session, lap and activity summaries at the end of activity files),
+        in file order.
+
+        If no messages have been parsed yet, a MessageIndex (see
+        fitparse.index) is built with a single pass over the data that
+        doesn't decode data messages, and only the requested ones are
+        decoded. The FitFile stays unparsed.
+        """
+        names = message_names(name)
+        with self._lock:
+            if self._index is None and (self._out is not None or self._context.complete or len(self._messages)):
+                messages = [m for m in self.get_messages(name=name)]
+                return messages[-count:] if count > 0 else []
+            if self._index is None:
+                self._index = build_index(self)
+        return self._index.get_last(names, count)
+
+    def to_arrow(self, name):
+        """Returns the data messages named `name` as a pyarrow.Table (see
+        get_columns() and fitparse.frames.table_to_arrow()).
+        """
+        return table_to_arrow(self.get_columns(name))
+
+    def to_dataframe(self, name):
+        """Returns the data messages named `name` as a pandas.DataFrame (see
+        get_columns() and fitparse.frames.table_to_dataframe()).
+        """
+        return table_to_dataframe(self.get_columns(name))
+
+    def _unparsed(self):
+        # Whether no message has been parsed (or written) yet
+        return self._out is None and not self._context.complete and not len(self._messages)
+
+    def _can_decode_bulk(self):
+        # Bulk decoding starts at the first message and skips writing output
+        return numpy is not None and self._unparsed()
+
+    def _fork_unparsed(self, bulk=False, spool_dir=None):
+        # Returns a parser of its own for the data, and the data (see
+        # fitparse.bulk._fork(), spooled to spool_dir if given), if no message
+        # has been parsed yet (and bulk decoding is possible, with bulk),
+        # otherwise None. Checked and forked under the lock, so other threads
+        # can't parse messages in between.
+        with self._lock:
+            if not (self._can_decode_bulk() if bulk else self._unparsed()):
+                return None
+            return _fork(self, spool_dir)
 
     @property
     def messages(self):
         # TODO: could this be more efficient?
         return list(self.get_messages())
 
-    def parse(self):
-        while self._parse_message():
-            pass
+    def parse(self, processes=1):
+        """Parses the FIT data completely. An unparsed file can be parsed
+        across several worker `processes` (None for the number of CPUs), see
+        fitparse.parallel.
+        """
+        with self._lock:
+            if processes != 1 and self._out is None and not self._context.complete and not len(self._messages):
+                from fitparse.parallel import parse_parallel
+
+                parse_parallel(self, processes=processes)
+                return
+            while self._parse_message():
+                pass
+
+    @classmethod
+    def probe(cls, fileish, name=PROBE_MESSAGES, tail=False, **kwargs):
+        """Reads the metadata of a FIT file: returns a dict of its header's
+        `protocol_version` and `profile_version`, and of each message name
+        (or number) in `name` to the first data message of that type (None
+        if there's none). Keyword arguments are passed on to FitFile.
+
+        Only those messages are decoded, other data messages are skipped by
+        their size, and reading stops as soon as all of them are found. With
+        `tail`, the rest of the file is skipped through as well, for the last
+        message of each type instead (ie the session and activity summaries
+        at the end of activity files). CRCs aren't checked.
+        """
+        if isinstance(name, (tuple, list)):
+            keys = name
+        else:
+            keys = [name]
+        names = message_names(keys)
+
+        def wanted(def_mesg):
+            return def_mesg.name in names or def_mesg.mesg_num in names
+
+        fitfile = cls(fileish, **kwargs)
+        try:
+            probed = {
+                'protocol_version': fitfile.protocol_version,
+                'profile_version': fitfile.profile_version,
+            }
+            found = {}
+            for _, header, def_mesg, message in fitfile._scan_messages(parse=wanted):
+                if message is None or header.is_definition or not wanted(def_mesg):
+                    continue
+                for key in (message.name, message.mesg_num):
+                    if key in names and (tail or key not in found):
+                        found[key] = message
+                if not tail and len(found) == len(names):
+                    break
+        finally:
+            fitfile.close()
+
+        for key in keys:
+            probed[key] = found.get(int(key) if isinstance(key, str) and key.isdigit() else key)
+        return probed
 
     def __iter__(self):
         return self.get_messages()
@@ -0,0 +1,392 @@
+import collections
+import copy
+import io
+import mmap
+import os
+import shutil
+import tempfile
+
+from fitparse.columns import _TableBuilder, numpy, object_array, require_numpy
+from fitparse.definitions import DEV_DATA_MESSAGES
+from fitparse.profile import FIELD_TYPE_TIMESTAMP
+from fitparse.utils import READ_BUFFER_SIZE, buffered, calc_crc
+
+
+# Shorter runs of data messages are parsed one by one
+MIN_RUN_LENGTH = 8
+
+# numpy type codes for the struct formats of the base types
+_DTYPE_CODES = {
+    'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4',
+    'f': 'f4', 'd': 'f8', 's': 'u1',
+}
+
+
+def _accumulate(raw_values, accumulation, bits):
+    # FitFile._apply_compressed_accumulation() over consecutive values. Each
+    # value adds its difference to the previous one (modulo 2 ** bits).
+    previous = numpy.empty_like(raw_values)
+    previous[0] = accumulation
+    previous[1:] = raw_values[:-1]
+    return accumulation + numpy.cumsum((raw_values - previous) & ((1 << bits) - 1))
+
+
+class _FieldDecoder(object):
+    # Decodes the column of one field definition of a run into raw values
+    # (as FitFile._parse_raw_values_from_data_message() would) and valid flags
+    __slots__ = ('key', 'field_def', 'field', 'name', 'kind', 'invalid', 'components')
+
+    def __init__(self, key, field_def, kind):
+        self.key = key
+        self.field_def = field_def
+        self.field = field_def.field
+        self.name = field_def.name
+        self.kind = kind
+        self.invalid = field_def.base_type.unparse(None)
+        # (component, destination field) tuples
+        self.components = []
+
+    def decode(self, raw):
+        kind = self.kind
+        if kind == 'number':
+            if raw.dtype.kind == 'f':
+                valid = ~numpy.isnan(raw)
+                return numpy.where(valid, raw.astype(numpy.float64), 0.0), valid
+            valid = raw != self.invalid
+            return numpy.where(valid, raw.astype(numpy.int64), 0), valid
+
+        if kind == 'byte':
+            valid = (raw != 0xFF).any(axis=1)
+            values = [tuple(v) if ok else None for v, ok in zip(raw.tolist(), valid.tolist())]
+            return object_array(values), valid
+
+        if kind == 'string':
+            parse = self.field_def.base_type.parse
+            values = [parse(row.tobytes()) for row in raw]
+        else:
+            # Multi-value field, invalid values are None within the tuple.
+            # These are raw values too, the column builder applies scale and
+            # offset to each of them.
+            invalid = self.invalid
+            if raw.dtype.kind == 'f':
+                values = [tuple(None if v != v else v for v in row) for row in raw.tolist()]
+            else:
+                values = [tuple(None if v == invalid else v for v in row) for row in raw.tolist()]
+        values = object_array(values)
+        return values, numpy.array([v is not None for v in values], dtype=bool)
+
+    def component_source(self, raw, values):
+        # The field's raw values as ints, as ComponentField.render() sees them
+        if self.kind == 'byte':
+            # Little endian byte array
+            raw = raw.astype(numpy.int64)
+            source = numpy.zeros(len(raw), dtype=numpy.int64)
+            for n in range(raw.shape[1]):
+                source |= raw[:, n] << (8 * n)
+            return source
+        return values
+
+
+class _RunDecoder(object):
+    # Decodes runs of data messages of one definition message with a single
+    # numpy.frombuffer() call. Definitions with developer fields, fields
+    # whose meaning depends on other values (subfields) and the messages
+    # defining developer fields (parsed one by one, so the developer fields
+    # are registered) aren't supported. With a set of field names, only the
+    # fields named in it (or with components named in it) and the timestamp
+    # are decoded, and only columns named in it are added.
+    __slots__ = ('def_mesg', 'dtype', 'fields', 'timestamp', 'supported', 'names')
+
+    def __init__(self, def_mesg, names=None):
+        self.def_mesg = def_mesg
+        self.fields = []
+        self.timestamp = None
+        self.names = names
+        self.supported = not def_mesg.dev_field_defs and def_mesg.name not in DEV_DATA_MESSAGES
+
+        dtype = [('header', 'u1')]
+        for n, field_def in enumerate(def_mesg.field_defs):
+            base_type = field_def.base_type
+            count = field_def.size // base_type.size
+            if base_type.name == 'byte':
+                kind = 'byte'
+            elif base_type.fmt == 's':
+                kind = 'string'
+            elif count > 1:
+                kind = 'array'
+            else:
+                kind = 'number'
+
+            key = 'f%d' % n
+            code = def_mesg.endian + _DTYPE_CODES[base_type.fmt]
+            dtype.append((key, code) if kind == 'number' else (key, code, (count,)))
+
+            field_decoder = _FieldDecoder(key, field_def, kind)
+            if not count:
+                self.supported = False
+
+            field = field_def.field
+            if field is not None:
+                if field.subfields:
+                    self.supported = False
+                for component in field.components or ():
+                    cmp_field = def_mesg.mesg_type.fields.get(component.def_num)
+                    if cmp_field is None or cmp_field.subfields:
+                        self.supported = False
+                    if not (kind == 'number' and base_type.fmt not in 'fd' or kind == 'byte' and count < 8):
+                        self.supported = False
+                    field_decoder.components.append((component, cmp_field))
+
+            if field_def.def_num == FIELD_TYPE_TIMESTAMP.def_num:
+                self.timestamp = field_decoder
+                if kind != 'number' or base_type.fmt in 'fd':
+                    self.supported = False
+
+            # Fields that aren't decoded are skipped in the records
+            if (names is None or field_decoder is self.timestamp or field_decoder.name in names or
+                    any(cmp_field.name in names for _, cmp_field in field_decoder.components if cmp_field)):
+                self.fields.append(field_decoder)
+
+        self.dtype = numpy.dtype(dtype)
+
+    def decode(self, data, offset, count, compressed, parser, table):
+        # Decodes count data messages at offset, adding them to table (if not
+        # None) and updating parser's accumulators the way parsing them one
+        # by one would
+        names = self.names
+        records = numpy.frombuffer(data, dtype=self.dtype, count=count, offset=offset)
+        rows = table.add_rows(count) if table is not None else None
+
+        for field_decoder in self.fields:
+            if table is None and field_decoder is not self.timestamp:
+                continue
+            raw = records[field_decoder.key]
+            values, valid = field_decoder.decode(raw)
+
+            if field_decoder is self.timestamp and valid.any():
+                parser._context.compressed_ts_accumulator = int(values[valid][-1])
+            if table is None:
+                continue
+
+            if field_decoder.components:
+                source = field_decoder.component_source(raw, values)
+            for component, cmp_field in field_decoder.components:
+                cmp_values = (source >> component.bit_offset) & ((1 << component.bits) - 1)
+                if component.accumulate:
+                    accumulator = parser._context.accumulators[self.def_mesg.mesg_num]
+                    accumulated = cmp_values[valid]
+                    if len(accumulated):
+                        accumulated = _accumulate(accumulated, accumulator[component.def_num], component.bits)
+                        cmp_values[valid] = accumulated
+                        accumulator[component.def_num] = int(accumulated[-1])
+                # Component scale and offset, see FitFile._apply_scale_offset()
+                if component.scale:
+                    cmp_values = cmp_values / float(component.scale)
+                if component.offset:
+                    cmp_values = cmp_values - component.offset
+                if names is None or cmp_field.name in names:
+                    cmp_values = numpy.where(valid, cmp_values, 0)
+                    table.add_column(cmp_field.name, cmp_field, rows, cmp_values, valid, True)
+
+            if names is None or field_decoder.name in names:
+                table.add_column(field_decoder.name, field_decoder.field, rows, values, valid, False)
+
+        if compressed:
+            time_offsets = (records['header'] & 0x1F).astype(numpy.int64)
+            timestamps = _accumulate(time_offsets, parser._context.compressed_ts_accumulator, 5)
+            parser._context.compressed_ts_accumulator = int(timestamps[-1])
+            if table is not None and (names is None or FIELD_TYPE_TIMESTAMP.name in names):
+                table.add_column(
+                    FIELD_TYPE_TIMESTAMP.name, FIELD_TYPE_TIMESTAMP, rows, timestamps,
+                    numpy.ones(count, dtype=bool), True,
+                )
+
+
+def _fork(fitfile, spool_dir=None):
+    # Returns a parser for the rest of fitfile's data (and the data), leaving
+    # fitfile unparsed so its messages can still be read. With spool_dir, the
+    # data is copied block by block to a temporary file there instead of
+    # being read into memory: fitfile reads it from that file, and the data
+    # (and the parser) are memory maps of it.
+    with fitfile._lock:
+        if spool_dir is None:
+            data = fitfile._file.read()
+            spool = None
+        else:
+            spool = tempfile.TemporaryFile(dir=spool_dir)
+            shutil.copyfileobj(fitfile._file, spool, READ_BUFFER_SIZE)
+            data = _map(spool)
+        if hasattr(fitfile._file, 'close'):
+            fitfile._file.close()
+        if spool is None:
+            fitfile._file = io.BytesIO(data)
+        else:
+            spool.seek(0)
+            fitfile._file = buffered(spool)
+
+    parser = copy.copy(fitfile)
+    # A map of its own, as closing it once parsed would fail while arrays
+    # of the data are in use
+    parser._file = _map(spool) if spool is not None and len(data) else io.BytesIO(data)
+    parser._out = None
+    parser._context = fitfile._context.restart()
+    # Messages are added to tables, not retained
+    parser._messages = collections.deque(maxlen=0)
+    return parser, data
+
+
+def _map(fileobj):
+    # A read-only memory map of a whole file (mmap can't map empty files)
+    fileobj.flush()
+    if not os.fstat(fileobj.fileno()).st_size:
+        return b''
+    return mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _run_length(buf, offset, size, max_count, header, compressed):
+    # Number of consecutive data messages of size bytes at offset with the
+    # same header, checked in growing windows
+    count, window = 0, MIN_RUN_LENGTH
+    while count < max_count:
+        end = min(max_count, count + window)
+        headers = buf[offset + count * size:offset + end * size:size]
+        if compressed:
+            # Only the local message number has to match
+            matches = (headers & 0xE0) == (header & 0xE0)
+        else:
+            matches = headers == header
+        if not matches.all():
+            return count + int(numpy.argmin(matches))
+        count, window = end, window * 2
+    return count
+
+
+def _decode(fitfile, table_for, max_size=None, fields=None, fork=None):
+    # Decodes fitfile's data messages into the tables returned by
+    # table_for(def_mesg) (or skips them if None), yielding after each run
+    # or message. Runs don't grow tables past max_size rows. Only the
+    # fields named in fields (a set) are decoded, if given. fork is the
+    # parser and data to decode, if forked already (see _fork()).
+    parser, data = fork or _fork(fitfile)
+    if fields is not None:
+        parser._fields, parser._projections = fields, {}
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    decoders = {}
+
+    while True:
+        offset = parser._file.tell()
+        if 0 < parser._context.bytes_left and offset < len(buf):
+            header = int(buf[offset])
+            if header & 0x80:
+                compressed, def_mesg = True, parser._context.local_mesgs.get((header >> 5) & 0x3)
+            elif not header & 0x40:
+                compressed, def_mesg = False, parser._context.local_mesgs.get(header & 0xF)
+            else:
+                def_mesg = None
+
+            decoder = None
+            if def_mesg is not None:
+                decoder = decoders.get(def_mesg)
+                if decoder is None:
+                    decoder = decoders[def_mesg] = _RunDecoder(def_mesg, fields)
+                # A compressed timestamp would follow the timestamp field
+                if not decoder.supported or (compressed and decoder.timestamp is not None):
+                    decoder = None
+
+            if decoder is not None:
+                table = table_for(def_mesg)
+                size = decoder.dtype.itemsize
+                max_count = min(parser._context.bytes_left, len(buf) - offset) // size
+                if max_size is not None and table is not None:
+                    max_count = min(max_count, max_size - table.size)
+                count = _run_length(buf, offset, size, max_count, header, compressed)
+                if count >= MIN_RUN_LENGTH:
+                    decoder.decode(data, offset, count, compressed, parser, table)
+                    size *= count
+                    if parser.check_crc:
+                        parser._context.crc = calc_crc(data[offset:offset + size], parser._context.crc)
+                    parser._context.bytes_left -= size
+                    parser._file.seek(offset + size)
+                    yield
+                    continue
+
+        message = parser._parse_message()
+        if message is None:
+            break
+        if message.type == 'data':
+            table = table_for(message.def_mesg)
+            if table is not None:
+                table.add_message(message)
+        yield
+
+
+def decode_columns(fitfile, name, names, fields=None, fork=None):
+    """Like build_columns(), but decodes the data of an unparsed FitFile
+    directly. Data messages with a name or number in `names` end up in the
+    ColumnTable named `name`, with only the fields named in `fields` (a
+    set), if given. `fork` is a parser and data from _fork(), if forked
+    already.
+
+    Runs of data messages of the same definition message are decoded with
+    a single numpy.frombuffer() call using a structured dtype, other
+    messages are parsed one by one.
+    """
+    require_numpy()
+
+    table = _TableBuilder(name)
+
+    def table_for(def_mesg):
+        if def_mesg.name in names or def_mesg.mesg_num in names:
+            return table
+
+    for _ in _decode(fitfile, table_for, fields=fields, fork=fork):
+        pass
+    return table.build(fitfile._processor)
+
+
+def decode_tables(fitfile, fields=None, fork=None):
+    """Like build_tables(), but decodes the data of an unparsed FitFile
+    directly (see decode_columns()).
+    """
+    require_numpy()
+
+    tables = {}
+
+    def table_for(def_mesg):
+        table = tables.get(def_mesg.name)
+        if table is None:
+            table = tables[def_mesg.name] = _TableBuilder(def_mesg.name)
+        return table
+
+    for _ in _decode(fitfile, table_for, fields=fields, fork=fork):
+        pass
+    return dict((name, table.build(fitfile._processor)) for name, table in tables.items())
+
+
+def decode_chunks(fitfile, names, chunk_size, fields=None, fork=None):
+    """Like build_chunks(), but decodes the data of an unparsed FitFile
+    directly (see decode_columns()), so only the current chunk is kept in
+    memory.
+    """
+    require_numpy()
+
+    processor = fitfile._processor
+    current = [None]
+    chunks = []
+
+    def table_for(def_mesg):
+        if names is not None and def_mesg.name not in names and def_mesg.mesg_num not in names:
+            return None
+        table = current[0]
+        if table is not None and (table.name != def_mesg.name or table.size >= chunk_size):
+            chunks.append(table.build(processor))
+            table = None
+        if table is None:
+            table = current[0] = _TableBuilder(def_mesg.name)
+        return table
+
+    for _ in _decode(fitfile, table_for, max_size=chunk_size, fields=fields, fork=fork):
+        while chunks:
+            yield chunks.pop(0)
+    if current[0] is not None:
+        yield current[0].build(processor)
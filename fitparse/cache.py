@@ -0,0 +1,272 @@
+import datetime
+import errno
+import hashlib
+import io
+import json
+import os
+import tempfile
+import warnings
+import zipfile
+
+from fitparse import __version__
+from fitparse.base import FitFile
+from fitparse.columns import ColumnTable, numpy, object_array, require_numpy
+from fitparse.processors import FitFileDataProcessor
+
+# Python 2 compat
+try:
+    str = basestring
+except NameError:
+    pass
+
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+def _replace(src, dst):
+    # Atomically move a fully written file into place
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # Python 2 (POSIX only)
+        os.rename(src, dst)
+
+
+def _encode_value(value):
+    # A value of an object array as JSON (see _encode_objects()), or raises
+    # TypeError if it can't be represented
+    if value is None or isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, tuple):
+        return [_encode_value(v) for v in value]
+    # Naive datetimes, dates and times (ie localtime_into_day fields)
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return {'datetime': [value.year, value.month, value.day, value.hour, value.minute, value.second,
+                             value.microsecond]}
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return {'date': [value.year, value.month, value.day]}
+    if isinstance(value, datetime.time) and value.tzinfo is None:
+        return {'time': [value.hour, value.minute, value.second, value.microsecond]}
+    raise TypeError('%r can\'t be cached' % (value,))
+
+
+def _encode_objects(array):
+    # Object arrays (strings, unknown enum values, tuples of array fields,
+    # times) as JSON, so entries load without unpickling. Lists stand for
+    # tuples, objects for datetimes, dates and times. Raises TypeError for
+    # values JSON can't represent.
+    data = json.dumps([_encode_value(value) for value in array.tolist()]).encode('utf-8')
+    return numpy.frombuffer(data, dtype=numpy.uint8)
+
+
+_DECODERS = {'datetime': datetime.datetime, 'date': datetime.date, 'time': datetime.time}
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        return tuple(_decode_value(v) for v in value)
+    if isinstance(value, dict):
+        (kind, args), = value.items()
+        return _DECODERS[kind](*args)
+    return value
+
+
+def _decode_objects(data):
+    return object_array([_decode_value(v) for v in json.loads(data.tobytes().decode('utf-8'))])
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        # Another process might have evicted it already
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class FitCache(object):
+    """A content-addressed on-disk cache of columnar FitFile output.
+
+    Entries are keyed by the SHA-256 of the file's contents, the data
+    processor (class and public options), check_crc and the fitparse
+    version, and hold the ColumnTables of all message types in a NumPy
+    .npz file. A hit doesn't decode the file at all. Object arrays are
+    stored as JSON, so entries load without unpickling anything; naive
+    datetimes, dates and times (ie localtime_into_day columns) are stored
+    as their components. Tables holding other objects aren't cached, with a
+    warning.
+
+    Entries are written to a temporary file and atomically renamed into
+    place, so several processes can share a cache directory. When the cache
+    grows beyond `max_size` bytes, the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        require_numpy()
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def _read(fileish):
+        if hasattr(fileish, 'read'):
+            return fileish.read()
+        if isinstance(fileish, str):
+            try:
+                with io.open(fileish, 'rb') as f:
+                    return f.read()
+            except TypeError:  # Python 2 - file contents
+                pass
+        return bytes(fileish)
+
+    def key(self, data, data_processor, check_crc=True):
+        processor_class = data_processor.__class__
+        options = sorted(
+            (name, repr(value)) for name, value in vars(data_processor).items()
+            if not name.startswith('_')
+        )
+        digest = hashlib.sha256()
+        digest.update(repr((
+            __version__, processor_class.__module__, processor_class.__name__,
+            options, data_processor.epoch_timestamps, bool(check_crc),
+        )).encode('utf-8'))
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def get_column_tables(self, fileish, data_processor=None, check_crc=True):
+        """Returns the same dict of ColumnTables as FitFile.get_column_tables(),
+        from the cache if possible.
+        """
+        data = self._read(fileish)
+        data_processor = data_processor or FitFileDataProcessor()
+        key = self.key(data, data_processor, check_crc)
+
+        tables = self.load(key)
+        if tables is None:
+            with FitFile(data, check_crc=check_crc, data_processor=data_processor) as fitfile:
+                tables = fitfile.get_column_tables()
+            self.store(key, tables)
+        return tables
+
+    def get_columns(self, fileish, name, data_processor=None, check_crc=True):
+        tables = self.get_column_tables(fileish, data_processor=data_processor, check_crc=check_crc)
+        table = tables.get(name)
+        if table is None:
+            return ColumnTable(name, {}, {}, 0)
+        return table
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            npz = numpy.load(path, allow_pickle=False)
+        except (IOError, OSError):
+            return None
+        except (zipfile.BadZipfile, ValueError, EOFError):
+            # Corrupted or truncated entry, rebuild it
+            _remove(path)
+            return None
+
+        try:
+            with npz:
+                meta = json.loads(npz['__meta__'].tobytes().decode('utf-8'))
+                objects = frozenset(meta.get('objects', ()))
+
+                def load_array(name):
+                    if name in objects:
+                        return _decode_objects(npz[name])
+                    return npz[name]
+
+                tables = {}
+                for t, table_meta in enumerate(meta['tables']):
+                    columns, units, categories = {}, {}, {}
+                    for c, (column, column_units) in enumerate(table_meta['columns']):
+                        prefix = 't%d_c%d' % (t, c)
+                        columns[column] = numpy.ma.MaskedArray(load_array(prefix), mask=npz[prefix + '_mask'])
+                        units[column] = column_units
+                        if prefix + '_categories' in npz.files:
+                            categories[column] = load_array(prefix + '_categories')
+                    tables[table_meta['name']] = ColumnTable(
+                        table_meta['name'], columns, units, table_meta['size'], categories)
+        except (KeyError, TypeError, ValueError, IOError, OSError, EOFError, zipfile.BadZipfile):
+            # Unreadable entry (ie corrupted or from an older format), rebuild it
+            _remove(path)
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return tables
+
+    def store(self, key, tables):
+        arrays, meta = {}, {'tables': [], 'objects': []}
+        for t, (name, table) in enumerate(sorted(tables.items())):
+            table_meta = {'name': name, 'size': table.size, 'columns': []}
+            for c, (column, values) in enumerate(sorted(table.columns.items())):
+                prefix = 't%d_c%d' % (t, c)
+                arrays[prefix] = numpy.ma.getdata(values)
+                arrays[prefix + '_mask'] = numpy.ma.getmaskarray(values)
+                # Enum codes are stored as is, with their category table
+                if column in table.categories:
+                    arrays[prefix + '_categories'] = table.categories[column]
+                table_meta['columns'].append((column, table.units.get(column)))
+            meta['tables'].append(table_meta)
+        for name, array in list(arrays.items()):
+            if array.dtype.kind == 'O':
+                try:
+                    encoded = _encode_objects(array)
+                except TypeError as e:
+                    # Not cacheable without pickling
+                    warnings.warn('Not caching %s: %s' % (key, e))
+                    return
+                arrays[name] = encoded
+                meta['objects'].append(name)
+        arrays['__meta__'] = numpy.frombuffer(json.dumps(meta).encode('utf-8'), dtype=numpy.uint8)
+
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez(f, **arrays)
+            _replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith('.npz'):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_size."""
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            _remove(path)
+            total_size -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            _remove(path)
@@ -0,0 +1,394 @@
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from fitparse.processors import UTC_REFERENCE
+
+# Python 2 compat
+try:
+    num_types = (int, float, long)
+except NameError:
+    num_types = (int, float)
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError('numpy is required for columnar output')
+
+
+class ColumnTable(object):
+    """The data messages of one type, as columns.
+
+    Columns are keyed by field name (as in DataMessage.get_values()) and are
+    numpy masked arrays with one entry per message, masked where a message
+    doesn't have the field or its value is invalid.
+
+    Enum columns are kept as small integer codes (their raw values) in
+    `columns`, with a table of the values they stand for, indexed by code, in
+    `categories` (see enum_categories()). They're only rendered into their
+    values when the column is asked for (ie table['event']).
+    """
+    __slots__ = ('name', 'columns', 'units', 'size', 'categories', '_rendered')
+
+    def __init__(self, name, columns, units, size, categories=None):
+        self.name = name
+        self.columns = columns
+        self.units = units
+        self.size = size
+        self.categories = categories or {}
+        self._rendered = {}
+
+    def __getitem__(self, column):
+        categories = self.categories.get(column)
+        if categories is None:
+            return self.columns[column]
+        rendered = self._rendered.get(column)
+        if rendered is None:
+            codes = self.columns[column]
+            rendered = self._rendered[column] = numpy.ma.MaskedArray(
+                categories[numpy.ma.getdata(codes)], mask=numpy.ma.getmaskarray(codes))
+        return rendered
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return self.size
+
+    def keys(self):
+        return self.columns.keys()
+
+    def slice(self, start, stop):
+        """Returns a ColumnTable of rows start to stop (exclusive)."""
+        columns = dict((name, values[start:stop]) for name, values in self.columns.items())
+        return ColumnTable(self.name, columns, self.units, len(range(self.size)[start:stop]), self.categories)
+
+    def items(self):
+        return [(column, self[column]) for column in self.columns]
+
+    def __repr__(self):
+        return '<ColumnTable: %s -- %d rows, columns: [%s]>' % (
+            self.name, self.size, ', '.join(self.columns),
+        )
+
+
+class _ColumnBuilder(object):
+    # Raw values of one column, collected row by row or as whole arrays (see
+    # add_chunk())
+    __slots__ = ('field', 'rows', 'raw_values', 'scaled', 'chunks')
+
+    def __init__(self, field):
+        self.field = field
+        self.rows = []
+        self.raw_values = []
+        # Component fields' raw values already have the component's
+        # scale and offset applied
+        self.scaled = []
+        self.chunks = []
+
+    def add_chunk(self, rows, values, valid, scaled):
+        # Adds arrays of rows, raw values (zero or None where invalid), valid
+        # flags and scaled flag (a bool or an array)
+        self._flush()
+        self.chunks.append((rows, values, valid, scaled))
+
+    def _flush(self):
+        # Turns the values collected row by row into a chunk
+        if not self.rows:
+            return
+        raw_values = self.raw_values
+        valid = numpy.array([v is not None for v in raw_values], dtype=bool)
+        if all(isinstance(v, num_types) or v is None for v in raw_values):
+            is_float = any(isinstance(v, float) for v in raw_values)
+            values = numpy.array(
+                [0 if v is None else v for v in raw_values],
+                dtype=numpy.float64 if is_float else numpy.int64,
+            )
+        else:
+            # Strings, byte arrays and multi-value fields
+            values = object_array(raw_values)
+        self.chunks.append((
+            numpy.array(self.rows, dtype=numpy.intp), values, valid,
+            numpy.array(self.scaled, dtype=bool),
+        ))
+        self.rows, self.raw_values, self.scaled = [], [], []
+
+    def build(self, size):
+        self._flush()
+        # Chunks without valid values (ie all None) don't decide the type
+        kinds = set(values.dtype.kind for _, values, valid, _ in self.chunks if valid.any())
+        if 'O' in kinds:
+            data = numpy.empty(size, dtype=object)
+        else:
+            data = numpy.zeros(size, dtype=numpy.float64 if 'f' in kinds else numpy.int64)
+        mask = numpy.ones(size, dtype=bool)
+        scaled = numpy.zeros(size, dtype=bool)
+        # In order, a later value of a row (ie a component of a later field)
+        # replaces an earlier one, even if it's None
+        for rows, values, valid, chunk_scaled in self.chunks:
+            if valid.any():
+                data[rows] = values
+            else:
+                data[rows] = None if data.dtype.kind == 'O' else 0
+            mask[rows] = ~valid
+            scaled[rows] = chunk_scaled
+
+        return self._apply_scale_offset(data, scaled), mask
+
+    def _apply_scale_offset(self, data, scaled):
+        field = self.field
+        if field is None or not (field.scale or field.offset):
+            return data
+
+        if data.dtype.kind == 'O':
+            # Multi-value fields, value by value
+            return object_array([
+                value if value_scaled else _scale_offset(field, value)
+                for value, value_scaled in zip(data.tolist(), scaled.tolist())
+            ])
+
+        data = data.astype(numpy.float64)
+        values = data
+        if field.scale:
+            values = values / field.scale
+        if field.offset:
+            values = values - field.offset
+        return numpy.where(scaled, data, values)
+
+
+def _scale_offset(field, value):
+    # FitFile._apply_scale_offset(), also of the values of tuples
+    if isinstance(value, tuple):
+        return tuple(_scale_offset(field, v) for v in value)
+    if isinstance(value, num_types):
+        if field.scale:
+            value = float(value) / field.scale
+        if field.offset:
+            value = value - field.offset
+    return value
+
+
+def _convert_objects(conversion, data):
+    # A UnitConversion of the numbers and tuples of numbers of an object
+    # column, as FieldData values (strings and the like are left as is)
+    return object_array([
+        conversion(value) if isinstance(value, num_types + (tuple,)) else value
+        for value in data.tolist()
+    ])
+
+
+def _time_into_day(seconds):
+    # process_type_localtime_into_day()
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    return datetime.time(h, m, s)
+
+
+def object_array(values):
+    # A 1-d object array, also of tuples (which numpy would otherwise turn
+    # into a 2-d array)
+    array = numpy.empty(len(values), dtype=object)
+    for n, value in enumerate(values):
+        array[n] = value
+    return array
+
+
+# Enum types with values up to this have category tables
+MAX_CATEGORY_CODE = 0xFFFF
+
+# (category table, whether each code is a value of the type) by FieldType,
+# see enum_categories()
+_category_tables = {}
+
+
+def _category_table(field_type):
+    try:
+        return _category_tables[field_type]
+    except KeyError:
+        pass
+
+    table = known = None
+    values = field_type.values
+    if values and max(values) <= MAX_CATEGORY_CODE:
+        codes = range(max(values) + 1)
+        table = object_array([values.get(n, n) for n in codes])
+        known = numpy.array([n in values for n in codes], dtype=bool)
+        table.flags.writeable = known.flags.writeable = False
+    return _category_tables.setdefault(field_type, (table, known))
+
+
+def enum_categories(field_type):
+    """Returns an object array of the values of an enum FieldType indexed by
+    raw value (raw values missing from the profile stand for themselves, as
+    in Field.render()), or None for other types and enums with values above
+    MAX_CATEGORY_CODE. Built once per type and shared by all columns.
+    """
+    return _category_table(field_type)[0]
+
+
+def _categorize(field_type, data, mask):
+    # Enum raw values as codes into the type's category table, or None unless
+    # they're all values of the type (ie bit fields, like message_index)
+    table, known = _category_table(field_type)
+    if table is None:
+        return None
+    valid = data[~mask]
+    if len(valid) and (valid.min() < 0 or valid.max() >= len(table) or not known[valid].all()):
+        return None
+    return data.astype(numpy.uint8 if len(table) <= 0x100 else numpy.uint16), table
+
+
+def _render(field, data, mask, processor):
+    # Vectorized equivalent of Field.render() and the built-in type
+    # processors. Returns the rendered data, its units and its categories
+    # (for enum codes).
+    field_type = field.type
+    if data.dtype.kind not in 'iu':
+        return data, field.units, None
+
+    if field_type.name == 'localtime_into_day':
+        return object_array([
+            None if masked else _time_into_day(value) for value, masked in zip(data.tolist(), mask.tolist())
+        ]), None, None
+
+    if field_type.name in ('date_time', 'local_date_time'):
+        # date_time values below 0x10000000 are relative (ie seconds since
+        # device power on), so like process_type_date_time() leave those as is
+        if field_type.name == 'date_time' and numpy.any((data < 0x10000000) & ~mask):
+            return data, field.units, None
+        epoch = data.astype(numpy.int64) + UTC_REFERENCE
+        if processor.epoch_timestamps:
+            return epoch, None, None
+        return epoch.astype('datetime64[s]'), None, None
+
+    if field_type.values:
+        categorized = _categorize(field_type, data, mask)
+        if categorized is not None:
+            codes, categories = categorized
+            return codes, field.units, categories
+        values = field_type.values
+        return object_array([values.get(v, v) for v in data.tolist()]), field.units, None
+
+    if field_type.name == 'bool':
+        return data.astype(bool), field.units, None
+
+    return data, field.units, None
+
+
+class _TableBuilder(object):
+    # Raw values of the data messages of one type, collected per column
+    __slots__ = ('name', 'size', 'builders')
+
+    def __init__(self, name):
+        self.name = name
+        self.size = 0
+        self.builders = {}
+
+    def add_rows(self, count):
+        # Returns the row numbers of count new messages
+        start = self.size
+        self.size += count
+        return numpy.arange(start, self.size, dtype=numpy.intp)
+
+    def add_column(self, field_name, field, rows, values, valid, scaled):
+        builder = self.builders.get(field_name)
+        if builder is None:
+            builder = self.builders[field_name] = _ColumnBuilder(field)
+        builder.add_chunk(rows, values, valid, scaled)
+
+    def add_message(self, message):
+        row = self.size
+        self.size += 1
+        builders = self.builders
+        for field_data in message.fields:
+            field_name = field_data.name
+            builder = builders.get(field_name)
+            if builder is None:
+                builder = builders[field_name] = _ColumnBuilder(field_data.field)
+            builder.rows.append(row)
+            builder.raw_values.append(field_data.raw_value)
+            builder.scaled.append(field_data.field_def is None)
+
+    def build(self, processor):
+        columns, units, categories = {}, {}, {}
+        for field_name, builder in self.builders.items():
+            data, mask = builder.build(self.size)
+            field = builder.field
+            field_units = field_categories = None
+            if field is not None:
+                data, field_units, field_categories = _render(field, data, mask, processor)
+
+            if field_categories is not None:
+                categories[field_name] = field_categories
+            else:
+                conversion = processor.get_conversion(field_name, field_units)
+                if conversion is not None and data.dtype.kind in 'iufO':
+                    if data.dtype.kind == 'O':
+                        data = _convert_objects(conversion, data)
+                    else:
+                        data = conversion(data.astype(numpy.float64))
+                    field_units = conversion.units or field_units
+
+            columns[field_name] = numpy.ma.MaskedArray(data, mask=mask)
+            units[field_name] = field_units
+
+        return ColumnTable(self.name, columns, units, self.size, categories)
+
+
+def build_columns(name, messages, processor):
+    """Builds a ColumnTable from DataMessages, using their raw values.
+
+    Scale/offset and the processor's declarative conversions (see
+    FitFileDataProcessor.get_conversion) are applied per column as array
+    operations (value by value to the tuples of multi-value fields), enums
+    are kept as codes into shared category tables. date_time fields become
+    datetime64[s] arrays (or POSIX timestamps if the processor's
+    epoch_timestamps is set), localtime_into_day fields datetime.time
+    objects. Other process_* methods of the processor aren't applied.
+    """
+    require_numpy()
+
+    table = _TableBuilder(name)
+    for message in messages:
+        table.add_message(message)
+    return table.build(processor)
+
+
+def build_tables(messages, processor):
+    """Like build_columns(), but builds a ColumnTable for each message type
+    in a single pass. Returns a dict of message names to ColumnTables.
+    """
+    require_numpy()
+
+    tables = {}
+    for message in messages:
+        table = tables.get(message.name)
+        if table is None:
+            table = tables[message.name] = _TableBuilder(message.name)
+        table.add_message(message)
+    return dict((name, table.build(processor)) for name, table in tables.items())
+
+
+def build_chunks(messages, processor, chunk_size):
+    """Builds ColumnTables of consecutive data messages of the same type, of
+    up to about `chunk_size` rows, in message order. Yields them as they're
+    complete.
+    """
+    require_numpy()
+
+    table = None
+    for message in messages:
+        if table is not None and (table.name != message.name or table.size >= chunk_size):
+            yield table.build(processor)
+            table = None
+        if table is None:
+            table = _TableBuilder(message.name)
+        table.add_message(message)
+    if table is not None:
+        yield table.build(processor)
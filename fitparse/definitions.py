@@ -0,0 +1,331 @@
+import collections
+import struct
+import threading
+
+from fitparse.profile import FIELD_TYPE_TIMESTAMP, MESSAGE_TYPES
+from fitparse.records import BASE_TYPES, BASE_TYPE_BYTE, FieldDefinition, RecordBase
+from fitparse.utils import FitParseError
+
+
+# Number of compiled definitions kept, least recently used ones are dropped
+DEFINITION_CACHE_SIZE = 1024
+
+# Plan of fields without subfields or components (ie developer fields)
+NO_FIELD_PLAN = ((), {})
+
+# Data messages that define developer fields
+DEV_DATA_MESSAGES = ('developer_data_id', 'field_description')
+
+
+class CompiledDefinition(RecordBase):
+    """The parts of a definition message that only depend on its bytes:
+    message type and field definitions, the components to accumulate, a
+    decoder for the raw values of its data messages and plans to resolve
+    their subfields and components. `size` is the size of those fields and
+    `timestamp` the (offset, struct, parse) of the timestamp field, to skip
+    data messages without decoding them. `data` are the definition bytes.
+
+    They are immutable and shared by all definition messages with the same
+    bytes (see get_definition()), within and across files and threads.
+    """
+    __slots__ = (
+        'endian', 'mesg_num', 'mesg_type', 'field_defs', 'accumulated',
+        'struct', 'decoders', 'field_plans', 'size', 'timestamp', 'data',
+    )
+
+    def decode(self, data):
+        """Returns the raw values of the field definitions in data (the
+        fields of a data message, without developer fields), as
+        FitFile._parse_raw_values_from_data_message() reads them.
+        """
+        return _unpack(self.struct, self.decoders, data)
+
+    def __reduce__(self):
+        # Compiled again (or taken from the cache) when unpickled
+        return get_definition, (self.data,)
+
+    def __repr__(self):
+        return '<CompiledDefinition: %s (#%d) -- field defs: [%s]>' % (
+            self.mesg_type.name if self.mesg_type else 'unknown', self.mesg_num,
+            ', '.join([fd.name for fd in self.field_defs]),
+        )
+
+
+class FieldProjection(RecordBase):
+    """The fields of a data message (with developer fields) to decode for
+    a set of field names (see project_definition()): a decoder skipping the
+    bytes of the others, and those fields' definitions and plans.
+    """
+    __slots__ = ('struct', 'decoders', 'field_defs', 'field_plans')
+
+    def decode(self, data):
+        """Returns the raw values of `field_defs` in data (all the fields of
+        a data message).
+        """
+        return _unpack(self.struct, self.decoders, data)
+
+    def __repr__(self):
+        return '<FieldProjection: [%s]>' % ', '.join([fd.name for fd in self.field_defs])
+
+
+def _unpack(compiled_struct, decoders, data):
+    values = compiled_struct.unpack(data)
+    raw_values = []
+    for start, stop, kind, parse in decoders:
+        if kind == 'byte':
+            # A tuple treated as a single value
+            raw_values.append(parse(values[start:stop]))
+        elif kind == 'array':
+            raw_values.append(tuple(parse(value) for value in values[start:stop]))
+        else:
+            raw_values.append(parse(values[start]))
+    return raw_values
+
+
+def is_skippable(def_mesg):
+    """Whether the data messages of a DefinitionMessage can be skipped
+    without parsing them, keeping track of the compressed timestamp and of
+    accumulated components (see FitFile._skip_data_message()). Messages
+    defining developer fields can't.
+    """
+    compiled = def_mesg.compiled
+    return def_mesg.name not in DEV_DATA_MESSAGES and not (compiled.accumulated and compiled.struct is None)
+
+
+def resolve_subfield(field, subfields, raw_values):
+    """Resolves a field into (field, parent), ie (subfield, field) or (field,
+    None), using its subfield plan (see compile_definition()).
+    """
+    for sub_field, refs in subfields:
+        for index, raw_value in refs:
+            if raw_values[index] == raw_value:
+                return sub_field, field
+    return field, None
+
+
+def _subfield_plan(field, field_defs):
+    # (subfield, ((index of reference field def, raw value), ...)) tuples.
+    # The first subfield with a reference field def of that raw value wins.
+    if field is None or not field.subfields:
+        return ()
+    return tuple(
+        (sub_field, tuple(
+            (index, ref_field.raw_value)
+            for ref_field in sub_field.ref_fields
+            for index, field_def in enumerate(field_defs)
+            if field_def.def_num == ref_field.def_num
+        ))
+        for sub_field in field.subfields
+    )
+
+
+def _decoders(endian, field_defs, keep=None):
+    # A struct for all fields and (start, stop, kind, parse) tuples to get
+    # each field's raw value from the unpacked values. None if a field can't
+    # be read (zero size). Only the fields whose index is in keep (if given)
+    # are unpacked, the bytes of the others are skipped.
+    fmt = [endian]
+    decoders = []
+    position = 0
+    for n, field_def in enumerate(field_defs):
+        if keep is not None and n not in keep:
+            fmt.append('%dx' % field_def.size)
+            continue
+        base_type = field_def.base_type
+        count = field_def.size // base_type.size
+        if not count:
+            return None, None
+        fmt.append('%d%s' % (count, base_type.fmt))
+        if base_type.fmt == 's':
+            kind, size = 'value', 1
+        elif base_type.name == 'byte':
+            kind, size = 'byte', count
+        else:
+            kind, size = 'array' if count > 1 else 'value', count
+        decoders.append((position, position + size, kind, base_type.parse))
+        position += size
+    return struct.Struct(''.join(fmt)), tuple(decoders)
+
+
+def _timestamp(endian, field_defs):
+    # (offset, struct, parse) of a single value timestamp field, for the
+    # compressed timestamp accumulator
+    offset = 0
+    for field_def in field_defs:
+        base_type = field_def.base_type
+        if field_def.def_num == FIELD_TYPE_TIMESTAMP.def_num and field_def.size == base_type.size:
+            return offset, struct.Struct(endian + base_type.fmt), base_type.parse
+        offset += field_def.size
+    return None
+
+
+def compile_definition(data):
+    """Compiles the bytes of a definition message following its header:
+    architecture, global message number, number of fields and the field
+    definitions (without the reserved byte and developer fields).
+    """
+    endian = '>' if data[0:1] != b'\x00' else '<'
+    global_mesg_num, num_fields = struct.unpack(endian + 'HB', data[1:4])
+    mesg_type = MESSAGE_TYPES.get(global_mesg_num)
+    field_defs = []
+    accumulated = []
+
+    for n in range(num_fields):
+        field_def_num, field_size, base_type_num = struct.unpack('3B', data[4 + n * 3:7 + n * 3])
+        # Try to get field from message type (None if unknown)
+        field = mesg_type.fields.get(field_def_num) if mesg_type else None
+        base_type = BASE_TYPES.get(base_type_num, BASE_TYPE_BYTE)
+
+        if (field_size % base_type.size) != 0:
+            # NOTE: we could fall back to byte encoding if there's any
+            # examples in the wild. For now, just throw an exception
+            raise FitParseError("Invalid field size %d for type '%s' (expected a multiple of %d)" % (
+                field_size, base_type.name, base_type.size))
+
+        # Components that are accumulators start their accumulation at 0
+        if field and field.components:
+            for component in field.components:
+                if component.accumulate:
+                    accumulated.append(component.def_num)
+
+        field_defs.append(FieldDefinition(
+            field=field,
+            def_num=field_def_num,
+            base_type=base_type,
+            size=field_size,
+        ))
+
+    # Per field def: its subfield plan, and for the field and each of its
+    # subfields (component, component's field, subfield plan of that field)
+    # tuples
+    field_plans = []
+    for field_def in field_defs:
+        field = field_def.field
+        components = {}
+        for resolved in ((field,) + tuple(field.subfields or ())) if field else ():
+            components[resolved] = tuple(
+                (component, mesg_type.fields[component.def_num],
+                 _subfield_plan(mesg_type.fields[component.def_num], field_defs))
+                for component in resolved.components or ()
+            )
+        field_plans.append((_subfield_plan(field, field_defs), components))
+
+    compiled_struct, decoders = _decoders(endian, field_defs)
+    return CompiledDefinition(
+        endian=endian,
+        mesg_num=global_mesg_num,
+        mesg_type=mesg_type,
+        field_defs=field_defs,
+        accumulated=tuple(accumulated),
+        struct=compiled_struct,
+        decoders=decoders,
+        field_plans=tuple(field_plans),
+        size=sum(field_def.size for field_def in field_defs),
+        timestamp=_timestamp(endian, field_defs),
+        data=data,
+    )
+
+
+def is_selected(field, parent_field, fields):
+    """Whether a field (resolved, see resolve_subfield()) or the field
+    definition of an unknown field is named in a set of field names, itself
+    or by its parent field.
+    """
+    return field.name in fields or (parent_field is not None and parent_field.name in fields)
+
+
+def _plan_refs(subfields):
+    # Indexes of the reference fields of a subfield plan
+    return set(index for _, refs in subfields for index, _ in refs)
+
+
+def _remap_plan(subfields, positions):
+    return tuple(
+        (sub_field, tuple((positions[index], raw_value) for index, raw_value in refs))
+        for sub_field, refs in subfields
+    )
+
+
+def project_definition(def_mesg, fields):
+    """Returns the FieldProjection of a DefinitionMessage for a set of field
+    names (as in DataMessage.get_values(), or of parent fields of subfields),
+    or None if its data messages have to be decoded completely.
+
+    Fields are kept if they're named in `fields`, or if a subfield or a
+    component of theirs is, as are the reference fields of their subfields,
+    the timestamp (for compressed timestamps) and developer fields (which
+    can stand in for native fields, see fitparse.base.adjust_message()).
+    Messages defining developer fields aren't projected.
+    """
+    if def_mesg.name in DEV_DATA_MESSAGES:
+        return None
+    compiled = def_mesg.compiled
+    field_defs = compiled.field_defs + def_mesg.dev_field_defs
+    field_plans = compiled.field_plans + (NO_FIELD_PLAN,) * len(def_mesg.dev_field_defs)
+
+    keep = set()
+    for n, (field_def, (subfields, components)) in enumerate(zip(field_defs, field_plans)):
+        names = set([field_def.name])
+        for sub_field, _ in subfields:
+            names.add(sub_field.name)
+        for resolved_components in components.values():
+            for _, cmp_field, cmp_subfields in resolved_components:
+                names.add(cmp_field.name)
+                names.update(sub_field.name for sub_field, _ in cmp_subfields)
+        if n >= len(compiled.field_defs) or names & fields or field_def.def_num == FIELD_TYPE_TIMESTAMP.def_num:
+            keep.add(n)
+
+    # Reference fields of the subfields of kept fields and their components
+    for n in list(keep):
+        subfields, components = field_plans[n]
+        keep.update(_plan_refs(subfields))
+        for resolved_components in components.values():
+            for _, _, cmp_subfields in resolved_components:
+                keep.update(_plan_refs(cmp_subfields))
+
+    projected_struct, decoders = _decoders(compiled.endian, field_defs, keep)
+    if projected_struct is None:
+        return None
+
+    kept = sorted(keep)
+    positions = dict((n, position) for position, n in enumerate(kept))
+    return FieldProjection(
+        struct=projected_struct,
+        decoders=decoders,
+        field_defs=[field_defs[n] for n in kept],
+        field_plans=tuple(
+            (_remap_plan(field_plans[n][0], positions), dict(
+                (resolved, tuple(
+                    (component, cmp_field, _remap_plan(cmp_subfields, positions))
+                    for component, cmp_field, cmp_subfields in resolved_components
+                ))
+                for resolved, resolved_components in field_plans[n][1].items()
+            ))
+            for n in kept
+        ),
+    )
+
+
+# Compiled definitions by definition bytes, shared process-wide
+_definitions = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def get_definition(data):
+    """Returns the CompiledDefinition of definition message bytes (see
+    compile_definition()), compiling them only if they're not in the cache
+    of the DEFINITION_CACHE_SIZE most recently used ones.
+    """
+    with _lock:
+        definition = _definitions.pop(data, None)
+        if definition is not None:
+            _definitions[data] = definition
+            return definition
+
+    definition = compile_definition(data)
+    with _lock:
+        # Another thread may have compiled the same bytes meanwhile
+        definition = _definitions.setdefault(data, definition)
+        while len(_definitions) > DEFINITION_CACHE_SIZE:
+            _definitions.popitem(last=False)
+    return definition
@@ -0,0 +1,413 @@
+import csv
+import datetime
+import io
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from fitparse.base import FitFile
+from fitparse.processors import StandardUnitsDataProcessor
+from fitparse.profile import FIELD_TYPE_TIMESTAMP
+from fitparse.utils import FitParseError
+
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+def column_name(field_data):
+    # Subfields are written to their parent field's column, so the columns of
+    # a table don't depend on the values of reference fields
+    if field_data.parent_field is not None:
+        return field_data.parent_field.name
+    return field_data.name
+
+
+def definition_columns(def_mesg):
+    """Returns the column names a definition message's data messages can fill.
+
+    Component fields are expanded into their destination fields, and
+    message types with a timestamp get a timestamp column (compressed
+    timestamp headers can add one that isn't part of the definition).
+    """
+    columns = []
+    mesg_type = def_mesg.mesg_type
+
+    for field_def in def_mesg.field_defs:
+        columns.append(field_def.name)
+        field = field_def.field
+        if field is None:
+            continue
+        components = list(field.components or ())
+        for sub_field in field.subfields or ():
+            components.extend(sub_field.components or ())
+        for component in components:
+            columns.append(mesg_type.fields[component.def_num].name)
+
+    columns.extend(field_def.name for field_def in def_mesg.dev_field_defs)
+
+    if mesg_type and FIELD_TYPE_TIMESTAMP.def_num in mesg_type.fields:
+        columns.append(FIELD_TYPE_TIMESTAMP.name)
+
+    # Drop duplicates, keeping definition order
+    seen = set()
+    return [c for c in columns if not (c in seen or seen.add(c))]
+
+
+class SchemaChanged(Exception):
+    """Raised by a table writer when a batch doesn't fit its schema."""
+
+
+class TableWriter(object):
+    # Writes batches of rows (lists in column order) to one table file
+    extension = None
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CSVTableWriter(TableWriter):
+    extension = '.csv'
+    dialect = 'excel'
+    encoding = 'utf-8'
+
+    def __init__(self, path, columns):
+        super(CSVTableWriter, self).__init__(path, columns)
+        self._fp = io.open(path, 'w', newline='', encoding=self.encoding)
+        self._writer = csv.writer(self._fp, dialect=self.dialect)
+        self._writer.writerow(columns)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._fp.close()
+
+
+class ExcelTableWriter(CSVTableWriter):
+    # A byte order mark makes Excel detect UTF-8 encoded CSV files
+    encoding = 'utf-8-sig'
+
+
+class ParquetTableWriter(TableWriter):
+    extension = '.parquet'
+
+    def __init__(self, path, columns):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required to write Parquet files')
+        super(ParquetTableWriter, self).__init__(path, columns)
+        self._writer = None
+
+    @staticmethod
+    def _infer_array(values):
+        try:
+            array = pyarrow.array(values)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError):
+            # Mixed types, ie an enum value missing from the profile
+            array = None
+        if array is None or pyarrow.types.is_null(array.type):
+            array = pyarrow.array([None if v is None else str(v) for v in values], type=pyarrow.string())
+        return array
+
+    def write_rows(self, rows):
+        columns = list(zip(*rows))
+
+        if self._writer is None:
+            table = pyarrow.Table.from_arrays(
+                [self._infer_array(list(values)) for values in columns], names=self.columns)
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        else:
+            arrays = []
+            for values, field in zip(columns, self._writer.schema):
+                if pyarrow.types.is_string(field.type):
+                    values = [None if v is None else str(v) for v in values]
+                try:
+                    arrays.append(pyarrow.array(values, type=field.type))
+                except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError):
+                    raise SchemaChanged(field.name)
+            table = pyarrow.Table.from_arrays(arrays, schema=self._writer.schema)
+
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+WRITER_CLASSES = {
+    'csv': CSVTableWriter,
+    'excel': ExcelTableWriter,
+    'parquet': ParquetTableWriter,
+}
+
+
+class _Table(object):
+    # Rows of one message type, buffered and written in batches. When a new
+    # definition adds columns (or a batch doesn't fit the schema) the current
+    # part is closed and the table continues in a new part file.
+
+    def __init__(self, exporter, name):
+        self.exporter = exporter
+        self.name = name
+        self.columns = []
+        self.index = {}
+        self.rows = []
+        self.parts = 0
+        self.writer = None
+
+    def add_columns(self, columns):
+        new_columns = [c for c in columns if c not in self.index]
+        if not new_columns:
+            return
+        self.flush()
+        self.close()
+        self.columns = self.columns + new_columns
+        self.index = dict((c, n) for n, c in enumerate(self.columns))
+
+    def add_message(self, message):
+        index = self.index
+        row = [None] * len(index)
+        for field_data in message.fields:
+            column = column_name(field_data)
+            n = index.get(column)
+            if n is None:
+                self.add_columns([column])
+                return self.add_message(message)
+            if field_data.value is not None or row[n] is None:
+                row[n] = field_data.value
+        self.rows.append(row)
+        if len(self.rows) >= self.exporter.batch_size:
+            self.flush()
+
+    def _open_writer(self):
+        self.parts += 1
+        filename = self.name if self.parts == 1 else '%s-%d' % (self.name, self.parts)
+        writer_class = self.exporter.writer_class
+        path = os.path.join(self.exporter.out_dir, filename + writer_class.extension)
+        self.writer = writer_class(path, list(self.columns))
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            self._open_writer()
+        try:
+            self.writer.write_rows(self.rows)
+        except SchemaChanged:
+            self.close()
+            self._open_writer()
+            self.writer.write_rows(self.rows)
+        self.rows = []
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class TableExporter(object):
+    """Streams the data messages of a FitFile into one table per message type.
+
+    Columns are fixed from the definition messages as they're read and rows
+    are written in batches of `batch_size`, so memory use doesn't depend on the
+    size of the file.
+    """
+
+    def __init__(self, out_dir, writer_class=CSVTableWriter, batch_size=DEFAULT_BATCH_SIZE):
+        self.out_dir = out_dir
+        self.writer_class = writer_class
+        self.batch_size = batch_size
+
+    def export(self, fitfile, name=None):
+        if not os.path.isdir(self.out_dir):
+            os.makedirs(self.out_dir)
+
+        tables = {}
+        try:
+            for message in fitfile.get_messages(name=name, with_definitions=True):
+                table = tables.get(message.name)
+                if table is None:
+                    table = tables[message.name] = _Table(self, message.name)
+                if message.type == 'definition':
+                    table.add_columns(definition_columns(message))
+                else:
+                    table.add_message(message)
+            for table in tables.values():
+                table.flush()
+        finally:
+            for table in tables.values():
+                table.close()
+
+        return sorted(name for name, table in tables.items() if table.parts)
+
+
+def _encode_str(value):
+    return json.encoder.encode_basestring_ascii(value)
+
+
+def _encode_tuple(value):
+    return '[%s]' % ','.join(_encode_value(v) for v in value)
+
+
+def _encode_float(value):
+    # NaN and infinities aren't valid JSON
+    return float.__repr__(value) if value - value == 0 else 'null'
+
+
+def _encode_isoformat(value):
+    return '"%s"' % value.isoformat()
+
+
+_VALUE_ENCODERS = {
+    type(None): lambda value: 'null',
+    bool: lambda value: 'true' if value else 'false',
+    int: int.__repr__,
+    float: _encode_float,
+    str: _encode_str,
+    tuple: _encode_tuple,
+    datetime.datetime: _encode_isoformat,
+    datetime.date: _encode_isoformat,
+    datetime.time: _encode_isoformat,
+}
+try:
+    _VALUE_ENCODERS[long] = long.__str__  # Python 2 compat
+    _VALUE_ENCODERS[unicode] = _encode_str
+except NameError:
+    pass
+
+
+def _encode_value(value):
+    encoder = _VALUE_ENCODERS.get(type(value))
+    if encoder is None:
+        return _encode_str(str(value))
+    return encoder(value)
+
+
+class NDJSONWriter(object):
+    """Writes data messages as newline delimited JSON, one message per line::
+
+        {"name":"record","fields":{"heart_rate":140,"speed":8.43}}
+
+    Fields with invalid (None) values are left out, NaN and infinite values
+    are written as null. If `units` is set, the units of the written fields
+    are added as a "units" object. Key strings are encoded once per
+    definition and field name and values are encoded directly (datetimes as
+    ISO 8601 strings), bypassing json.dumps.
+    """
+
+    def __init__(self, fp, units=False):
+        self.fp = fp
+        self.units = units
+        self._prefixes = {}
+        self._keys = {}
+
+    def _prefix(self, def_mesg):
+        prefix = self._prefixes[def_mesg] = '{"name":%s,"fields":{' % _encode_str(def_mesg.name)
+        return prefix
+
+    def _key(self, name):
+        key = self._keys[name] = '%s:' % _encode_str(str(name))
+        return key
+
+    def encode(self, message):
+        keys = self._keys
+        fields, units = [], []
+        for field_data in message.fields:
+            value = field_data.value
+            if value is None:
+                continue
+            name = field_data.name
+            key = keys.get(name) or self._key(name)
+            encoder = _VALUE_ENCODERS.get(type(value))
+            fields.append(key + (encoder(value) if encoder else _encode_value(value)))
+            if self.units and field_data.units:
+                units.append(key + _encode_str(field_data.units))
+
+        prefix = self._prefixes.get(message.def_mesg) or self._prefix(message.def_mesg)
+        if self.units:
+            return '%s%s},"units":{%s}}' % (prefix, ','.join(fields), ','.join(units))
+        return '%s%s}}' % (prefix, ','.join(fields))
+
+    def write(self, messages):
+        write = self.fp.write
+        count = 0
+        for message in messages:
+            if message.type == 'data':
+                write(self.encode(message) + '\n')
+                count += 1
+        return count
+
+
+def write_ndjson(fitfile, fp, name=None, units=False):
+    """Writes the data messages of `fitfile` (optionally filtered by `name`)
+    to the text file object `fp` as NDJSON. Returns the number of messages
+    written.
+    """
+    return NDJSONWriter(fp, units=units).write(fitfile.get_messages(name=name))
+
+
+def _export_file(args):
+    path, out_dir, file_type, name, check_crc = args
+    exporter = TableExporter(out_dir, writer_class=WRITER_CLASSES[file_type])
+    try:
+        with FitFile(path, check_crc=check_crc, data_processor=StandardUnitsDataProcessor()) as fitfile:
+            return path, exporter.export(fitfile, name=name), None
+    except FitParseError as e:
+        # One bad file shouldn't abort exporting a whole directory
+        return path, None, e
+
+
+def _out_dirs(paths, out_dir, root=None):
+    # An output directory per path, named by the path relative to root (or
+    # its basename) without extension, numbered if names still collide
+    dirs, seen = [], set()
+    for path in paths:
+        name = os.path.relpath(path, root) if root is not None else os.path.basename(path)
+        name = os.path.splitext(name)[0]
+        unique, n = name, 1
+        while os.path.normcase(unique) in seen:
+            n += 1
+            unique = '%s-%d' % (name, n)
+        seen.add(os.path.normcase(unique))
+        dirs.append(os.path.join(out_dir, unique))
+    return dirs
+
+
+def export_files(paths, out_dir, file_type='csv', name=None, check_crc=True, processes=None, root=None):
+    """Exports each .FIT file in `paths` to its own directory below `out_dir`,
+    named by the file's path relative to `root` (or its basename).
+
+    Files are fanned out across a pool of `processes` worker processes (the
+    number of CPUs by default). Yields (path, exported message names, error)
+    tuples in completion order, where error is the FitParseError raised for
+    files that couldn't be parsed (tables exported before it are kept).
+    """
+    import multiprocessing
+
+    jobs = [
+        (path, path_out_dir, file_type, name, check_crc)
+        for path, path_out_dir in zip(paths, _out_dirs(paths, out_dir, root))
+    ]
+    if processes == 1:
+        for job in jobs:
+            yield _export_file(job)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_export_file, jobs):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,355 @@
+import datetime
+import math
+import operator
+
+from fitparse.profile import FIELD_TYPE_TIMESTAMP
+
+
+# Seconds of date_time fields count from this (naive, UTC) datetime
+FIT_EPOCH = datetime.datetime(1989, 12, 31)
+
+# Messages whose native fields fitparse.base.adjust_message() may replace
+# with developer fields (session, lap and record)
+_ADJUSTED_MESGS = (18, 19, 20)
+
+_OPERATORS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+
+def _fit_seconds(value):
+    # datetimes (naive ones are UTC, like the ones FitFile returns) are
+    # compared as the seconds of date_time fields
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            value = value.replace(tzinfo=None) - value.utcoffset()
+        delta = value - FIT_EPOCH
+        return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+    return value
+
+
+def _scale_offset(field, value):
+    # FitFile._apply_scale_offset() of a single value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if field.scale:
+            value = float(value) / field.scale
+        if field.offset:
+            value = value - field.offset
+    return value
+
+
+def field_value(field_data):
+    """The value of a FieldData that predicates compare: rendered from its
+    raw value with the scale and offset of its field (enums as names), but
+    without the data processor (date_time fields are seconds).
+    """
+    field, raw_value = field_data.field, field_data.raw_value
+    if field is None or raw_value is None:
+        return raw_value
+    value = field.render(raw_value)
+    if field_data.field_def is not None:
+        # Components and compressed timestamps are scaled already
+        value = _scale_offset(field, value)
+    return value
+
+
+class Predicate(object):
+    """A filter of data messages on their field values, see field().
+    Predicates combine with ``&``, ``|`` and ``~``.
+
+    `compile()` turns it into a test of the raw values of a definition
+    message's data messages, so messages can be rejected before they're
+    decoded, and `matches()` tests a DataMessage.
+    """
+    __slots__ = ()
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    @property
+    def names(self):
+        """The set of field names the predicate compares."""
+        raise NotImplementedError
+
+    def matches(self, fields):
+        """Whether a DataMessage (or a list of its FieldData) matches."""
+        raise NotImplementedError
+
+    def compile(self, def_mesg, field_defs, field_plans):
+        """Returns a test(raw_values, timestamp) of the raw values of the
+        data messages of a DefinitionMessage decoding `field_defs` (with
+        their plans, see fitparse.definitions), and the compressed timestamp
+        of the message's header (or None). Returns None if the predicate
+        has to be tested on the decoded message instead (see matches()).
+        """
+        raise NotImplementedError
+
+
+class Comparison(Predicate):
+    """Compares the value of a field (see field_value()) with a constant.
+    Messages without a valid value of the field don't match.
+    """
+    __slots__ = ('name', 'op', 'value')
+
+    def __init__(self, name, op, value):
+        if op not in _OPERATORS:
+            raise ValueError('Unknown comparison operator: %r' % (op,))
+        self.name = name
+        self.op = op
+        self.value = value
+
+    @property
+    def names(self):
+        return frozenset([self.name])
+
+    def matches(self, fields):
+        compare, value = _OPERATORS[self.op], _fit_seconds(self.value)
+        for field_data in fields:
+            if field_data.is_named(self.name) or field_data.name == self.name:
+                return _test_value(compare, value)(field_value(field_data))
+        return False
+
+    def compile(self, def_mesg, field_defs, field_plans):
+        name = self.name
+        if not isinstance(name, str) or (def_mesg.dev_field_defs and def_mesg.mesg_num in _ADJUSTED_MESGS):
+            return None
+
+        # The field definitions a field of that name would be decoded from,
+        # as a field, a subfield or a component
+        sources = []
+        for n, (field_def, (subfields, components)) in enumerate(zip(field_defs, field_plans)):
+            if field_def.name == name:
+                sources.append(n)
+            elif any(sub_field.name == name for sub_field, _ in subfields):
+                return None
+            for resolved_components in components.values():
+                for _, cmp_field, cmp_subfields in resolved_components:
+                    if cmp_field.name == name or any(sub_field.name == name for sub_field, _ in cmp_subfields):
+                        return None
+
+        compare, value = _OPERATORS[self.op], _fit_seconds(self.value)
+        if not sources:
+            if name == FIELD_TYPE_TIMESTAMP.name:
+                # The compressed timestamp of the header, if any
+                test = _test_value(compare, value)
+                return lambda raw_values, timestamp: test(timestamp)
+            return lambda raw_values, timestamp: False
+        if len(sources) > 1:
+            return None
+
+        n = sources[0]
+        field_def = field_defs[n]
+        base_type = field_def.base_type
+        if base_type.fmt != 's' and (base_type.name == 'byte' or field_def.size != base_type.size):
+            # Arrays
+            return None
+        field = field_def.field
+        if field is not None and field.subfields:
+            # Its subfields are rendered differently
+            return None
+
+        test = _raw_test(field, base_type, compare, value)
+        return lambda raw_values, timestamp: test(raw_values[n])
+
+    def __repr__(self):
+        return 'field(%r) %s %r' % (self.name, self.op, self.value)
+
+
+class And(Predicate):
+    __slots__ = ('predicates',)
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    @property
+    def names(self):
+        return frozenset().union(*[predicate.names for predicate in self.predicates])
+
+    def matches(self, fields):
+        return all(predicate.matches(fields) for predicate in self.predicates)
+
+    def compile(self, def_mesg, field_defs, field_plans):
+        tests = _compile_all(self.predicates, def_mesg, field_defs, field_plans)
+        if tests is None:
+            return None
+        return lambda raw_values, timestamp: all(test(raw_values, timestamp) for test in tests)
+
+    def __repr__(self):
+        return '(%s)' % ' & '.join(repr(predicate) for predicate in self.predicates)
+
+
+class Or(Predicate):
+    __slots__ = ('predicates',)
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    @property
+    def names(self):
+        return frozenset().union(*[predicate.names for predicate in self.predicates])
+
+    def matches(self, fields):
+        return any(predicate.matches(fields) for predicate in self.predicates)
+
+    def compile(self, def_mesg, field_defs, field_plans):
+        tests = _compile_all(self.predicates, def_mesg, field_defs, field_plans)
+        if tests is None:
+            return None
+        return lambda raw_values, timestamp: any(test(raw_values, timestamp) for test in tests)
+
+    def __repr__(self):
+        return '(%s)' % ' | '.join(repr(predicate) for predicate in self.predicates)
+
+
+class Not(Predicate):
+    __slots__ = ('predicate',)
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    @property
+    def names(self):
+        return self.predicate.names
+
+    def matches(self, fields):
+        return not self.predicate.matches(fields)
+
+    def compile(self, def_mesg, field_defs, field_plans):
+        test = self.predicate.compile(def_mesg, field_defs, field_plans)
+        if test is None:
+            return None
+        return lambda raw_values, timestamp: not test(raw_values, timestamp)
+
+    def __repr__(self):
+        return '~%r' % (self.predicate,)
+
+
+def _compile_all(predicates, def_mesg, field_defs, field_plans):
+    tests = []
+    for predicate in predicates:
+        test = predicate.compile(def_mesg, field_defs, field_plans)
+        if test is None:
+            return None
+        tests.append(test)
+    return tuple(tests)
+
+
+def _test_value(compare, value):
+    # Test of a field's value (None if invalid), comparisons that aren't
+    # supported (ie strings with numbers) don't match
+    def test(field_value):
+        if field_value is None:
+            return False
+        try:
+            return compare(field_value, value)
+        except TypeError:
+            return False
+    return test
+
+
+def _raw_test(field, base_type, compare, value):
+    # Test of a field's raw value, comparing it with the constant converted
+    # to raw space where possible
+    if field is None:
+        return _test_value(compare, value)
+
+    values = field.type.values
+    if values:
+        if compare not in (operator.eq, operator.ne):
+            test = _test_value(compare, value)
+            return lambda raw_value: test(None if raw_value is None else values.get(raw_value, raw_value))
+        # The raw values rendered to the constant
+        try:
+            raws = frozenset(raw for raw, name in values.items() if name == value)
+            if isinstance(value, int) and value not in values:
+                raws |= frozenset([value])
+        except TypeError:
+            raws = frozenset()
+        if compare is operator.eq:
+            return lambda raw_value: raw_value in raws
+        return lambda raw_value: raw_value is not None and raw_value not in raws
+
+    if not (field.scale or field.offset):
+        return _test_value(compare, value)
+
+    test = _test_value(compare, value)
+    if (base_type.fmt not in 'bBhHiIqQ' or isinstance(value, bool) or not isinstance(value, (int, float)) or
+            math.isinf(value) or math.isnan(value)):
+        return lambda raw_value: test(_scale_offset(field, raw_value))
+
+    # Values grow with raw values (scales are positive), so the raw values
+    # that match are those on one side of the constant in raw space. The
+    # integers around it are checked with the exact conversion.
+    raw_constant = (value + (field.offset or 0)) * (field.scale or 1)
+    base = int(math.floor(raw_constant))
+    candidates = range(base - 1, base + 3)
+    matching = [raw for raw in candidates if compare(_scale_offset(field, raw), value)]
+    if compare in (operator.gt, operator.ge):
+        low = min(matching) if matching else base + 3
+        return lambda raw_value: raw_value is not None and raw_value >= low
+    if compare in (operator.lt, operator.le):
+        high = max(matching) if matching else base - 2
+        return lambda raw_value: raw_value is not None and raw_value <= high
+    equal = frozenset(raw for raw in candidates if _scale_offset(field, raw) == value)
+    if compare is operator.eq:
+        return lambda raw_value: raw_value in equal
+    return lambda raw_value: raw_value is not None and raw_value not in equal
+
+
+class FieldRef(object):
+    """A field of data messages by name, to build Predicates comparing its
+    value with constants (see field()).
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, value):
+        return Comparison(self.name, '==', value)
+
+    def __ne__(self, value):
+        return Comparison(self.name, '!=', value)
+
+    def __lt__(self, value):
+        return Comparison(self.name, '<', value)
+
+    def __le__(self, value):
+        return Comparison(self.name, '<=', value)
+
+    def __gt__(self, value):
+        return Comparison(self.name, '>', value)
+
+    def __ge__(self, value):
+        return Comparison(self.name, '>=', value)
+
+    __hash__ = None
+
+    def isin(self, values):
+        """Matches values equal to any of `values`."""
+        return Or(*[Comparison(self.name, '==', value) for value in values])
+
+    def __repr__(self):
+        return 'field(%r)' % (self.name,)
+
+
+def field(name):
+    """Refers to a field of data messages, to filter them with
+    FitFile.get_messages(where=...), ie::
+
+        fitfile.get_messages('record', where=(field('power') > 0) & (field('heart_rate') >= 120))
+        fitfile.get_messages('event', where=field('event_type') == 'start')
+
+    Values are compared as the profile defines them (scale and offset
+    applied, enums by name), before the data processor: datetimes are
+    compared with date_time fields as seconds, but units aren't converted.
+    Messages without a valid value of the field don't match.
+    """
+    return FieldRef(name)
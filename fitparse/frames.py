@@ -0,0 +1,140 @@
+try:
+    import pandas
+except ImportError:
+    pandas = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from fitparse.columns import numpy, require_numpy
+
+# Python 2 compat
+try:
+    str_types = (str, unicode)
+    int_types = (int, long)
+except NameError:
+    str_types = (str,)
+    int_types = (int,)
+
+
+def _object_values(column):
+    data = numpy.ma.getdata(column)
+    mask = numpy.ma.getmaskarray(column)
+    return [None if masked else value for value, masked in zip(data.tolist(), mask.tolist())]
+
+
+def _dictionary(codes, categories):
+    # Enum codes as (indices, dictionary) of the categories that are used,
+    # indices are -1 where masked
+    data = numpy.ma.getdata(codes)
+    mask = numpy.ma.getmaskarray(codes)
+    used = numpy.unique(data[~mask])
+    indices = numpy.searchsorted(used, data).astype(numpy.int32)
+    indices[mask] = -1
+    return indices, [str(value) for value in categories[used].tolist()]
+
+
+def _categories(values):
+    # The values of an object column of strings (ie rendered enums) as
+    # strings, values missing from the profile stay numbers in those. None
+    # for other columns.
+    valid = [v for v in values if v is not None]
+    if not any(isinstance(v, str_types) for v in valid):
+        return None
+    if not all(isinstance(v, str_types + int_types) for v in valid):
+        return None
+    return [v if v is None or isinstance(v, str_types) else str(v) for v in values]
+
+
+def _arrow_array(column, categories):
+    if categories is not None:
+        indices, dictionary = _dictionary(column, categories)
+        return pyarrow.DictionaryArray.from_arrays(
+            pyarrow.array(indices, mask=indices < 0), pyarrow.array(dictionary, type=pyarrow.string()))
+
+    data = numpy.ma.getdata(column)
+    mask = numpy.ma.getmaskarray(column)
+    if data.dtype.kind == 'M':
+        return pyarrow.array(data, mask=mask, type=pyarrow.timestamp(numpy.datetime_data(data.dtype)[0]))
+    if data.dtype.kind != 'O':
+        return pyarrow.array(data, mask=mask if mask.any() else None)
+
+    values = _object_values(column)
+    categories = _categories(values)
+    if categories is not None:
+        return pyarrow.array(categories, type=pyarrow.string()).dictionary_encode()
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError):
+        # Mixed types, same fallback as ParquetTableWriter
+        return pyarrow.array([None if v is None else str(v) for v in values], type=pyarrow.string())
+
+
+def table_to_arrow(table):
+    """Converts a ColumnTable to a pyarrow.Table.
+
+    Masked (invalid) values become nulls, datetime64 columns timestamps and
+    enum codes (see ColumnTable) and other string columns are dictionary
+    encoded. Numeric columns are passed to Arrow without copying where
+    possible. Units are kept in the fields' metadata.
+    """
+    require_numpy()
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for Arrow output')
+
+    arrays, fields = [], []
+    for name, column in table.columns.items():
+        array = _arrow_array(column, table.categories.get(name))
+        units = table.units.get(name)
+        arrays.append(array)
+        fields.append(pyarrow.field(name, array.type, metadata={'units': units} if units else None))
+    return pyarrow.Table.from_arrays(arrays, schema=pyarrow.schema(fields))
+
+
+def _series(column, categories):
+    if categories is not None:
+        indices, dictionary = _dictionary(column, categories)
+        if len(set(dictionary)) == len(dictionary):
+            return pandas.Categorical.from_codes(indices, dictionary)
+        column = numpy.ma.MaskedArray(categories[numpy.ma.getdata(column)], mask=numpy.ma.getmaskarray(column))
+
+    data = numpy.ma.getdata(column)
+    mask = numpy.ma.getmaskarray(column)
+    if not mask.any() and data.dtype.kind != 'O':
+        return data
+
+    kind = data.dtype.kind
+    if kind in 'iu':
+        return pandas.arrays.IntegerArray(data, mask)
+    if kind == 'b':
+        return pandas.arrays.BooleanArray(data, mask)
+    if kind == 'f':
+        return numpy.where(mask, numpy.nan, data)
+    if kind == 'M':
+        return numpy.where(mask, numpy.datetime64('NaT'), data)
+
+    values = _object_values(column)
+    categories = _categories(values)
+    if categories is not None:
+        return pandas.Categorical(categories)
+    return pandas.Series(values, dtype=object)
+
+
+def table_to_dataframe(table):
+    """Converts a ColumnTable to a pandas.DataFrame.
+
+    Masked (invalid) values become missing values (nullable integer and
+    boolean columns, NaN and NaT), datetime64 columns stay datetime64 and
+    enum codes (see ColumnTable) and other string columns become
+    categoricals.
+    """
+    require_numpy()
+    if pandas is None:
+        raise ImportError('pandas is required for DataFrame output')
+
+    return pandas.DataFrame(
+        dict((name, _series(column, table.categories.get(name))) for name, column in table.columns.items()),
+        columns=list(table.columns),
+        index=pandas.RangeIndex(table.size),
+    )
@@ -0,0 +1,98 @@
+import heapq
+import threading
+
+from fitparse.bulk import _fork
+
+
+class MessageIndex(object):
+    """Where the data messages of a FIT file are, by message name, from a
+    single structural pass over its data (see build_index()).
+
+    Each entry is an (offset, definition message, compressed timestamp
+    accumulator, component accumulators) tuple: all that's needed to decode
+    that message on its own, ie only the last few session messages (see
+    get_last()).
+    """
+
+    def __init__(self, parser, data):
+        self._parser = parser
+        self._data = data
+        # Decoding moves the parser around
+        self._lock = threading.Lock()
+        # Entries by message name, in file order
+        self.entries = {}
+
+    def __contains__(self, name):
+        return bool(self.find([name]))
+
+    def find(self, names):
+        """Returns the entries of the messages with a name or number in
+        `names`, in file order.
+        """
+        found = [
+            entries for name, entries in self.entries.items()
+            if name in names or entries[0][1].mesg_num in names
+        ]
+        if len(found) == 1:
+            return found[0]
+        return list(heapq.merge(*found))
+
+    def decode(self, entry):
+        """Returns the DataMessage of an entry."""
+        offset, def_mesg, timestamp, accumulators = entry
+        parser = self._parser
+        with self._lock:
+            context = parser._context
+            context.compressed_ts_accumulator = timestamp
+            if accumulators is not None:
+                context.accumulators[def_mesg.mesg_num] = dict(accumulators)
+            context.bytes_left = len(self._data) - offset
+
+            parser._file.seek(offset)
+            header = parser._parse_message_header()
+            context.local_mesgs[header.local_mesg_num] = def_mesg
+            return parser._parse_data_message(header)
+
+    def get_messages(self, names, start=None, stop=None):
+        """Decodes the messages with a name or number in `names`, sliced by
+        start and stop like a list.
+        """
+        return [self.decode(entry) for entry in self.find(names)[start:stop]]
+
+    def get_last(self, names, count=1):
+        """Decodes the last `count` messages with a name or number in
+        `names`, in file order.
+        """
+        return self.get_messages(names, start=-count) if count > 0 else []
+
+    def __repr__(self):
+        return '<MessageIndex: %d messages of %d types>' % (
+            sum(len(entries) for entries in self.entries.values()), len(self.entries))
+
+
+def build_index(fitfile):
+    """Returns a MessageIndex of the data messages of an unparsed FitFile.
+
+    Message headers and definition messages are read, data messages are
+    skipped by their size without decoding them (only their timestamps and
+    accumulated components are read), see FitFile._scan_messages(). Messages
+    defining developer fields are parsed. CRCs aren't checked. The FitFile
+    stays unparsed.
+    """
+    parser, data = _fork(fitfile)
+    index = MessageIndex(parser, data)
+    for offset, _, def_mesg, message in parser._scan_messages(parser._file.tell()):
+        if def_mesg is None or message is not None:
+            continue
+        # Before the data message is read
+        context = parser._context
+        entry = (
+            offset, def_mesg, context.compressed_ts_accumulator,
+            dict(context.accumulators[def_mesg.mesg_num]) if def_mesg.compiled.accumulated else None,
+        )
+        entries = index.entries.get(def_mesg.name)
+        if entries is None:
+            entries = index.entries[def_mesg.name] = []
+        entries.append(entry)
+
+    return index
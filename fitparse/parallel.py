@@ -0,0 +1,204 @@
+import pickle
+import struct
+
+from fitparse.base import FitFile
+from fitparse.bulk import _fork
+from fitparse.utils import FitCRCError, FitEOFError, crc_combine
+
+
+# Bytes of messages decoded per worker task
+PARALLEL_CHUNK_SIZE = 1024 * 1024
+
+# Header of the FIT data a worker decodes a chunk from, see _parse_chunk()
+_CHUNK_HEADER = struct.Struct('<2BHI4s')
+
+
+class ParseChunk(object):
+    """The parsing state at `start` (an offset into the data of a FIT file
+    after its first header): the active definition messages ({local message
+    number: (offset, definition message)}), accumulators and developer
+    fields.
+    """
+    __slots__ = ('start', 'definitions', 'compressed_ts_accumulator', 'accumulators', 'dev_types')
+
+    def __init__(self, start, context, offsets):
+        self.start = start
+        self.definitions = dict(
+            (local_mesg_num, (offsets[id(def_mesg)], def_mesg))
+            for local_mesg_num, def_mesg in context.local_mesgs.items()
+        )
+        self.compressed_ts_accumulator = context.compressed_ts_accumulator
+        self.accumulators = context.accumulators
+        self.dev_types = context.dev_types
+
+    def __repr__(self):
+        return '<ParseChunk: %d>' % self.start
+
+
+def _field_defs(def_mesg):
+    return def_mesg.field_defs + def_mesg.dev_field_defs
+
+
+def split_chunks(fitfile, chunk_size=PARALLEL_CHUNK_SIZE):
+    """Splits the data of an unparsed FitFile into chunks of about
+    `chunk_size` bytes of messages, with a single structural pass over it
+    (see FitFile._scan_messages()).
+
+    Returns the parser the pass left at the end of the data, the data, the
+    definition messages by offset, and for each chained file (segment) the
+    CRC of its header, its (start, stop, state) chunks, where state is the
+    ParseChunk at start (pickled), and the offset of its CRC.
+    """
+    parser, data = _fork(fitfile)
+    definitions = {}
+    # Definition messages by id, with their offsets
+    offsets = {}
+    segments = []
+
+    segment = chunk = None
+    for offset, header, def_mesg, message in parser._scan_messages(parser._file.tell()):
+        if message is not None:
+            if header.is_definition:
+                definitions[offset] = message
+                offsets[id(message)] = offset
+            continue
+
+        context = parser._context
+        if segment is None:
+            segment = (context.crc, [])
+        if chunk is not None and (header is None or offset - chunk[0] >= chunk_size):
+            segment[1].append((chunk[0], offset, chunk[1]))
+            chunk = None
+
+        if header is None:
+            # The CRC, then a chained file if any
+            segments.append(segment + (offset,))
+            segment = None
+        elif chunk is None:
+            chunk = (offset, pickle.dumps(ParseChunk(offset, context, offsets), pickle.HIGHEST_PROTOCOL))
+
+    return parser, data, definitions, segments
+
+
+def _parse_chunk(args):
+    # Parses the messages of a chunk, returns them along with their CRC
+    # (starting from 0). Definition messages, and those of data messages
+    # and their fields, are replaced by their offsets and indexes, see
+    # _restore_messages().
+    state, data, processor = args
+    chunk = pickle.loads(state)
+    fitfile = FitFile(
+        _CHUNK_HEADER.pack(12, 0x10, 0, len(data), b'.FIT') + data,
+        check_crc=False, data_processor=processor,
+    )
+    context = fitfile._context
+    context.crc = 0
+    context.compressed_ts_accumulator = chunk.compressed_ts_accumulator
+    context.accumulators = chunk.accumulators
+    context.dev_types = chunk.dev_types
+
+    offsets = {}
+    for local_mesg_num, (offset, def_mesg) in chunk.definitions.items():
+        context.local_mesgs[local_mesg_num] = def_mesg
+        offsets[id(def_mesg)] = offset
+
+    while context.bytes_left > 0:
+        offset = chunk.start + fitfile._file.tell() - _CHUNK_HEADER.size
+        message = fitfile._parse_message()
+        if message.type == 'definition':
+            offsets[id(message)] = offset
+
+    messages = fitfile._messages
+    indexes = {}
+    for n, message in enumerate(messages):
+        if message.type == 'definition':
+            messages[n] = offsets[id(message)]
+            continue
+        def_mesg = message.def_mesg
+        field_indexes = indexes.get(id(def_mesg))
+        if field_indexes is None:
+            field_indexes = indexes[id(def_mesg)] = dict(
+                (id(field_def), index) for index, field_def in enumerate(_field_defs(def_mesg)))
+        message.def_mesg = offsets[id(def_mesg)]
+        for field_data in message.fields:
+            if field_data.field_def is not None:
+                field_data.field_def = field_indexes[id(field_data.field_def)]
+    return context.crc, messages
+
+
+def _restore_messages(messages, definitions):
+    # Puts the definition messages (by offset) back into messages returned
+    # by _parse_chunk()
+    field_defs = {}
+    for n, message in enumerate(messages):
+        if message.__class__ is int:
+            messages[n] = definitions[message]
+            continue
+        def_mesg = message.def_mesg = definitions[message.def_mesg]
+        fields = field_defs.get(id(def_mesg))
+        if fields is None:
+            fields = field_defs[id(def_mesg)] = _field_defs(def_mesg)
+        for field_data in message.fields:
+            if field_data.field_def is not None:
+                field_data.field_def = fields[field_data.field_def]
+    return messages
+
+
+def parse_parallel(fitfile, processes=None, chunk_size=PARALLEL_CHUNK_SIZE):
+    """Parses an unparsed FitFile across a pool of `processes` worker
+    processes (the number of CPUs by default). Its messages are then the
+    same as parsing it sequentially.
+
+    A single structural pass (see split_chunks()) records the definition
+    messages, timestamps and accumulated values at the start of each chunk
+    of about `chunk_size` bytes, without decoding data messages. Chunks are
+    then parsed independently, and CRCs are combined and checked once all
+    of them are. The data processor needs to be picklable.
+
+    Messages come back from workers pickled: they're Python objects, unlike
+    the typed columns fitparse.shared writes to shared memory, so they'd be
+    pickled into a block just the same.
+    """
+    parser, data, definitions, segments = split_chunks(fitfile, chunk_size)
+    jobs = [
+        (state, data[start:stop], fitfile._processor)
+        for _, chunks, _ in segments
+        for start, stop, state in chunks
+    ]
+
+    if processes == 1 or len(jobs) <= 1:
+        results = [_parse_chunk(job) for job in jobs]
+    else:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(jobs)))
+        try:
+            results = pool.map(_parse_chunk, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    messages = []
+    results = iter(results)
+    for crc, chunks, crc_offset in segments:
+        for start, stop, _ in chunks:
+            chunk_crc, chunk_messages = next(results)
+            crc = crc_combine(crc, chunk_crc, stop - start)
+            messages.extend(_restore_messages(chunk_messages, definitions))
+
+        # Checked the way FitFile._read_and_assert_crc() does
+        crc_data = data[crc_offset:crc_offset + 2]
+        if len(crc_data) != 2:
+            raise FitEOFError("Tried to read 2 bytes from .FIT file but got %d" % len(crc_data))
+        crc_actual, = struct.unpack('<H', crc_data)
+        if crc_actual != crc and fitfile.check_crc:
+            raise FitCRCError('CRC Mismatch [expected = 0x%04X, actual = 0x%04X]' % (crc, crc_actual))
+
+    with fitfile._lock:
+        for message in messages:
+            fitfile._messages.append(message)
+        parser._context.complete = True
+        fitfile._context = parser._context
+        fitfile.protocol_version = parser.protocol_version
+        fitfile.profile_version = parser.profile_version
+        fitfile.close()
@@ -1,3 +1,4 @@
+import collections
 import datetime
 from fitparse.utils import scrub_method_name
 
@@ -5,6 +6,108 @@ from fitparse.utils import scrub_method_name
 UTC_REFERENCE = 631065600  # timestamp for UTC 00:00 Dec 31 1989
 
 
+class DateTimeConverter(object):
+    """Converts seconds since UTC_REFERENCE into (naive, UTC) datetimes.
+
+    Consecutive timestamps in a file are usually a few seconds apart, so a
+    value shortly after the last converted one is built by adding a
+    precomputed timedelta to its datetime. Other values are looked up in a
+    small LRU cache before falling back to datetime.utcfromtimestamp().
+    """
+    _deltas = tuple(datetime.timedelta(seconds=n) for n in range(256))
+
+    def __init__(self, cache_size=128):
+        self.cache_size = cache_size
+        # (value, datetime) of the last conversion, kept as a single tuple so
+        # concurrent readers never see a mismatched pair
+        self._last = (None, None)
+        self._cache = collections.OrderedDict()
+
+    def __call__(self, value):
+        last_value, last_datetime = self._last
+        if last_value is not None:
+            delta = value - last_value
+            if delta.__class__ is int and 0 <= delta < 256:
+                result = last_datetime + self._deltas[delta]
+                self._last = (value, result)
+                return result
+
+        cache = self._cache
+        result = cache.pop(value, None)
+        if result is None:
+            result = datetime.datetime.utcfromtimestamp(UTC_REFERENCE + value)
+            if len(cache) >= self.cache_size:
+                cache.popitem(last=False)
+        cache[value] = result
+        self._last = (value, result)
+        return result
+
+
+class UnitConversion(object):
+    """A linear conversion of values into other units: value / divisor *
+    scale + offset. The divisor is exact, ie divisor=1000.0 gives the same
+    values as dividing by 1000.0 (multiplying by 0.001 may not).
+
+    Works on single values, tuples of values and numpy arrays alike. If
+    `units` is set, converted fields get these units.
+    """
+    __slots__ = ('scale', 'offset', 'units', 'divisor')
+
+    def __init__(self, scale=1.0, offset=0.0, units=None, divisor=1.0):
+        self.scale = scale
+        self.offset = offset
+        self.units = units
+        self.divisor = divisor
+
+    def __call__(self, value):
+        if isinstance(value, tuple):
+            return tuple(None if v is None else self(v) for v in value)
+        if self.divisor != 1.0:
+            value = value / self.divisor
+        if self.scale != 1.0:
+            value = value * self.scale
+        if self.offset:
+            value = value + self.offset
+        return value
+
+    def then(self, other):
+        # Fold this conversion followed by other into a single conversion
+        return UnitConversion(
+            scale=self.scale * other.scale / other.divisor,
+            offset=(self.offset * other.scale) / other.divisor + other.offset,
+            units=other.units or self.units,
+            divisor=self.divisor,
+        )
+
+    def apply(self, field_data):
+        if field_data.value is not None:
+            field_data.value = self(field_data.value)
+        if self.units is not None:
+            field_data.units = self.units
+
+    def __repr__(self):
+        return '<UnitConversion: value / %r * %r + %r [%s]>' % (self.divisor, self.scale, self.offset, self.units)
+
+
+def conversion_processor(kind):
+    """Returns a process_field_<name> (kind 'field') or process_units_<units>
+    (kind 'units') method applying the processor's declarative conversion,
+    as run_field_processor() or run_unit_processor() would without one.
+
+    They're kept for subclasses calling them; a subclass overriding one
+    replaces that conversion.
+    """
+    def process(self, field_data):
+        if kind == 'field':
+            conversion = self.get_field_conversion(field_data.name)
+        else:
+            conversion = self.unit_conversions.get(field_data.units)
+        if conversion is not None:
+            conversion.apply(field_data)
+    process.conversion = kind
+    return process
+
+
 class FitFileDataProcessor(object):
     # TODO: Document API
     # Functions that will be called to do the processing:
@@ -19,8 +122,33 @@ class FitFileDataProcessor(object):
     #def process_units_<unit_name> (field_data)
     #def process_message_<mesg_name / mesg_type_num> (data_message)
 
+    # Declarative unit conversions, keyed by field name and by units. They're
+    # applied by run_field_processor() and run_unit_processor() when there's
+    # no process_field_<name> or process_units_<units> method (other than a
+    # conversion_processor()), so a process_units_<units> method sees values
+    # converted by the field's conversion. Unlike those methods, they're also
+    # applied as array operations by FitFile.get_columns(): for each (field
+    # name, units) pair they're resolved once into a single folded
+    # UnitConversion (see get_conversion()).
+    field_conversions = {}
+    unit_conversions = {}
+
+    # Return date_time fields as POSIX timestamps (int seconds) instead of datetimes
+    epoch_timestamps = False
+
     # Used to memoize scrubbed method names
     _scrubbed_method_names = {}
+    # Used to memoize whether processor classes have a processor method, and
+    # their conversions
+    _processor_methods = {}
+    _conversions = {}
+    # DateTimeConverter, created when first needed (subclasses may not call
+    # __init__())
+    _to_datetime = None
+
+    def __init__(self, epoch_timestamps=None):
+        if epoch_timestamps is not None:
+            self.epoch_timestamps = epoch_timestamps
 
     def _scrub_method_name(self, method_name):
         """Scrubs a method name, returning result from local cache if available.
@@ -45,32 +173,95 @@ class FitFileDataProcessor(object):
             'process_type_%s' % field_data.type.name), field_data)
 
     def run_field_processor(self, field_data):
-        self._run_processor(self._scrub_method_name(
-            'process_field_%s' % field_data.name), field_data)
+        if not self._run_processor(self._field_processor_name(field_data.name), field_data):
+            conversion = self.get_field_conversion(field_data.name)
+            if conversion is not None:
+                conversion.apply(field_data)
+
+    def _field_processor_name(self, name):
+        return self._scrub_method_name('process_field_%s' % name)
 
     def run_unit_processor(self, field_data):
         if field_data.units:
-            self._run_processor(self._scrub_method_name(
-                'process_units_%s' % field_data.units), field_data)
+            if not self._run_processor(self._scrub_method_name(
+                    'process_units_%s' % field_data.units), field_data):
+                conversion = self.unit_conversions.get(field_data.units)
+                if conversion is not None:
+                    conversion.apply(field_data)
 
     def run_message_processor(self, data_message):
         self._run_processor(self._scrub_method_name(
             'process_message_%s' % data_message.def_mesg.name), data_message)
 
+    def get_field_conversion(self, name):
+        return self.field_conversions.get(name)
+
+    def get_conversion(self, name, units):
+        """Returns the folded UnitConversion for a field, or None. It gives
+        the values of run_field_processor() followed by run_unit_processor(),
+        if neither runs a process_* method.
+        """
+        instance_processors = self._has_instance_processors()
+        key = (self.__class__, name, units)
+        if not instance_processors:
+            try:
+                return self._conversions[key]
+            except KeyError:
+                pass
+
+        conversion = None
+        if not self._overrides(self._field_processor_name(name)):
+            conversion = self.get_field_conversion(name)
+        if conversion is not None and conversion.units is not None:
+            units = conversion.units
+        units_conversion = None
+        if units and not self._overrides(self._scrub_method_name('process_units_%s' % units)):
+            units_conversion = self.unit_conversions.get(units)
+        if units_conversion is not None:
+            conversion = conversion.then(units_conversion) if conversion else units_conversion
+
+        if not instance_processors:
+            self._conversions[key] = conversion
+        return conversion
+
+    def _has_instance_processors(self):
+        # Whether process_* methods were set on the processor itself
+        return any(name.startswith('process_') for name in getattr(self, '__dict__', ()))
+
+    def _overrides(self, processor_name):
+        # Whether a process_* method replaces the declarative conversion
+        method = getattr(self, processor_name, None)
+        return method is not None and getattr(method, 'conversion', None) is None
+
     def _run_processor(self, processor_name, data):
+        # Calls the processor method, if there's one, and returns whether
+        # there was. Whether the class has it is memoized.
+        key = (self.__class__, processor_name)
         try:
-            getattr(self, processor_name)(data)
-        except AttributeError:
-            pass
+            present = self._processor_methods[key]
+        except KeyError:
+            present = self._processor_methods[key] = hasattr(self.__class__, processor_name)
+        if not present and processor_name not in getattr(self, '__dict__', ()):
+            return False
+        getattr(self, processor_name)(data)
+        return True
 
     def process_type_bool(self, field_data):
         if field_data.value is not None:
             field_data.value = bool(field_data.value)
 
+    def convert_date_time(self, value):
+        if self.epoch_timestamps:
+            return UTC_REFERENCE + value
+        to_datetime = self._to_datetime
+        if to_datetime is None:
+            to_datetime = self._to_datetime = DateTimeConverter()
+        return to_datetime(value)
+
     def process_type_date_time(self, field_data):
         value = field_data.value
         if value is not None and value >= 0x10000000:
-            field_data.value = datetime.datetime.utcfromtimestamp(UTC_REFERENCE + value)
+            field_data.value = self.convert_date_time(value)
             field_data.units = None  # Units were 's', set to None
 
     def process_type_local_date_time(self, field_data):
@@ -78,7 +269,7 @@ class FitFileDataProcessor(object):
             # NOTE: This value was created on the device using it's local timezone.
             #       Unless we know that timezone, this value won't be correct. However, if we
             #       assume UTC, at least it'll be consistent.
-            field_data.value = datetime.datetime.utcfromtimestamp(UTC_REFERENCE + field_data.value)
+            field_data.value = self.convert_date_time(field_data.value)
             field_data.units = None
 
     def process_type_localtime_into_day(self, field_data):
@@ -90,27 +281,31 @@ class FitFileDataProcessor(object):
 
 
 class StandardUnitsDataProcessor(FitFileDataProcessor):
-    def run_field_processor(self, field_data):
+    speed_conversion = UnitConversion(scale=60.0 * 60.0 / 1000.0, units='km/h')
+
+    field_conversions = {
+        'distance': UnitConversion(divisor=1000.0, units='km'),
+        'speed': speed_conversion,
+    }
+    unit_conversions = {
+        'semicircles': UnitConversion(scale=180.0 / (2 ** 31), units='deg'),
+    }
+
+    def get_field_conversion(self, name):
         """
-        Convert all '*_speed' fields using 'process_field_speed'
-        All other units will use the default method.
+        Convert all '*_speed' fields using speed_conversion
+        All other fields will use field_conversions.
         """
-        if field_data.name.endswith("_speed"):
-            self.process_field_speed(field_data)
-        else:
-            super(StandardUnitsDataProcessor, self).run_field_processor(field_data)
+        if name.endswith('_speed'):
+            return self.speed_conversion
+        return super(StandardUnitsDataProcessor, self).get_field_conversion(name)
 
-    def process_field_distance(self, field_data):
-        if field_data.value is not None:
-            field_data.value /= 1000.0
-        field_data.units = 'km'
+    def _field_processor_name(self, name):
+        # All '*_speed' fields are processed by process_field_speed
+        if name.endswith('_speed'):
+            return 'process_field_speed'
+        return super(StandardUnitsDataProcessor, self)._field_processor_name(name)
 
-    def process_field_speed(self, field_data):
-        if field_data.value is not None:
-            field_data.value *= 60.0 * 60.0 / 1000.0
-        field_data.units = 'km/h'
-
-    def process_units_semicircles(self, field_data):
-        if field_data.value is not None:
-            field_data.value *= 180.0 / (2 ** 31)
-        field_data.units = 'deg'
+    process_field_distance = conversion_processor('field')
+    process_field_speed = conversion_processor('field')
+    process_units_semicircles = conversion_processor('units')
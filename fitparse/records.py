@@ -21,6 +21,9 @@ except ImportError:
 from fitparse.utils import FitParseError
 
 
+# Developer fields registered by add_dev_data_id() and
+# add_dev_field_description() when not given a registry of their own
+# (FitFile keeps one per file)
 DEV_TYPES = {}
 
 
@@ -38,9 +41,87 @@ class RecordBase(object):
             setattr(self, slot_name, value)
 
 
+# Keys of the objects of the profile by id, see profile_object()
+_profile_keys = {}
+
+
+def _profile_key(obj):
+    if not _profile_keys:
+        from fitparse.profile import FIELD_TYPE_TIMESTAMP, FIELD_TYPES, MESSAGE_TYPES
+
+        keys = {id(FIELD_TYPE_TIMESTAMP): ('timestamp',)}
+        for identifier, base_type in BASE_TYPES.items():
+            keys[id(base_type)] = ('base_type', identifier)
+        for name, field_type in FIELD_TYPES.items():
+            keys[id(field_type)] = ('field_type', name)
+        for mesg_num, mesg_type in MESSAGE_TYPES.items():
+            keys[id(mesg_type)] = ('mesg_type', mesg_num)
+            for def_num, field in mesg_type.fields.items():
+                keys[id(field)] = ('field', mesg_num, def_num)
+                for n, sub_field in enumerate(field.subfields or ()):
+                    keys[id(sub_field)] = ('subfield', mesg_num, def_num, n)
+        _profile_keys.update(keys)
+    return _profile_keys.get(id(obj))
+
+
+def profile_object(kind, *key):
+    """Returns an object of the profile (a base type, field type, message
+    type, field or subfield) by its key.
+    """
+    from fitparse.profile import FIELD_TYPE_TIMESTAMP, FIELD_TYPES, MESSAGE_TYPES
+
+    if kind == 'timestamp':
+        return FIELD_TYPE_TIMESTAMP
+    if kind == 'base_type':
+        return BASE_TYPES[key[0]]
+    if kind == 'field_type':
+        return FIELD_TYPES[key[0]]
+    if kind == 'mesg_type':
+        return MESSAGE_TYPES[key[0]]
+    field = MESSAGE_TYPES[key[0]].fields[key[1]]
+    return field if kind == 'field' else field.subfields[key[2]]
+
+
+class ProfileRecordBase(RecordBase):
+    # Objects of the profile are pickled as references to it, so they stay
+    # shared (and their parse functions don't need pickling)
+    __slots__ = ()
+
+    def __reduce_ex__(self, protocol):
+        key = _profile_key(self)
+        if key is not None:
+            return profile_object, key
+        return super(ProfileRecordBase, self).__reduce_ex__(protocol)
+
+
 class MessageHeader(RecordBase):
+    # Immutable, so the headers of all 256 header bytes are shared (see
+    # message_header())
     __slots__ = ('is_definition', 'is_developer_data', 'local_mesg_num', 'time_offset')
 
+    def __init__(self, is_definition, is_developer_data, local_mesg_num, time_offset):
+        set_slot = super(MessageHeader, self).__setattr__
+        set_slot('is_definition', is_definition)
+        set_slot('is_developer_data', is_developer_data)
+        set_slot('local_mesg_num', local_mesg_num)
+        set_slot('time_offset', time_offset)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('MessageHeader is immutable')
+
+    def __reduce_ex__(self, protocol):
+        # Unpickled as the shared header
+        return message_header, (self.code,)
+
+    @property
+    def code(self):
+        """The header byte."""
+        if self.time_offset is not None:
+            return 0x80 | (self.local_mesg_num << 5) | self.time_offset
+        return (
+            (0x40 if self.is_definition else 0) | (0x20 if self.is_developer_data else 0) | self.local_mesg_num
+        )
+
     def __repr__(self):
         return '<MessageHeader: %s%s -- local mesg: #%d%s>' % (
             'definition' if self.is_definition else 'data',
@@ -50,8 +131,44 @@ class MessageHeader(RecordBase):
         )
 
 
+def _decode_message_header(code):
+    if code & 0x80:  # bit 7: Is this record a compressed timestamp?
+        return MessageHeader(
+            is_definition=False,
+            is_developer_data=False,
+            local_mesg_num=(code >> 5) & 0x3,  # bits 5-6
+            time_offset=code & 0x1F,  # bits 0-4
+        )
+    return MessageHeader(
+        is_definition=bool(code & 0x40),  # bit 6
+        is_developer_data=bool(code & 0x20),  # bit 5
+        local_mesg_num=code & 0xF,  # bits 0-3
+        time_offset=None,
+    )
+
+
+def _message_headers():
+    headers = [_decode_message_header(code) for code in range(256)]
+    # Bit 4 of normal headers is reserved, those with it set share the
+    # header without
+    for code in range(0x10, 0x80):
+        if code & 0x10:
+            headers[code] = headers[code & ~0x10]
+    return tuple(headers)
+
+
+# The MessageHeader of each header byte
+MESSAGE_HEADERS = _message_headers()
+
+
+def message_header(code):
+    """Returns the shared MessageHeader of a header byte."""
+    return MESSAGE_HEADERS[code]
+
+
 class DefinitionMessage(RecordBase):
-    __slots__ = ('header', 'endian', 'mesg_type', 'mesg_num', 'field_defs', 'dev_field_defs')
+    # compiled: the shared CompiledDefinition (see fitparse.definitions)
+    __slots__ = ('header', 'endian', 'mesg_type', 'mesg_num', 'field_defs', 'dev_field_defs', 'compiled')
     type = 'definition'
 
     @property
@@ -118,6 +235,15 @@ class DataMessage(RecordBase):
     __slots__ = ('header', 'def_mesg', 'fields')
     type = 'data'
 
+    @classmethod
+    def make(cls, header, def_mesg, fields):
+        # Faster than the generic RecordBase.__init__()
+        message = object.__new__(cls)
+        message.header = header
+        message.def_mesg = def_mesg
+        message.fields = fields
+        return message
+
     def get(self, field_name, as_dict=False):
         # SIMPLIFY: get rid of as_dict
         for field_data in self.fields:
@@ -180,6 +306,18 @@ class FieldData(RecordBase):
             # NOTE:Not a property since you may want to override this in a data processor
             self.units = self.field.units
 
+    @classmethod
+    def make(cls, field_def, field, parent_field, value, raw_value):
+        # Faster than the generic RecordBase.__init__()
+        field_data = object.__new__(cls)
+        field_data.field_def = field_def
+        field_data.field = field
+        field_data.parent_field = parent_field
+        field_data.value = value
+        field_data.raw_value = raw_value
+        field_data.units = field.units if field else None
+        return field_data
+
     def _decode_raw_value(self, raw_value):
         # Apply numeric transformations (scale+offset)
         if isinstance(raw_value, tuple):
@@ -273,7 +411,7 @@ class FieldData(RecordBase):
         )
 
 
-class BaseType(RecordBase):
+class BaseType(ProfileRecordBase):
     __slots__ = ('name', 'identifier', 'fmt', 'parse', 'unparse')
     values = None  # In case we're treated as a FieldType
 
@@ -291,21 +429,21 @@ class BaseType(RecordBase):
         )
 
 
-class FieldType(RecordBase):
+class FieldType(ProfileRecordBase):
     __slots__ = ('name', 'base_type', 'values')
 
     def __repr__(self):
         return '<FieldType: %s (%s)>' % (self.name, self.base_type)
 
 
-class MessageType(RecordBase):
+class MessageType(ProfileRecordBase):
     __slots__ = ('name', 'mesg_num', 'fields')
 
     def __repr__(self):
         return '<MessageType: %s (#%d)>' % (self.name, self.mesg_num)
 
 
-class FieldAndSubFieldBase(RecordBase):
+class FieldAndSubFieldBase(ProfileRecordBase):
     __slots__ = ()
 
     @property
@@ -317,8 +455,9 @@ class FieldAndSubFieldBase(RecordBase):
         return isinstance(self.type, BaseType)
 
     def render(self, raw_value):
-        if self.type.values and (raw_value in self.type.values):
-            return self.type.values[raw_value]
+        values = self.type.values
+        if values:
+            return values.get(raw_value, raw_value)
         return raw_value
 
 
@@ -404,8 +543,53 @@ BASE_TYPES = {
 }
 
 
-def add_dev_data_id(message):
-    global DEV_TYPES
+class RecordPool(object):
+    """Recycles the DataMessage and FieldData objects of data messages, see
+    FitFile.get_messages(recycle=True). Objects handed out are reused once
+    recycle() is called, so a message is only valid until then.
+    """
+    __slots__ = ('_free', '_used', '_message')
+
+    def __init__(self):
+        self._free = []
+        self._used = []
+        self._message = None
+
+    def field_data(self, field_def, field, parent_field, value, raw_value):
+        """Returns a FieldData like FieldData.make()."""
+        if not self._free:
+            field_data = FieldData.make(field_def, field, parent_field, value, raw_value)
+        else:
+            field_data = self._free.pop()
+            field_data.field_def = field_def
+            field_data.field = field
+            field_data.parent_field = parent_field
+            field_data.value = value
+            field_data.raw_value = raw_value
+            field_data.units = field.units if field else None
+        self._used.append(field_data)
+        return field_data
+
+    def data_message(self, header, def_mesg, fields):
+        """Returns a DataMessage like DataMessage.make()."""
+        message = self._message
+        if message is None:
+            message = self._message = DataMessage.make(header, def_mesg, fields)
+        else:
+            message.header = header
+            message.def_mesg = def_mesg
+            message.fields = fields
+        return message
+
+    def recycle(self):
+        """Makes the objects handed out so far available again."""
+        self._free.extend(self._used)
+        del self._used[:]
+
+
+def add_dev_data_id(message, dev_types=None):
+    if dev_types is None:
+        dev_types = DEV_TYPES
     dev_data_index = message.get('developer_data_index').raw_value
     if message.get('application_id'):
         application_id = message.get('application_id').raw_value
@@ -413,11 +597,12 @@ def add_dev_data_id(message):
         application_id = None
 
     # Note that nothing in the spec says overwriting an existing type is invalid
-    DEV_TYPES[dev_data_index] = {'dev_data_index': dev_data_index, 'application_id': application_id, 'fields': {}}
+    dev_types[dev_data_index] = {'dev_data_index': dev_data_index, 'application_id': application_id, 'fields': {}}
 
 
-def add_dev_field_description(message):
-    global DEV_TYPES
+def add_dev_field_description(message, dev_types=None):
+    if dev_types is None:
+        dev_types = DEV_TYPES
 
     dev_data_index = message.get('developer_data_index').raw_value
     field_def_num = message.get('field_definition_number').raw_value
@@ -429,9 +614,9 @@ def add_dev_field_description(message):
     if native_field_num is not None:
         native_field_num = native_field_num.raw_value
 
-    if dev_data_index not in DEV_TYPES:
+    if dev_data_index not in dev_types:
         raise FitParseError("No such dev_data_index=%s found" % (dev_data_index))
-    fields = DEV_TYPES[int(dev_data_index)]['fields']
+    fields = dev_types[int(dev_data_index)]['fields']
 
     # Note that nothing in the spec says overwriting an existing field is invalid
     fields[field_def_num] = DevField(dev_data_index=dev_data_index,
@@ -442,10 +627,12 @@ def add_dev_field_description(message):
                                      native_field_num=native_field_num)
 
 
-def get_dev_type(dev_data_index, field_def_num):
-    if dev_data_index not in DEV_TYPES:
+def get_dev_type(dev_data_index, field_def_num, dev_types=None):
+    if dev_types is None:
+        dev_types = DEV_TYPES
+    if dev_data_index not in dev_types:
         raise FitParseError("No such dev_data_index=%s found when looking up field %s" % (dev_data_index, field_def_num))
-    elif field_def_num not in DEV_TYPES[dev_data_index]['fields']:
+    elif field_def_num not in dev_types[dev_data_index]['fields']:
         raise FitParseError("No such field %s for dev_data_index %s" % (field_def_num, dev_data_index))
 
-    return DEV_TYPES[dev_data_index]['fields'][field_def_num]
+    return dev_types[dev_data_index]['fields'][field_def_num]
@@ -0,0 +1,215 @@
+import math
+
+from fitparse.columns import ColumnTable, numpy, object_array, require_numpy
+
+
+RESAMPLE_METHODS = ('ffill', 'linear')
+
+
+class _Samples(object):
+    # Valid samples of one column, sorted by time
+    __slots__ = ('times', 'values', 'linear')
+
+    def __init__(self, values, linear):
+        self.times = numpy.empty(0, dtype=numpy.float64)
+        self.values = values[:0]
+        self.linear = linear
+
+    def extend(self, times, values):
+        if len(self.times):
+            # Samples older than ones already seen are dropped
+            newer = times > self.times[-1]
+            times, values = times[newer], values[newer]
+        if not len(times):
+            return
+        times = numpy.concatenate((self.times, times))
+        values = numpy.concatenate((self.values, values))
+        # Of samples at the same time, keep the last one
+        last = numpy.append(times[1:] != times[:-1], True)
+        self.times, self.values = times[last], values[last]
+
+    def ready(self, grid, max_gap):
+        # Whether the values at grid points are known, that is don't depend on
+        # samples that haven't been seen yet
+        if not self.linear or not len(self.times):
+            return numpy.ones(len(grid), dtype=bool)
+        ready = grid <= self.times[-1]
+        if max_gap is not None:
+            ready |= grid - self.times[-1] > max_gap
+        return ready
+
+    def sample(self, grid, max_gap):
+        times, values = self.times, self.values
+        if not len(times):
+            valid = numpy.zeros(len(grid), dtype=bool)
+            if values.dtype.kind == 'O':
+                return object_array([None] * len(grid)), valid
+            return numpy.zeros(len(grid), dtype=values.dtype), valid
+
+        index = numpy.searchsorted(times, grid, side='right') - 1
+        valid = index >= 0
+        previous = numpy.maximum(index, 0)
+
+        if self.linear:
+            data = numpy.interp(grid, times, values.astype(numpy.float64))
+            valid &= grid <= times[-1]
+            if max_gap is not None:
+                # Not across gaps between samples longer than max_gap
+                following = numpy.minimum(previous + 1, len(times) - 1)
+                valid &= (grid == times[previous]) | (times[following] - times[previous] <= max_gap)
+        else:
+            data = values[previous]
+            if max_gap is not None:
+                # Values are held for max_gap seconds at most
+                valid &= grid - times[previous] <= max_gap
+
+        if data.dtype.kind == 'O':
+            data[~valid] = None
+        else:
+            data = numpy.where(valid, data, numpy.zeros(1, dtype=data.dtype))
+        return data, valid
+
+    def trim(self, time):
+        # Drops samples no longer needed for grid points after time
+        start = max(int(numpy.searchsorted(self.times, time, side='right')) - 1, 0)
+        self.times, self.values = self.times[start:], self.values[start:]
+
+
+class Resampler(object):
+    """Resamples ColumnTables (ie of record messages) to a uniform time grid.
+
+    Grid points are multiples of `interval` seconds (of the time column),
+    from the first to the last valid timestamp, so series of different
+    files line up. Numeric columns are linearly interpolated between valid
+    values (`method='linear'`) or forward filled (`method='ffill'`), other
+    columns (enums, strings, ...) are always forward filled. With `max_gap`
+    set, linear interpolation doesn't bridge gaps between values longer than
+    max_gap seconds, and values are forward filled for at most max_gap
+    seconds. Grid points without a value are masked.
+
+    Tables can be added in consecutive chunks (see add()), for the same
+    result as resampling them as a whole.
+    """
+
+    def __init__(self, interval=1, method='linear', max_gap=None, time_column='timestamp'):
+        require_numpy()
+        if method not in RESAMPLE_METHODS:
+            raise ValueError('Unknown resampling method %r (expected one of: %s)' % (
+                method, ', '.join(RESAMPLE_METHODS)))
+        if interval <= 0:
+            raise ValueError('Resampling interval must be positive')
+
+        self.interval = interval
+        self.method = method
+        self.max_gap = max_gap
+        self.time_column = time_column
+        self.name = None
+        self.units = {}
+        self.categories = {}
+        self._samples = {}
+        self._time_dtype = None
+        # Next grid point to emit and the last valid timestamp, in multiples
+        # of interval and seconds
+        self._next = None
+        self._end = None
+
+    def _seconds(self, times):
+        self._time_dtype = times.dtype
+        if times.dtype.kind == 'M':
+            return times.astype('datetime64[ms]').astype(numpy.int64) / 1000.0
+        return times.astype(numpy.float64)
+
+    def _extend(self, table):
+        if self.name is None:
+            self.name = table.name
+            self.units[self.time_column] = table.units.get(self.time_column)
+        column = table[self.time_column]
+        rows = ~numpy.ma.getmaskarray(column)
+        times = self._seconds(numpy.ma.getdata(column)[rows])
+        if not len(times):
+            return
+
+        order = numpy.argsort(times, kind='mergesort')
+        times = times[order]
+        if self._next is None:
+            self._next = int(math.ceil(times[0] / self.interval))
+        self._end = times[-1] if self._end is None else max(self._end, times[-1])
+
+        for name, column in table.columns.items():
+            if name == self.time_column:
+                continue
+            data = numpy.ma.getdata(column)[rows][order]
+            valid = ~numpy.ma.getmaskarray(column)[rows][order]
+            # Enum codes are forward filled, with the longest category table
+            categories = table.categories.get(name)
+            if categories is not None and len(categories) > len(self.categories.get(name, ())):
+                self.categories[name] = categories
+            samples = self._samples.get(name)
+            if samples is None:
+                linear = self.method == 'linear' and data.dtype.kind in 'iuf' and categories is None
+                samples = self._samples[name] = _Samples(data, linear)
+                self.units[name] = table.units.get(name)
+            samples.extend(times[valid], data[valid])
+
+    def _emit(self, final):
+        grid = numpy.empty(0, dtype=numpy.float64)
+        if self._next is not None:
+            last = int(math.floor(self._end / self.interval))
+            grid = numpy.arange(self._next, last + 1) * float(self.interval)
+
+        if not final:
+            # Stop at the first grid point depending on samples to come
+            ready = numpy.ones(len(grid), dtype=bool)
+            for samples in self._samples.values():
+                ready &= samples.ready(grid, self.max_gap)
+            if not ready.all():
+                grid = grid[:int(numpy.argmin(ready))]
+
+        columns, units = {}, {}
+        if self._next is not None:
+            columns[self.time_column] = numpy.ma.MaskedArray(self._time_values(grid))
+            units[self.time_column] = self.units[self.time_column]
+        for name, samples in self._samples.items():
+            data, valid = samples.sample(grid, self.max_gap)
+            columns[name] = numpy.ma.MaskedArray(data, mask=~valid)
+            units[name] = self.units[name]
+
+        if len(grid):
+            self._next += len(grid)
+            for samples in self._samples.values():
+                samples.trim(grid[-1])
+
+        return ColumnTable(self.name, columns, units, len(grid), dict(self.categories))
+
+    def _time_values(self, grid):
+        # Grid points in the time column's type
+        integral = float(self.interval).is_integer()
+        if self._time_dtype.kind == 'M':
+            if integral:
+                return grid.astype(numpy.int64).astype('datetime64[s]')
+            return numpy.round(grid * 1000).astype(numpy.int64).astype('datetime64[ms]')
+        return grid.astype(numpy.int64) if integral else grid
+
+    def add(self, table):
+        """Adds the next chunk of rows and returns a ColumnTable of the grid
+        points that are now known.
+        """
+        self._extend(table)
+        return self._emit(final=False)
+
+    def finish(self):
+        """Returns a ColumnTable of the remaining grid points."""
+        return self._emit(final=True)
+
+
+def resample(table, interval=1, method='linear', max_gap=None, time_column='timestamp'):
+    """Resamples a ColumnTable to a uniform time grid, see Resampler.
+
+    For example, 1 Hz records with gaps of more than 10 seconds left out::
+
+        records = fitfile.get_columns('record')
+        records = resample(records, interval=1, max_gap=10)
+    """
+    resampler = Resampler(interval=interval, method=method, max_gap=max_gap, time_column=time_column)
+    resampler._extend(table)
+    return resampler.finish()
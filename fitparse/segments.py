@@ -0,0 +1,115 @@
+import struct
+
+from fitparse.base import FitFile
+from fitparse.utils import FitEOFError, FitHeaderError, open_fileish
+
+
+class FitSegment(object):
+    """One FIT file of a chain of FIT files: its header and data records
+    followed by a CRC, starting at `offset`.
+
+    Segments don't share definition messages or accumulated values, so each
+    can be parsed on its own (see open()).
+    """
+    __slots__ = ('index', 'offset', 'header_size', 'data_size', 'protocol_version', 'profile_version', 'data')
+
+    def __init__(self, index, offset, header_size, data_size, protocol_version, profile_version, data):
+        self.index = index
+        self.offset = offset
+        self.header_size = header_size
+        self.data_size = data_size
+        self.protocol_version = protocol_version
+        self.profile_version = profile_version
+        # The segment's bytes, header to CRC
+        self.data = data
+
+    @property
+    def size(self):
+        return self.header_size + self.data_size + 2
+
+    def open(self, **kwargs):
+        """Returns a FitFile of the segment, keyword arguments are passed on."""
+        return FitFile(self.data, **kwargs)
+
+    def __repr__(self):
+        return '<FitSegment: #%d -- offset: %d, data size: %d, protocol: %s, profile: %s>' % (
+            self.index, self.offset, self.data_size, self.protocol_version, self.profile_version,
+        )
+
+
+def scan_segments(data):
+    """Returns the FitSegments of FIT data (bytes), reading only the headers
+    of chained files to find where each one ends.
+    """
+    if not data:
+        raise FitHeaderError("Invalid .FIT File Header")
+
+    segments = []
+    offset = 0
+    while offset < len(data):
+        header = data[offset:offset + 12]
+        if len(header) < 12:
+            raise FitEOFError("Tried to read 12 bytes from .FIT file but got %d" % len(header))
+        if header[8:12] != b'.FIT':
+            raise FitHeaderError("Invalid .FIT File Header")
+
+        # Decoded the same way FitFile._parse_file_header() does
+        header_size, protocol_ver_enc, profile_ver_enc, data_size = struct.unpack('<2BHI4x', header)
+        size = header_size + data_size + 2
+        if offset + size > len(data):
+            raise FitEOFError("Tried to read %d bytes from .FIT file but got %d" % (size, len(data) - offset))
+
+        segments.append(FitSegment(
+            index=len(segments),
+            offset=offset,
+            header_size=header_size,
+            data_size=data_size,
+            protocol_version=float("%d.%d" % (protocol_ver_enc >> 4, protocol_ver_enc & ((1 << 4) - 1))),
+            profile_version=float("%d.%d" % (profile_ver_enc / 100, profile_ver_enc % 100)),
+            data=data[offset:offset + size],
+        ))
+        offset += size
+    return segments
+
+
+def read_segments(fileish):
+    """Reads `fileish` (a path, file object or file contents, as FitFile
+    accepts) and returns its FitSegments, see scan_segments().
+    """
+    fileobj = open_fileish(fileish)
+    try:
+        return scan_segments(fileobj.read())
+    finally:
+        if fileobj is not fileish and hasattr(fileobj, 'close'):
+            fileobj.close()
+
+
+def _map_segment(args):
+    func, segment, kwargs = args
+    with segment.open(**kwargs) as fitfile:
+        return func(fitfile)
+
+
+def map_segments(fileish, func, processes=None, **kwargs):
+    """Calls `func` with a FitFile of each chained file (segment) of
+    `fileish` and returns the results, in order. Keyword arguments are passed
+    on to FitFile.
+
+    Segments are parsed independently across a pool of `processes` worker
+    processes (the number of CPUs by default), so `func` and its results
+    need to be picklable, ie::
+
+        tables = map_segments('archive.fit', FitFile.get_column_tables)
+    """
+    jobs = [(func, segment, kwargs) for segment in read_segments(fileish)]
+    if processes == 1 or len(jobs) <= 1:
+        return [_map_segment(job) for job in jobs]
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(jobs)))
+    try:
+        return pool.map(_map_segment, jobs)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,248 @@
+import os
+import pickle
+import struct
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+from fitparse.columns import ColumnTable, numpy, require_numpy
+from fitparse.segments import map_segments
+from fitparse.utils import FitParseError
+
+
+# Start of a block: magic and size of the (pickled) schema, see share_tables()
+_BLOCK_HEADER = struct.Struct('<4sQ')
+_BLOCK_MAGIC = b'FITC'
+# Arrays start at multiples of this, enough for any dtype (and cache lines)
+_ALIGNMENT = 64
+
+
+def require_shared_memory():
+    require_numpy()
+    if shared_memory is None:
+        raise ImportError('multiprocessing.shared_memory (Python 3.8+) is required for shared tables')
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _view(buf, dtype, shape, offset):
+    # An array of the block (which keeps it from being closed while in use)
+    count = 1
+    for dimension in shape:
+        count *= dimension
+    if not count:
+        return numpy.empty(shape, dtype)
+    return numpy.frombuffer(buf, dtype, count, offset).reshape(shape)
+
+
+def _create_block(size):
+    # A block that outlives the (worker) process creating it. It's only
+    # tracked (and unlinked at exit if it's leaked) once it's attached.
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlink_block(name):
+    # Frees a block (if it's still allocated) without attaching to it
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def share_tables(tables):
+    """Copies a dict of ColumnTables (see FitFile.get_column_tables()) into
+    a new shared memory block and returns its name, to attach to it with
+    SharedTables.
+
+    The block holds a small schema (names, units, enum categories and the
+    dtype, shape and offset of each column), followed by the data and masks
+    of the columns as typed arrays. Columns of Python objects (ie strings)
+    are kept in the schema.
+
+    The block outlives this process until it's unlinked, except on Windows,
+    which frees blocks once no process has them open.
+    """
+    require_shared_memory()
+    schema, arrays = [], []
+    size = 0
+    for table in tables.values():
+        columns = []
+        for name, column in table.columns.items():
+            data = numpy.ma.getdata(column)
+            if data.dtype.hasobject:
+                columns.append((name, None, None, column, None))
+                continue
+
+            mask = numpy.ma.getmask(column)
+            offsets = []
+            for values in (data, mask if mask is not numpy.ma.nomask and mask.any() else None):
+                if values is None:
+                    offsets.append(None)
+                    continue
+                size = _align(size)
+                offsets.append(size)
+                arrays.append((size, values))
+                size += values.nbytes
+            columns.append((name, data.dtype.str, data.shape, offsets[0], offsets[1]))
+        schema.append((table.name, table.size, table.units, table.categories, columns))
+
+    schema = pickle.dumps(schema, pickle.HIGHEST_PROTOCOL)
+    start = _align(_BLOCK_HEADER.size + len(schema))
+    shm = _create_block(start + size)
+    try:
+        buf = shm.buf
+        _BLOCK_HEADER.pack_into(buf, 0, _BLOCK_MAGIC, len(schema))
+        buf[_BLOCK_HEADER.size:_BLOCK_HEADER.size + len(schema)] = schema
+        for offset, values in arrays:
+            _view(buf, values.dtype, values.shape, start + offset)[...] = values
+        del buf
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return shm.name
+
+
+def share_column_tables(fitfile):
+    """Shares the ColumnTables of a FitFile, see share_tables(). To be used
+    as a worker function, ie with map_segments().
+    """
+    return share_tables(fitfile.get_column_tables())
+
+
+class SharedTables(object):
+    """The ColumnTables of a shared memory block written by share_tables(),
+    by message name like FitFile.get_column_tables(). Attaching doesn't
+    copy the columns, they're numpy arrays of the block.
+
+    The block is allocated until it's released, ie::
+
+        with SharedTables(name) as tables:
+            speed = tables['record']['speed'].mean()
+
+    Columns stay valid after the block is closed or released: the memory is
+    only unmapped (and freed, once unlinked) with the last of them.
+    """
+
+    def __init__(self, name):
+        require_shared_memory()
+        self.name = name
+        self._shm = shared_memory.SharedMemory(name)
+        try:
+            self.tables = self._attach()
+        except BaseException:
+            self._shm.close()
+            raise
+
+    def _attach(self):
+        buf = self._shm.buf
+        magic, schema_size = _BLOCK_HEADER.unpack_from(buf)
+        if magic != _BLOCK_MAGIC:
+            raise FitParseError('Not a shared memory block of ColumnTables: %s' % self.name)
+        schema = pickle.loads(buf[_BLOCK_HEADER.size:_BLOCK_HEADER.size + schema_size])
+        start = _align(_BLOCK_HEADER.size + schema_size)
+
+        tables = {}
+        for name, size, units, categories, columns in schema:
+            table_columns = {}
+            for column, dtype, shape, data, mask in columns:
+                if dtype is not None:
+                    data = numpy.ma.MaskedArray(
+                        _view(buf, dtype, shape, start + data),
+                        mask=numpy.ma.nomask if mask is None else _view(buf, numpy.bool_, shape, start + mask),
+                        copy=False,
+                    )
+                table_columns[column] = data
+            tables[name] = ColumnTable(name, table_columns, units, size, categories)
+        return tables
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def get(self, name, default=None):
+        return self.tables.get(name, default)
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def __iter__(self):
+        return iter(self.tables)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def keys(self):
+        return self.tables.keys()
+
+    def items(self):
+        return self.tables.items()
+
+    def close(self):
+        """Detaches from the block, which stays allocated. Columns still in
+        use keep it mapped until they're gone.
+        """
+        self.tables = {}
+        try:
+            self._shm.close()
+        except BufferError:
+            # Leave the mapping to the arrays of the columns, it's unmapped
+            # along with the last one
+            self._shm._mmap = None
+            self._shm.close()
+
+    def unlink(self):
+        """Frees the block once every process has closed it."""
+        self._shm.unlink()
+
+    def release(self):
+        """Unlinks and closes the block."""
+        try:
+            self.unlink()
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    def __repr__(self):
+        return '<SharedTables: %s -- %d tables, %d bytes>' % (self.name, len(self.tables), self._shm.size)
+
+
+def map_shared_tables(fileish, processes=None, **kwargs):
+    """Decodes the ColumnTables of each chained file (segment) of `fileish`
+    across a pool of `processes` worker processes (see map_segments()), and
+    returns a SharedTables of each, in order.
+
+    Workers write their tables to shared memory instead of pickling them
+    back. Each SharedTables needs to be released once done with.
+    """
+    names = map_segments(fileish, share_column_tables, processes=processes, **kwargs)
+    shared = []
+    try:
+        for name in names:
+            shared.append(SharedTables(name))
+    finally:
+        if len(shared) < len(names):
+            # Free every block, attached or not
+            for tables in shared:
+                tables.close()
+            for name in names:
+                _unlink_block(name)
+    return shared
@@ -0,0 +1,223 @@
+import itertools
+import os
+import shutil
+import tempfile
+
+from fitparse.bulk import _decode
+from fitparse.columns import ColumnTable, _TableBuilder, numpy, require_numpy
+
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+# Approximate memory per row of the chunks being collected (about 16 fields,
+# as raw values and then as rendered columns)
+_ROW_SIZE = 1024
+# Rows converted at a time when a spilled column changes dtype
+_CONVERT_ROWS = 1024 * 1024
+
+
+class _SpilledColumn(object):
+    # A column appended to a data file and a mask file chunk by chunk.
+    # Columns of objects (ie strings), and those whose chunks can't share a
+    # dtype, are kept in memory instead.
+    __slots__ = ('path', 'dtype', 'categories', 'units', 'size', 'objects')
+
+    def __init__(self, path, dtype, units, categories):
+        self.path = path
+        self.dtype = dtype
+        self.units = units
+        self.categories = categories
+        self.size = 0
+        # (data, mask) chunks of columns kept in memory
+        self.objects = [] if dtype.hasobject else None
+
+    def append(self, data, mask, categories=None):
+        if self.objects is None and not self._can_append(data.dtype, categories):
+            self._to_objects()
+        if self.objects is not None:
+            if categories is not None:
+                data = categories[data]
+            self.objects.append((data, mask))
+        else:
+            with open(self.path + '.data', 'ab') as f:
+                data.astype(self.dtype, copy=False).tofile(f)
+            with open(self.path + '.mask', 'ab') as f:
+                mask.tofile(f)
+        self.size += len(data)
+
+    def pad(self, count):
+        # Appends count masked rows
+        if count:
+            dtype = self.dtype if self.objects is None else object
+            self.append(numpy.zeros(count, dtype), numpy.ones(count, bool), self.categories)
+
+    def _can_append(self, dtype, categories):
+        if categories is not self.categories:
+            return False
+        if dtype == self.dtype:
+            return True
+        if dtype.kind not in 'biuf' or self.dtype.kind not in 'biuf':
+            return False
+        # ie ints in one chunk, floats in the next
+        promoted = numpy.promote_types(self.dtype, dtype)
+        if promoted != self.dtype:
+            self._convert(promoted)
+        return True
+
+    def _load(self):
+        if not self.size:
+            return numpy.zeros(0, self.dtype), numpy.zeros(0, bool)
+        # Copy-on-write, changing the arrays doesn't change the files
+        return (
+            numpy.memmap(self.path + '.data', self.dtype, 'c', shape=(self.size,)),
+            numpy.memmap(self.path + '.mask', bool, 'c', shape=(self.size,)),
+        )
+
+    def _convert(self, dtype):
+        data, _ = self._load()
+        with open(self.path + '.convert', 'wb') as f:
+            for start in range(0, self.size, _CONVERT_ROWS):
+                data[start:start + _CONVERT_ROWS].astype(dtype).tofile(f)
+        del data
+        os.remove(self.path + '.data')
+        os.rename(self.path + '.convert', self.path + '.data')
+        self.dtype = dtype
+
+    def _to_objects(self):
+        data, mask = self._load()
+        if self.categories is not None:
+            data = self.categories[data]
+        self.objects = [(data.astype(object), numpy.array(mask))]
+        self.dtype = numpy.dtype(object)
+        self.categories = None
+
+    def build(self):
+        if self.objects is None:
+            data, mask = self._load()
+        elif self.objects:
+            data = numpy.concatenate([data for data, _ in self.objects])
+            mask = numpy.concatenate([mask for _, mask in self.objects])
+        else:
+            data, mask = numpy.zeros(0, object), numpy.zeros(0, bool)
+        return numpy.ma.MaskedArray(data, mask=mask)
+
+
+class _SpilledTable(object):
+    # The columns of one ColumnTable, appended chunk by chunk (see append())
+    __slots__ = ('name', 'size', 'columns', '_paths')
+
+    def __init__(self, name, paths):
+        self.name = name
+        self.size = 0
+        self.columns = {}
+        # Yields a path prefix for each new column
+        self._paths = paths
+
+    def append(self, table):
+        for name, column in self.columns.items():
+            if name not in table.columns:
+                column.pad(table.size)
+        for name, values in table.columns.items():
+            data = numpy.ma.getdata(values)
+            categories = table.categories.get(name)
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = _SpilledColumn(
+                    next(self._paths), data.dtype, table.units.get(name), categories)
+                column.pad(self.size)
+            column.append(data, numpy.ma.getmaskarray(values), categories)
+        self.size += table.size
+
+    def build(self):
+        columns, units, categories = {}, {}, {}
+        for name, column in self.columns.items():
+            columns[name] = column.build()
+            units[name] = column.units
+            if column.categories is not None:
+                categories[name] = column.categories
+        return ColumnTable(self.name, columns, units, self.size, categories)
+
+
+def _add_messages(messages, table_for):
+    # The equivalent of _decode() for messages already parsed
+    for message in messages:
+        table = table_for(message.name, message.mesg_num)
+        if table is not None:
+            table.add_message(message)
+        yield
+
+
+def _spill(fitfile, table_name, memory_budget, directory, fields):
+    # Decodes the data messages of fitfile (only the fields named in fields,
+    # if not None) into ColumnTables named table_name(name, mesg_num)
+    # (skipping those it returns None for), in chunks spilled to files
+    require_numpy()
+
+    processor = fitfile._processor
+    max_rows = max(1, memory_budget // _ROW_SIZE)
+    spill_dir = tempfile.mkdtemp(prefix='fitparse-', dir=directory)
+    paths = (os.path.join(spill_dir, str(n)) for n in itertools.count())
+    builders, spilled = {}, {}
+
+    def table_for(name, mesg_num):
+        name = table_name(name, mesg_num)
+        if name is None:
+            return None
+        builder = builders.get(name)
+        if builder is None:
+            builder = builders[name] = _TableBuilder(name)
+        return builder
+
+    def flush():
+        for name, builder in builders.items():
+            table = spilled.get(name)
+            if table is None:
+                table = spilled[name] = _SpilledTable(name, paths)
+            table.append(builder.build(processor))
+        builders.clear()
+
+    try:
+        # The data is spooled to a file rather than read into memory
+        fork = fitfile._fork_unparsed(bulk=True, spool_dir=spill_dir)
+        if fork is not None:
+            steps = _decode(
+                fitfile, lambda def_mesg: table_for(def_mesg.name, def_mesg.mesg_num), max_size=max_rows,
+                fields=fields, fork=fork,
+            )
+        else:
+            steps = _add_messages(fitfile.get_messages(fields=fields), table_for)
+        for _ in steps:
+            if sum(builder.size for builder in builders.values()) >= max_rows:
+                flush()
+        flush()
+        return dict((name, table.build()) for name, table in spilled.items())
+    finally:
+        # Mapped files stay readable once removed, except on Windows (where
+        # removing them fails, and they're left to the temporary directory)
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def spill_columns(fitfile, name, names, memory_budget=DEFAULT_MEMORY_BUDGET, directory=None, fields=None):
+    """Like decode_columns(), but keeps the messages being decoded to about
+    `memory_budget` bytes: they're decoded in chunks, which are appended to
+    temporary files as they fill. The columns of the ColumnTable returned
+    are memory-mapped arrays of those files (copy-on-write), so they're
+    paged in as they're accessed.
+
+    Temporary files are created in `directory` (the system's temporary
+    directory by default) and removed right away, they're freed along with
+    the arrays. The FIT data (decompressed) is copied to one of them rather
+    than read into memory, the FitFile reads it from there afterwards.
+    Columns of objects (ie strings) are kept in memory.
+    """
+    tables = _spill(
+        fitfile, lambda mesg_name, mesg_num: name if mesg_name in names or mesg_num in names else None,
+        memory_budget, directory, fields,
+    )
+    return tables.get(name) or ColumnTable(name, {}, {}, 0)
+
+
+def spill_tables(fitfile, memory_budget=DEFAULT_MEMORY_BUDGET, directory=None, fields=None):
+    """Like spill_columns(), but returns a dict of message names to
+    ColumnTables for all data messages.
+    """
+    return _spill(fitfile, lambda mesg_name, mesg_num: mesg_name, memory_budget, directory, fields)
@@ -0,0 +1,256 @@
+import array
+import datetime
+
+from fitparse.processors import UTC_REFERENCE, DateTimeConverter
+from fitparse.records import DataMessage, FieldData, message_header
+
+# Python 2 compat
+try:
+    int_types = (int, long)
+except NameError:
+    int_types = (int,)
+
+
+FIT_EPOCH = datetime.datetime.utcfromtimestamp(UTC_REFERENCE)
+_NONE_INT = -(2 ** 63)
+_NAN = float('nan')
+
+
+class _Column(object):
+    # Values of one field of a layout, kept in a typed array when they are
+    # all ints, floats or (whole second) datetimes, otherwise in a list
+    __slots__ = ('kind', 'values', 'valid')
+
+    def __init__(self):
+        self.kind = int
+        self.values = array.array('q')
+        self.valid = 0
+
+    def _encode(self, value):
+        # Returns the typed array representation, or raises ValueError
+        kind = self.kind
+        if kind is int:
+            if value.__class__ not in int_types:
+                raise ValueError
+            return value
+        if kind is float:
+            if value.__class__ is not float:
+                raise ValueError
+            return value
+        if kind is datetime.datetime:
+            if value.__class__ is not datetime.datetime or value.microsecond or value.tzinfo:
+                raise ValueError
+            delta = value - FIT_EPOCH
+            return delta.days * 86400 + delta.seconds
+        return value
+
+    def decode(self, n, to_datetime):
+        value = self.values[n]
+        kind = self.kind
+        if kind is int:
+            return None if value == _NONE_INT else value
+        if kind is float:
+            return None if value != value else value
+        if kind is datetime.datetime:
+            return None if value == _NONE_INT else to_datetime(value)
+        return value
+
+    @staticmethod
+    def _kind_of(value):
+        cls = value.__class__
+        if cls in int_types:
+            return int
+        if cls is float:
+            return float
+        if cls is datetime.datetime and not value.microsecond and value.tzinfo is None:
+            return datetime.datetime
+        return object
+
+    def _convert(self, kind, to_datetime):
+        # Switch the column to kind, in a typed array if no valid value has
+        # been stored yet, otherwise to a list
+        size = len(self.values)
+        if self.valid:
+            self.values = [self.decode(n, to_datetime) for n in range(size)]
+            self.kind = object
+        elif kind is float:
+            self.kind, self.values = float, array.array('d', [_NAN]) * size
+        elif kind is int or kind is datetime.datetime:
+            self.kind, self.values = kind, array.array('q', [_NONE_INT]) * size
+        else:
+            self.kind, self.values = object, [None] * size
+
+    def append(self, value, to_datetime):
+        if value is None:
+            kind = self.kind
+            if kind is int or kind is datetime.datetime:
+                self.values.append(_NONE_INT)
+            elif kind is float:
+                self.values.append(_NAN)
+            else:
+                self.values.append(None)
+            return
+
+        try:
+            self.values.append(self._encode(value))
+        except ValueError:
+            self._convert(self._kind_of(value), to_datetime)
+            return self.append(value, to_datetime)
+        except OverflowError:
+            self._convert(object, to_datetime)
+            return self.append(value, to_datetime)
+        self.valid += 1
+
+
+class _Layout(object):
+    # Data messages sharing a definition message and the same fields (after
+    # subfield resolution, components and processors). Each field has a value
+    # and a raw value column, with one row per message.
+    __slots__ = ('index', 'def_mesg', 'fields', 'names', 'lookup', 'values', 'raw_values', 'headers', 'size')
+
+    def __init__(self, index, def_mesg, field_datas):
+        self.index = index
+        self.def_mesg = def_mesg
+        self.fields = tuple(
+            (fd.field_def, fd.field, fd.parent_field, fd.units) for fd in field_datas
+        )
+        self.names = tuple(fd.name if fd.name else fd.def_num for fd in field_datas)
+        # Same matching as DataMessage.get(): the first field named name
+        self.lookup = {}
+        for n, fd in enumerate(field_datas):
+            keys = []
+            if fd.field:
+                keys.extend((fd.field.name, fd.field.def_num))
+            if fd.parent_field:
+                keys.extend((fd.parent_field.name, fd.parent_field.def_num))
+            if fd.field_def:
+                keys.append(fd.field_def.def_num)
+            for key in keys:
+                self.lookup.setdefault(key, n)
+        self.values = [_Column() for _ in field_datas]
+        self.raw_values = [_Column() for _ in field_datas]
+        # Header bytes of the messages (see MessageHeader.code)
+        self.headers = array.array('h')
+        self.size = 0
+
+
+class CompactDataMessage(DataMessage):
+    """A read-only view of a data message in a CompactMessageStore.
+
+    Works like a DataMessage, but field values live in the store's columns.
+    FieldData objects are only created when asked for (get(), fields and
+    iteration), and changes to them aren't stored.
+    """
+    __slots__ = ('_store', '_layout', '_row')
+
+    def __init__(self, store, layout, row):
+        self._store = store
+        self._layout = layout
+        self._row = row
+
+    @property
+    def header(self):
+        return message_header(self._layout.headers[self._row])
+
+    @property
+    def def_mesg(self):
+        return self._layout.def_mesg
+
+    def _value(self, n):
+        return self._layout.values[n].decode(self._row, self._store._to_datetime)
+
+    def _field_data(self, n):
+        field_def, field, parent_field, units = self._layout.fields[n]
+        field_data = FieldData(
+            field_def=field_def,
+            field=field,
+            parent_field=parent_field,
+            value=self._value(n),
+            raw_value=self._layout.raw_values[n].decode(self._row, self._store._to_datetime),
+        )
+        # Set after creating it, processors may have unset the field's default units
+        field_data.units = units
+        return field_data
+
+    @property
+    def fields(self):
+        return [self._field_data(n) for n in range(len(self._layout.fields))]
+
+    def get(self, field_name, as_dict=False):
+        n = self._layout.lookup.get(field_name)
+        if n is not None:
+            field_data = self._field_data(n)
+            return field_data.as_dict() if as_dict else field_data
+
+    def get_value(self, field_name):
+        n = self._layout.lookup.get(field_name)
+        if n is not None:
+            return self._value(n)
+
+    def get_values(self):
+        return dict((name, self._value(n)) for n, name in enumerate(self._layout.names))
+
+
+class CompactMessageStore(object):
+    """A compact alternative to a list of parsed messages (see FitFile's
+    `compact` option).
+
+    Data messages are grouped by layout and their values are kept in typed
+    array.array columns, so retaining them takes a fraction of the memory of
+    DataMessage and FieldData objects. Reading the store returns
+    CompactDataMessage views.
+    """
+
+    def __init__(self):
+        self._layouts = {}
+        self._layout_list = []
+        self._definitions = []
+        # Per message, in order: layout index (or -1 - index of a definition
+        # message) and row in the layout
+        self._order = array.array('l')
+        self._rows = array.array('l')
+        self._to_datetime = DateTimeConverter()
+
+    def append(self, message):
+        if message.type != 'data':
+            self._order.append(-1 - len(self._definitions))
+            self._rows.append(0)
+            self._definitions.append(message)
+            return
+
+        fields = message.fields
+        key = (message.def_mesg, tuple(
+            (fd.field_def, fd.field, fd.parent_field, fd.units) for fd in fields
+        ))
+        layout = self._layouts.get(key)
+        if layout is None:
+            layout = self._layouts[key] = _Layout(len(self._layout_list), message.def_mesg, fields)
+            self._layout_list.append(layout)
+
+        to_datetime = self._to_datetime
+        for field_data, values, raw_values in zip(fields, layout.values, layout.raw_values):
+            values.append(field_data.value, to_datetime)
+            raw_values.append(field_data.raw_value, to_datetime)
+        layout.headers.append(message.header.code)
+
+        self._order.append(layout.index)
+        self._rows.append(layout.size)
+        layout.size += 1
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._order)
+        layout_index = self._order[index]
+        if layout_index < 0:
+            return self._definitions[-1 - layout_index]
+        return CompactDataMessage(self, self._layout_list[layout_index], self._rows[index])
+
+    def __iter__(self):
+        # Index based, so messages appended while iterating are yielded too
+        index = 0
+        while index < len(self._order):
+            yield self[index]
+            index += 1
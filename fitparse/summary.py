@@ -0,0 +1,367 @@
+from fitparse.base import DEFAULT_CHUNK_SIZE
+from fitparse.columns import ColumnTable, numpy, require_numpy
+
+
+# Meters per second in a unit of speed
+SPEED_UNITS = {'m/s': 1.0, 'km/h': 1 / 3.6, 'mph': 0.44704}
+
+# Seconds of the rolling power average of normalized power
+NORMALIZED_POWER_WINDOW = 30
+
+# Altitude changes (in meters) ignored as noise when adding up the ascent,
+# which matches the devices' total_ascent within about 25% on most test files
+ASCENT_THRESHOLD = 2.5
+
+
+def _first_name(table, names):
+    for name in names:
+        if name in table:
+            return name
+
+
+def _first_column(table, names):
+    name = _first_name(table, names)
+    if name is not None:
+        return table[name]
+
+
+def _valid(column):
+    # Valid values of a column as floats
+    if column is None:
+        return numpy.empty(0)
+    return numpy.ma.getdata(column)[~numpy.ma.getmaskarray(column)].astype(numpy.float64)
+
+
+def _seconds(column):
+    data = numpy.ma.getdata(column)
+    if data.dtype.kind == 'M':
+        return data.astype('datetime64[s]').astype(numpy.int64).astype(numpy.float64)
+    return data.astype(numpy.float64)
+
+
+class ActivitySummary(object):
+    """Running totals of record data, updated a ColumnTable chunk at a time
+    (see add_records()) with constant memory.
+
+    Time is in seconds, the other values are in the units of the record
+    columns (ie meters, or kilometers with StandardUnitsDataProcessor).
+    Records more than `max_gap` seconds apart count as a pause, and as
+    moving if faster than `moving_speed` m/s (or if the distance increased,
+    without a speed column). Climbs count towards the total ascent once
+    they're `ascent_threshold` high, and end once the altitude drops that
+    much below their top, so noise doesn't add up.
+
+    `device` holds the values of the session or lap message the records
+    were summarized for, see compare().
+    """
+
+    # Summary fields and the session and lap fields they correspond to
+    DEVICE_FIELDS = (
+        ('elapsed_time', 'total_elapsed_time'),
+        ('timer_time', 'total_timer_time'),
+        ('moving_time', 'total_moving_time'),
+        ('distance', 'total_distance'),
+        ('avg_heart_rate', 'avg_heart_rate'),
+        ('max_heart_rate', 'max_heart_rate'),
+        ('avg_power', 'avg_power'),
+        ('max_power', 'max_power'),
+        ('normalized_power', 'normalized_power'),
+        ('total_ascent', 'total_ascent'),
+    )
+
+    def __init__(self, name='activity', moving_speed=0.5, max_gap=10, ascent_threshold=ASCENT_THRESHOLD):
+        require_numpy()
+        self.name = name
+        self.moving_speed = moving_speed
+        self.max_gap = max_gap
+        self.ascent_threshold = ascent_threshold
+        self.device = None
+        # Time range of the session or lap
+        self.start_time = None
+        self.end_time = None
+
+        self.records = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.timer_time = 0.0
+        self.moving_time = 0.0
+        self.last_distance = 0
+        self._distance = None
+        # Ascent of the climbs that ended, the lowest altitude since then and
+        # the top of the current climb (None if not climbing)
+        self._ascent = None
+        self._altitude = None
+        self._peak = None
+        self._heart_rate = [0, 0.0, None]
+        self._power = [0, 0.0, None]
+        # Normalized power: last seconds of power, and 4th powers of the
+        # rolling averages
+        self._power_window = numpy.empty(0)
+        self._rolling = [0, 0.0]
+
+    def add_records(self, table):
+        """Adds a ColumnTable of record messages."""
+        if not table.size:
+            return
+        self.records += table.size
+
+        if 'timestamp' in table:
+            column = table['timestamp']
+            has_time = ~numpy.ma.getmaskarray(column)
+            times = _seconds(column)[has_time]
+        else:
+            has_time = numpy.zeros(table.size, dtype=bool)
+            times = numpy.empty(0)
+        previous = self.last_timestamp
+        if len(times):
+            if self.first_timestamp is None:
+                self.first_timestamp = previous = float(times[0])
+            self.last_timestamp = float(times[-1])
+        intervals = numpy.diff(numpy.concatenate(([previous], times))) if len(times) else times
+        counted = (intervals > 0) & (intervals <= self.max_gap)
+        self.timer_time += float(intervals[counted].sum())
+
+        distance = _first_column(table, ('distance',))
+        speed_name = _first_name(table, ('speed', 'enhanced_speed'))
+        if speed_name is not None:
+            speed = table[speed_name]
+            factor = SPEED_UNITS.get(table.units.get(speed_name), 1.0)
+            moving = (numpy.ma.filled(speed.astype(numpy.float64), 0) * factor > self.moving_speed)[has_time]
+        elif distance is not None:
+            moving = numpy.ma.filled(numpy.ma.diff(numpy.ma.concatenate((
+                [self.last_distance], distance.astype(numpy.float64)))) > 0, False)[has_time]
+        else:
+            moving = numpy.zeros(len(times), dtype=bool)
+        self.moving_time += float(intervals[counted & moving].sum())
+
+        # Distance restarts (ie in multisport files) are skipped
+        distances = _valid(distance)
+        if len(distances):
+            steps = numpy.diff(numpy.concatenate(([self.last_distance], distances)))
+            self._distance = (self._distance or 0) + float(steps[steps > 0].sum())
+            self.last_distance = float(distances[-1])
+
+        altitudes = _valid(_first_column(table, ('enhanced_altitude', 'altitude')))
+        if len(altitudes):
+            self._add_altitudes(altitudes)
+
+        for stats, column in ((self._heart_rate, table.columns.get('heart_rate')),
+                              (self._power, table.columns.get('power'))):
+            values = _valid(column)
+            if len(values):
+                stats[0] += len(values)
+                stats[1] += float(values.sum())
+                stats[2] = max(float(values.max()), stats[2]) if stats[2] is not None else float(values.max())
+
+        if self._power[0] and 'power' in table:
+            self._add_power(numpy.ma.filled(table['power'].astype(numpy.float64), 0)[has_time], intervals)
+
+    def _add_altitudes(self, altitudes):
+        if self._ascent is None:
+            self._ascent = 0.0
+            self._altitude = float(altitudes[0])
+
+        if not self.ascent_threshold:
+            steps = numpy.diff(numpy.concatenate(([self._altitude], altitudes)))
+            self._ascent += float(steps[steps > 0].sum())
+            self._altitude = float(altitudes[-1])
+            return
+
+        # A climb starts ascent_threshold above the lowest altitude since the
+        # last one, and ends ascent_threshold below its top
+        threshold, low, peak = self.ascent_threshold, self._altitude, self._peak
+        for altitude in altitudes.tolist():
+            if peak is not None:
+                if altitude > peak:
+                    peak = altitude
+                elif peak - altitude >= threshold:
+                    self._ascent += peak - low
+                    low, peak = altitude, None
+            elif altitude < low:
+                low = altitude
+            elif altitude - low >= threshold:
+                peak = altitude
+        self._altitude, self._peak = low, peak
+
+    def _add_power(self, power, intervals):
+        # Power as a 1 second series, each value held for the time since the
+        # previous record (1 second after pauses)
+        seconds = numpy.where(
+            (intervals >= 1) & (intervals <= self.max_gap), numpy.round(intervals), 1,
+        ).astype(numpy.intp)
+        series = numpy.concatenate((self._power_window, numpy.repeat(power, seconds)))
+        window = NORMALIZED_POWER_WINDOW
+        if len(series) >= window:
+            sums = numpy.cumsum(numpy.concatenate(([0.0], series)))
+            rolling = (sums[window:] - sums[:-window]) / window
+            self._rolling[0] += len(rolling)
+            self._rolling[1] += float((rolling ** 4).sum())
+        self._power_window = series[-(window - 1):]
+
+    @property
+    def elapsed_time(self):
+        if self.first_timestamp is None:
+            return None
+        return self.last_timestamp - self.first_timestamp
+
+    @property
+    def distance(self):
+        return self._distance
+
+    @property
+    def total_ascent(self):
+        if self._ascent is None:
+            return None
+        if self._peak is not None:
+            # The current climb
+            return self._ascent + self._peak - self._altitude
+        return self._ascent
+
+    @property
+    def avg_heart_rate(self):
+        count, total, _ = self._heart_rate
+        return total / count if count else None
+
+    @property
+    def max_heart_rate(self):
+        return self._heart_rate[2]
+
+    @property
+    def avg_power(self):
+        count, total, _ = self._power
+        return total / count if count else None
+
+    @property
+    def max_power(self):
+        return self._power[2]
+
+    @property
+    def normalized_power(self):
+        count, total = self._rolling
+        return (total / count) ** 0.25 if count else None
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name, _ in self.DEVICE_FIELDS)
+
+    def compare(self):
+        """Returns a dict of summary field names to (computed value, device
+        value) tuples, for the fields the device provided.
+        """
+        if not self.device:
+            return {}
+        return dict(
+            (name, (getattr(self, name), self.device[device_name]))
+            for name, device_name in self.DEVICE_FIELDS
+            if self.device.get(device_name) is not None
+        )
+
+    def __repr__(self):
+        return '<ActivitySummary: %s -- %d records>' % (self.name, self.records)
+
+
+class ActivityReport(object):
+    """Summaries of an activity and of its sessions and laps, updated from
+    a stream of record ColumnTable chunks (see add()).
+
+    Records are summarized for the activity and for the session and lap
+    whose time range (start_time to timestamp) they're in, so `sessions`
+    and `laps` (ColumnTables of session and lap messages) are needed up
+    front. Their values become the summaries' `device` values, to
+    cross-check them (see ActivitySummary.compare()). Keyword arguments are
+    passed on to the ActivitySummary objects.
+    """
+
+    def __init__(self, sessions=(), laps=(), **options):
+        self.options = options
+        self.total = ActivitySummary('activity', **options)
+        self.sessions = self._summaries('session', sessions)
+        self.laps = self._summaries('lap', laps)
+        if len(self.sessions) == 1:
+            self.total.device = self.sessions[0].device
+        self._ranges = [self._time_ranges(self.sessions), self._time_ranges(self.laps)]
+        self._last_distance = 0
+
+    def _summaries(self, name, tables):
+        if isinstance(tables, ColumnTable):
+            tables = [tables]
+        summaries = []
+        for table in tables:
+            for row in range(table.size):
+                summary = ActivitySummary(name, **self.options)
+                summary.device = dict((column, values[row:row + 1].tolist()[0]) for column, values in table.items())
+                if 'start_time' in table and 'timestamp' in table:
+                    start_time, end_time = table['start_time'][row:row + 1], table['timestamp'][row:row + 1]
+                    if not (numpy.ma.is_masked(start_time) or numpy.ma.is_masked(end_time)):
+                        summary.start_time = float(_seconds(start_time)[0])
+                        summary.end_time = float(_seconds(end_time)[0])
+                summaries.append(summary)
+        return summaries
+
+    @staticmethod
+    def _time_ranges(summaries):
+        # Start and end times, and summaries sorted by start time
+        timed = sorted((s for s in summaries if s.start_time is not None), key=lambda s: s.start_time)
+        return (
+            numpy.array([s.start_time for s in timed], dtype=numpy.float64),
+            numpy.array([s.end_time for s in timed], dtype=numpy.float64),
+            timed,
+        )
+
+    def add(self, table):
+        """Adds a ColumnTable of record messages."""
+        self.total.add_records(table)
+        if not table.size or 'timestamp' not in table:
+            return
+
+        times = _seconds(table['timestamp'])
+        has_time = ~numpy.ma.getmaskarray(table['timestamp'])
+        # Last valid distance before each row, for summaries starting there
+        distance = table.columns.get('distance')
+        if distance is not None:
+            rows = numpy.where(~numpy.ma.getmaskarray(distance), numpy.arange(table.size), -1)
+            last_rows = numpy.maximum.accumulate(rows)
+            distances = numpy.ma.getdata(distance)
+
+        for starts, ends, summaries in self._ranges:
+            if not summaries:
+                continue
+            index = numpy.searchsorted(starts, times, side='right') - 1
+            index[~has_time | (index < 0)] = -1
+            index[(index >= 0) & (times > ends[numpy.maximum(index, 0)])] = -1
+
+            # Runs of rows in the same session or lap
+            bounds = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(index)) + 1, [table.size]))
+            for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                if index[start] < 0:
+                    continue
+                summary = summaries[index[start]]
+                if not summary.records and distance is not None:
+                    previous = last_rows[start - 1] if start else -1
+                    summary.last_distance = float(distances[previous]) if previous >= 0 else self._last_distance
+                summary.add_records(table.slice(start, stop))
+
+        if distance is not None and last_rows[-1] >= 0:
+            self._last_distance = float(distances[last_rows[-1]])
+
+    def __repr__(self):
+        return '<ActivityReport: %d records, %d sessions, %d laps>' % (
+            self.total.records, len(self.sessions), len(self.laps))
+
+
+def summarize(fitfile, chunk_size=DEFAULT_CHUNK_SIZE, **options):
+    """Summarizes the records of a FitFile, see ActivityReport.
+
+    This reads the file in two passes: session and lap messages (usually
+    at the end of the file) are read first, then records are summarized a
+    chunk at a time, so memory doesn't grow with the number of records.
+    Both are decoded in bulk when possible, without creating message
+    objects.
+    """
+    tables = {'session': [], 'lap': []}
+    for table in fitfile.get_column_chunks(name=('session', 'lap'), chunk_size=chunk_size):
+        tables[table.name].append(table)
+
+    report = ActivityReport(sessions=tables['session'], laps=tables['lap'], **options)
+    for table in fitfile.get_column_chunks(name='record', chunk_size=chunk_size):
+        report.add(table)
+    return report
@@ -1,5 +1,22 @@
+import gzip
+import io
 import re
 
+# Python 2 compat
+try:
+    str = basestring
+except NameError:
+    pass
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+try:
+    import lzma
+except ImportError:  # Python 2
+    lzma = None
+
 
 class FitParseError(ValueError):
     pass
@@ -33,6 +50,34 @@ def calc_crc(byte_arr, crc=0):
     return crc
 
 
+def _crc_times(matrix, crc):
+    # Applies a linear map of CRCs (the images of each bit) to crc
+    result, n = 0, 0
+    while crc:
+        if crc & 1:
+            result ^= matrix[n]
+        crc >>= 1
+        n += 1
+    return result
+
+
+def crc_combine(crc1, crc2, size2):
+    """Returns the CRC of two blocks of data, given the CRC of the first
+    (`crc1`), the CRC of the second starting from 0 (`crc2`) and its size,
+    so blocks can be checked independently.
+    """
+    # The CRC is linear: calc_crc(data, crc1) is crc2 combined with crc1
+    # run through size2 zero bytes, done by squaring the map of one byte
+    matrix = [calc_crc(b'\x00', 1 << n) for n in range(16)]
+    while size2:
+        if size2 & 1:
+            crc1 = _crc_times(matrix, crc1)
+        size2 >>= 1
+        if size2:
+            matrix = [_crc_times(matrix, column) for column in matrix]
+    return crc1 ^ crc2
+
+
 METHOD_NAME_SCRUBBER = re.compile(r'\W|^(?=\d)')
 UNIT_NAME_TO_FUNC_REPLACEMENTS = (
     ('/', ' per '),
@@ -47,3 +92,216 @@ def scrub_method_name(method_name, convert_units=False):
                 replace_from, '%s' % replace_to,
             )
     return METHOD_NAME_SCRUBBER.sub('_', method_name)
+
+
+# Magic bytes of the supported compressed formats. They can't be confused with
+# a FIT file, which starts with its header size (12 or 14)
+COMPRESSION_MAGIC = (
+    (b'\x1f\x8b', lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode='rb')),
+    (b'BZh', lambda fileobj: bz2.BZ2File(fileobj)),
+    (b'\xfd7zXZ\x00', lambda fileobj: lzma.LZMAFile(fileobj)),
+)
+DECOMPRESS_BUFFER_SIZE = 256 * 1024
+# Size of the blocks FitFile reads its data in (see BlockReader)
+READ_BUFFER_SIZE = 256 * 1024
+
+
+class _PrefixedFile(object):
+    # Puts back bytes already read from a file object that can't seek or peek
+
+    def __init__(self, prefix, fileobj):
+        self._prefix = prefix
+        self._file = fileobj
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._file.read(size)
+        if size is None or size < 0:
+            data, self._prefix = self._prefix + self._file.read(), b''
+            return data
+        data, self._prefix = self._prefix[:size], self._prefix[size:]
+        if len(data) < size:
+            data += self._file.read(size - len(data))
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return getattr(self._file, 'closed', False)
+
+    def close(self):
+        if hasattr(self._file, 'close'):
+            self._file.close()
+
+
+class _DecompressedFile(io.BufferedReader):
+    # Reads decompressed data in large chunks, and closes the compressed
+    # source along with the decompressor (they don't close file objects
+    # they were given)
+
+    def __init__(self, decompressor, source):
+        super(_DecompressedFile, self).__init__(decompressor, buffer_size=DECOMPRESS_BUFFER_SIZE)
+        self._source = source
+
+    def close(self):
+        super(_DecompressedFile, self).close()
+        if hasattr(self._source, 'close'):
+            self._source.close()
+
+
+class BlockReader(object):
+    """Serves reads of a file object from blocks of `block_size` bytes, so
+    parsing doesn't cost a read() call (or a system call, for unbuffered
+    sources) per message header and field.
+
+    Only reads forward, so sources that can't seek (pipes, sockets, stdin)
+    work too. Short reads of the source are retried until it's exhausted.
+    """
+
+    def __init__(self, fileobj, block_size=READ_BUFFER_SIZE):
+        self._file = fileobj
+        self._block_size = block_size
+        self._block = b''
+        # Position within the block, and of the block within the file
+        self._position = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        position = self._position
+        end = position + size
+        if 0 <= size and end <= len(self._block):
+            self._position = end
+            return self._block[position:end]
+        return self._read_blocks(size)
+
+    def _read_blocks(self, size):
+        # The rest of the block, followed by more blocks until there's
+        # enough data (or all of it, for a negative size)
+        chunks = [memoryview(self._block)[self._position:]]
+        available = len(chunks[0])
+        while size is None or size < 0 or available < size:
+            block = self._file.read(self._block_size if size is None or size < 0 else
+                                    max(self._block_size, size - available))
+            if not block:
+                break
+            chunks.append(block)
+            available += len(block)
+
+        data = b''.join(chunks)
+        self._offset += self._position
+        if size is None or size < 0 or len(data) <= size:
+            self._block, self._position = b'', 0
+            self._offset += len(data)
+            return data
+        # Keep what's beyond size for the next reads
+        self._block, self._position = data, size
+        return data[:size]
+
+    def tell(self):
+        return self._offset + self._position
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return getattr(self._file, 'closed', False)
+
+    def close(self):
+        if hasattr(self._file, 'close'):
+            self._file.close()
+
+
+def buffered(fileobj):
+    """Returns a BlockReader of `fileobj`, or `fileobj` itself if it's
+    already in memory.
+    """
+    if isinstance(fileobj, (io.BytesIO, BlockReader)):
+        return fileobj
+    return BlockReader(fileobj)
+
+
+def _read_fully(fileobj, size):
+    # Reads size bytes unless the data ends first (a single read of a pipe
+    # may return fewer)
+    chunks = []
+    while size > 0:
+        chunk = fileobj.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def peek(fileobj, size):
+    """Returns up to `size` bytes from the start of `fileobj` without
+    consuming them, along with the file object to continue reading from.
+    """
+    position = None
+    if hasattr(fileobj, 'peek'):
+        data = fileobj.peek(size)[:size]
+        if len(data) == size:
+            return data, fileobj
+    else:
+        try:
+            position = fileobj.tell()
+        except (AttributeError, IOError, OSError):
+            pass
+
+    data = _read_fully(fileobj, size)
+    if position is not None:
+        try:
+            fileobj.seek(position)
+            return data, fileobj
+        except (AttributeError, IOError, OSError):
+            pass
+    # Bytes read from files that can't seek are put back
+    return data, _PrefixedFile(data, fileobj)
+
+
+def open_decompressed(fileobj):
+    """Detects gzip, bz2 and xz compressed data by its magic bytes.
+
+    Returns a file object that stream-decompresses the data if it's
+    compressed, otherwise a file object reading `fileobj` as is. Neither
+    needs to seek, so pipes and stdin work.
+    """
+    magic, fileobj = peek(fileobj, 6)
+    for prefix, decompressor in COMPRESSION_MAGIC:
+        if magic.startswith(prefix):
+            try:
+                return _DecompressedFile(decompressor(fileobj), fileobj)
+            except AttributeError:
+                # The compression module isn't available (ie lzma on Python 2)
+                raise FitParseError('Unsupported compressed .FIT file')
+    return fileobj
+
+
+def open_fileish(fileish):
+    """Returns a file object reading `fileish`: a file object, a path or the
+    file contents (bytes), stream-decompressing it if it's compressed (see
+    open_decompressed()).
+    """
+    if hasattr(fileish, 'read'):
+        # BytesIO-like object
+        fileobj = fileish
+    elif isinstance(fileish, str):
+        # Python2 - file path, file contents in the case of a TypeError
+        # Python3 - file path
+        try:
+            fileobj = open(fileish, 'rb')
+        except TypeError:
+            fileobj = io.BytesIO(fileish)
+    else:
+        # Python 3 - file contents
+        fileobj = io.BytesIO(fileish)
+
+    return open_decompressed(fileobj)
@@ -1,16 +1,50 @@
 #!/usr/bin/env python
 
+import bz2
 import csv
 import datetime
+import gzip
 import io
+import json
 import os
+import pickle
+import shutil
 from struct import pack
 import sys
-
-from fitparse import FitFile
-from fitparse.processors import UTC_REFERENCE, StandardUnitsDataProcessor
+import tempfile
+import threading
+import tracemalloc
+import warnings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pandas
+except ImportError:
+    pandas = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from fitparse import FitFile, definitions, filters, records, shared as shared_module
+from fitparse.cache import FitCache
+from fitparse.columns import ColumnTable, build_tables, enum_categories, object_array
+from fitparse.export import CSVTableWriter, ParquetTableWriter, TableExporter, export_files, write_ndjson
+from fitparse.index import build_index
+from fitparse.parallel import parse_parallel
+from fitparse.processors import (
+    UTC_REFERENCE, DateTimeConverter, FitFileDataProcessor, StandardUnitsDataProcessor, UnitConversion,
+)
+from fitparse.profile import MESSAGE_TYPES
 from fitparse.records import BASE_TYPES
-from fitparse.utils import calc_crc, FitEOFError, FitCRCError, FitHeaderError
+from fitparse.resample import Resampler, resample
+from fitparse.segments import map_segments, read_segments, scan_segments
+from fitparse.shared import SharedTables, map_shared_tables, shared_memory
+from fitparse.summary import ActivitySummary, summarize
+from fitparse.utils import BlockReader, calc_crc, FitEOFError, FitCRCError, FitHeaderError, FitParseError
 
 if sys.version_info >= (2, 7):
     import unittest
@@ -77,6 +111,10 @@ def testfile(filename):
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'files', filename)
 
 
+def message_values(fitfile):
+    return [message.get_values() for message in fitfile.get_messages()]
+
+
 class FitFileTestCase(unittest.TestCase):
     def test_basic_file_with_one_record(self, endian='<'):
         f = FitFile(generate_fitfile(endian=endian))
@@ -324,6 +362,118 @@ class FitFileTestCase(unittest.TestCase):
         FitFile(testfile('20170518-191602-1740899583.fit')).parse()
         FitFile(testfile('DeveloperData.fit')).parse()
 
+    def test_developer_types_per_file(self):
+        fitfile = FitFile(testfile('developer-types-sample.fit'))
+        fitfile.parse()
+        self.assertTrue(fitfile._context.dev_types)
+        self.assertEqual(records.DEV_TYPES, {})
+
+    def test_threads(self):
+        filenames = ('developer-types-sample.fit', 'compressed-speed-distance.fit', 'activity-settings.fit')
+
+        def values(messages):
+            return [message.get_values() for message in messages]
+
+        expected = dict((filename, values(FitFile(testfile(filename)).get_messages())) for filename in filenames)
+        results = {}
+
+        def parse(filename, n):
+            results[filename, n] = values(FitFile(testfile(filename)).get_messages())
+
+        threads = [threading.Thread(target=parse, args=(filename, n)) for filename in filenames for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for (filename, n), result in results.items():
+            self.assertEqual(result, expected[filename])
+        self.assertEqual(len(results), len(threads))
+
+        # Iterating one FitFile from several threads, each sees all messages
+        fitfile = FitFile(testfile('compressed-speed-distance.fit'))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(values(fitfile.get_messages()))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [expected['compressed-speed-distance.fit']] * 4)
+
+        # Definitions are compiled once and shared between files
+        definitions = [
+            [message.field_defs for message in FitFile(testfile('activity-settings.fit')).get_messages(with_definitions=True)
+             if message.type == 'definition']
+            for _ in range(2)
+        ]
+        for first, second in zip(*definitions):
+            self.assertIs(first, second)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_columns_while_parsing_in_thread(self):
+        fit_path = testfile('garmin-edge-500-activity.fit')
+        expected = FitFile(fit_path).get_columns('record')
+
+        # Another thread parses right after the file is found unparsed. It
+        # has to wait for the file to be forked.
+        fitfile = FitFile(fit_path)
+        can_decode_bulk = fitfile._can_decode_bulk
+        threads = []
+
+        def parse_after_check():
+            result = can_decode_bulk()
+            if not threads:
+                threads.append(threading.Thread(target=fitfile.parse))
+                threads[0].start()
+                threads[0].join(0.5)
+            return result
+
+        fitfile._can_decode_bulk = parse_after_check
+        columns = fitfile.get_columns('record')
+        threads[0].join()
+        self.assertEqual(len(columns), len(expected))
+        self.assertEqual(columns['timestamp'].tolist(), expected['timestamp'].tolist())
+
+    def test_definition_cache(self):
+        # record: timestamp (uint32), heart_rate (uint8), compressed_speed_distance (byte[3])
+        data = pack('<BHB9B', 0, 20, 3, 253, 4, 0x86, 3, 1, 2, 8, 3, 0x0D)
+        definition = definitions.get_definition(data)
+        self.assertIs(definitions.get_definition(data), definition)
+        self.assertEqual([fd.name for fd in definition.field_defs], ['timestamp', 'heart_rate', 'compressed_speed_distance'])
+        self.assertEqual(definition.accumulated, (5,))
+        self.assertEqual(
+            definition.decode(pack('<IB3B', 1000, 0xFF, 0x64, 0x00, 0x01)),
+            [1000, None, (0x64, 0x00, 0x01)])
+
+        # Least recently used definitions are dropped
+        cache_size = definitions.DEFINITION_CACHE_SIZE
+        definitions.DEFINITION_CACHE_SIZE = 2
+        try:
+            definitions.get_definition(pack('<BHB3B', 0, 20, 1, 3, 1, 2))
+            definitions.get_definition(data)
+            definitions.get_definition(pack('<BHB3B', 0, 20, 1, 4, 2, 0x84))
+            self.assertIs(definitions.get_definition(data), definition)
+            self.assertEqual(len(definitions._definitions), 2)
+        finally:
+            definitions.DEFINITION_CACHE_SIZE = cache_size
+
+    def test_message_headers(self):
+        # One shared, immutable header per header byte
+        for code in range(256):
+            header = records.MESSAGE_HEADERS[code]
+            self.assertIs(records.message_header(code), header)
+            self.assertIs(pickle.loads(pickle.dumps(header, pickle.HIGHEST_PROTOCOL)), header)
+            self.assertEqual(header.code, code & ~0x10 if code < 0x80 else code)
+        self.assertEqual(
+            (records.message_header(0xC3).is_definition, records.message_header(0xC3).local_mesg_num,
+             records.message_header(0xC3).time_offset),
+            (False, 2, 3))
+        with self.assertRaises(AttributeError):
+            records.message_header(0x40).local_mesg_num = 1
+
+        messages = FitFile(testfile('compressed-speed-distance.fit')).get_messages(with_definitions=True)
+        for message in messages:
+            self.assertIs(message.header, records.message_header(message.header.code))
+
     def test_invalid_crc(self):
         try:
             FitFile(testfile('activity-filecrc.fit')).parse()
@@ -341,6 +491,162 @@ class FitFileTestCase(unittest.TestCase):
     def test_chained_file(self):
         FitFile(testfile('activity-settings.fit')).parse()
 
+    def test_chained_file_segments(self):
+        segments = read_segments(testfile('activity-settings.fit'))
+        self.assertEqual([(s.offset, s.data_size) for s in segments], [(0, 757), (771, 68)])
+        self.assertEqual(sum(s.size for s in segments), os.path.getsize(testfile('activity-settings.fit')))
+
+        expected = message_values(FitFile(testfile('activity-settings.fit')))
+        for processes in (1, 2):
+            values = map_segments(testfile('activity-settings.fit'), message_values, processes=processes)
+            self.assertEqual(len(values), 2)
+            self.assertEqual(values[0] + values[1], expected)
+
+        with open(testfile('activity-settings.fit'), 'rb') as f:
+            data = f.read()
+        self.assertRaises(FitEOFError, scan_segments, data[:-1])
+        self.assertRaises(FitHeaderError, scan_segments, data + b'\x00' * 12)
+
+    def test_probe(self):
+        for filename in ('garmin-edge-500-activity.fit', 'developer-types-sample.fit', 'activity-settings.fit'):
+            fitfile = FitFile(testfile(filename))
+            fitfile.parse()
+            file_ids = [m.get_values() for m in fitfile.get_messages('file_id')]
+            sessions = [m.get_values() for m in fitfile.get_messages('session')]
+
+            probed = FitFile.probe(testfile(filename))
+            self.assertEqual(sorted(probed), ['file_id', 'profile_version', 'protocol_version', 'session'])
+            self.assertEqual(probed['profile_version'], FitFile(testfile(filename)).profile_version)
+            self.assertEqual(probed['file_id'].get_values(), file_ids[0])
+            self.assertEqual(probed['session'] and probed['session'].get_values(), sessions[0] if sessions else None)
+
+            # The last messages, across chained files
+            probed = FitFile.probe(testfile(filename), name=('file_id', '18', 'activity'), tail=True)
+            self.assertEqual(probed['file_id'].get_values(), file_ids[-1])
+            self.assertEqual(probed['18'] and probed['18'].get_values(), sessions[-1] if sessions else None)
+            self.assertEqual(probed['activity'] is None, not list(fitfile.get_messages('activity')))
+
+    def test_get_messages_fields(self):
+        def projected(messages, fields):
+            return [dict((k, v) for k, v in m.get_values().items() if k in fields) for m in messages]
+
+        fit_path = testfile('garmin-edge-500-activity.fit')
+        events = list(FitFile(fit_path).get_messages('event'))
+        # Subfields are resolved with reference fields that aren't decoded
+        for fields in (['timer_trigger', 'timestamp'], ['data']):
+            messages = list(FitFile(fit_path).get_messages('event', fields=fields))
+            names = set(fields)
+            if fields == ['data']:
+                names.update(f.name for m in events for f in m.fields if f.parent_field is not None)
+            self.assertEqual([m.get_values() for m in messages], projected(events, names))
+
+        # Accumulated components, developer fields
+        for filename, fields in (('compressed-speed-distance.fit', ['distance', 'timestamp']),
+                                 ('DeveloperData.fit', ['doughnuts_earned', 'field_name'])):
+            messages = list(FitFile(testfile(filename)).get_messages(fields=fields))
+            self.assertEqual(
+                [m.get_values() for m in messages], projected(FitFile(testfile(filename)).messages, fields))
+
+        # Messages that are already parsed are projected
+        fitfile = FitFile(fit_path)
+        fitfile.parse()
+        messages = list(fitfile.get_messages('event', fields='event_type'))
+        self.assertEqual([m.get_values() for m in messages], projected(events, ['event_type']))
+
+    def test_get_messages_where(self):
+        def value(message, name):
+            for field_data in message.fields:
+                if field_data.name == name:
+                    return filters.field_value(field_data)
+
+        for filename in ('garmin-edge-500-activity.fit', 'compressed-speed-distance.fit', 'DeveloperData.fit'):
+            fit_path = testfile(filename)
+            messages = FitFile(fit_path).messages
+            for name, where, test in (
+                    ('record', filters.field('speed') >= 3.2, lambda m: (value(m, 'speed') or 0) >= 3.2),
+                    ('record', filters.field('distance') > 500, lambda m: (value(m, 'distance') or 0) > 500),
+                    ('record', (filters.field('heart_rate') >= 120) & ~(filters.field('cadence') < 80),
+                     lambda m: (value(m, 'heart_rate') or 0) >= 120 and value(m, 'cadence') not in range(80)),
+                    ('event', filters.field('event_type').isin(['start', 'stop']),
+                     lambda m: value(m, 'event_type') in ('start', 'stop')),
+                    ('record', filters.field('timestamp') > datetime.datetime(2011, 9, 1), None)):
+                expected = [m.get_values() for m in messages if m.name == name and (test or where.matches)(m)]
+                self.assertEqual([m.get_values() for m in FitFile(fit_path).get_messages(name, where=where)],
+                                 expected)
+
+                # With a projection of other fields, and on a parsed file
+                self.assertEqual(
+                    [m.get_values() for m in FitFile(fit_path).get_messages(name, where=where, fields='timestamp')],
+                    [dict((k, v) for k, v in values.items() if k == 'timestamp') for values in expected])
+                fitfile = FitFile(fit_path)
+                fitfile.parse()
+                self.assertEqual([m.get_values() for m in fitfile.get_messages(name, where=where)], expected)
+
+    def test_get_messages_recycle(self):
+        for filename in ('garmin-edge-500-activity.fit', 'compressed-speed-distance.fit', 'DeveloperData.fit'):
+            values = [m.get_values() for m in FitFile(testfile(filename)).get_messages()]
+            messages = FitFile(testfile(filename)).get_messages(recycle=True)
+            self.assertEqual([m.get_values() for m in messages], values)
+
+        # The objects of the previous message are reused
+        fitfile = FitFile(testfile('garmin-edge-500-activity.fit'))
+        messages = fitfile.get_messages('record', recycle=True)
+        first = next(messages)
+        field_datas = list(first.fields)
+        second = next(messages)
+        self.assertIs(first, second)
+        self.assertTrue(set(map(id, field_datas)) & set(map(id, second.fields)))
+        self.assertEqual(len(fitfile.messages), len(FitFile(testfile('garmin-edge-500-activity.fit')).messages))
+
+    def test_get_last_messages(self):
+        for filename in ('garmin-edge-500-activity.fit', 'compressed-speed-distance.fit',
+                         'developer-types-sample.fit', 'activity-settings.fit'):
+            messages = FitFile(testfile(filename)).messages
+            for name in (('session',), ('lap', 'activity'), ('record',), ('file_id',)):
+                values = [m.get_values() for m in messages if m.name in name]
+                fitfile = FitFile(testfile(filename))
+                self.assertEqual([m.get_values() for m in fitfile.get_last_messages(name, count=2)], values[-2:])
+                self.assertEqual(fitfile.get_last_messages(name, count=0), [])
+
+            # Still unparsed
+            self.assertEqual(message_values(fitfile), [m.get_values() for m in messages])
+            self.assertEqual([m.get_values() for m in fitfile.get_last_messages('file_id')], values[-1:])
+
+        # Every message decoded on its own
+        index = build_index(FitFile(testfile('compressed-speed-distance.fit')))
+        self.assertEqual(
+            [m.get_values() for m in index.get_messages(set(index.entries))],
+            message_values(FitFile(testfile('compressed-speed-distance.fit'))),
+        )
+
+    def test_parse_parallel(self):
+        for filename in ('compressed-speed-distance.fit', 'developer-types-sample.fit', 'activity-settings.fit'):
+            expected = [
+                m.get_values() if m.type == 'data' else m.name
+                for m in FitFile(testfile(filename)).get_messages(with_definitions=True)
+            ]
+            for processes in (1, 2):
+                fitfile = FitFile(testfile(filename))
+                parse_parallel(fitfile, processes=processes, chunk_size=256)
+                messages = list(fitfile.get_messages(with_definitions=True))
+                self.assertEqual([m.get_values() if m.type == 'data' else m.name for m in messages], expected)
+                # Data messages refer to the definition messages before them
+                definitions = [m for m in messages if m.type == 'definition']
+                self.assertTrue(all(
+                    any(m.def_mesg is d for d in definitions) for m in messages if m.type == 'data'))
+
+        # Messages pickle with references to the profile
+        message = pickle.loads(pickle.dumps(messages[-1], pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(message.get_values(), messages[-1].get_values())
+        self.assertIs(message.fields[0].field, messages[-1].fields[0].field)
+
+        fitfile = FitFile(testfile('garmin-edge-500-activity.fit'))
+        fitfile.parse(processes=2)
+        self.assertEqual(len(fitfile.messages), 10915)
+
+        self.assertRaises(FitCRCError, parse_parallel, FitFile(testfile('activity-activity-filecrc.fit')), 1, 256)
+        parse_parallel(FitFile(testfile('activity-activity-filecrc.fit'), check_crc=False), 1, 256)
+
     def test_invalid_chained_files(self):
         """Detect errors when files are chained together
 
@@ -413,15 +719,720 @@ class FitFileTestCase(unittest.TestCase):
         with open(testfile("nametest.FIT"), 'rb') as f:
             FitFile(io.BytesIO(f.read()))
 
+    def test_compressed_files(self):
+        with open(testfile('activity-settings.fit'), 'rb') as f:
+            fit_data = f.read()
+        expected = [m.get_values() for m in FitFile(fit_data).get_messages()]
+
+        for compress in (gzip.compress, bz2.compress):
+            messages = FitFile(compress(fit_data)).get_messages()
+            self.assertEqual([m.get_values() for m in messages], expected)
+
+    def test_non_seekable_stream(self):
+        class Pipe(object):
+            def __init__(self, data):
+                self._data = io.BytesIO(data)
+
+            def read(self, size=-1):
+                return self._data.read(size)
+
+        with open(testfile('activity-settings.fit'), 'rb') as f:
+            fit_data = f.read()
+        self.assertEqual(len(FitFile(Pipe(fit_data)).messages), len(FitFile(fit_data).messages))
+        self.assertEqual(len(FitFile(Pipe(gzip.compress(fit_data))).messages), len(FitFile(fit_data).messages))
+
+        class TrickledPipe(Pipe):
+            # Returns a byte per read, tells but can't seek
+            def read(self, size=-1):
+                return self._data.read(1 if size > 0 else size)
+
+            def tell(self):
+                return self._data.tell()
+
+            def seek(self, offset, whence=0):
+                raise io.UnsupportedOperation('seek')
+
+        for data in (fit_data, gzip.compress(fit_data)):
+            self.assertEqual(len(FitFile(TrickledPipe(data)).messages), len(FitFile(fit_data).messages))
+
+    def test_block_reader(self):
+        class Socket(object):
+            # Returns at most 5 bytes per read, counting the reads
+            def __init__(self, data):
+                self._data = io.BytesIO(data)
+                self.reads = 0
+
+            def read(self, size=-1):
+                self.reads += 1
+                return self._data.read(min(size, 5))
+
+        data = bytes(bytearray(range(256))) * 4
+        reader = BlockReader(Socket(data), block_size=64)
+        self.assertEqual(reader.read(3), data[:3])
+        self.assertEqual(reader.read(100), data[3:103])
+        self.assertEqual(reader.tell(), 103)
+        self.assertEqual(reader.read(0), b'')
+        self.assertEqual(reader.read(), data[103:])
+        self.assertEqual(reader.read(12), b'')
+
+        with open(testfile('activity-settings.fit'), 'rb') as f:
+            fit_data = f.read()
+        source = Socket(fit_data * 2)
+        fitfile = FitFile(source)
+        self.assertEqual(
+            [m.get_values() for m in fitfile.get_messages()],
+            [m.get_values() for m in FitFile(fit_data * 2).get_messages()],
+        )
+        # One call per 5 bytes, not per field
+        self.assertLess(source.reads, len(fit_data) * 2 // 5 + 10)
+
+    def test_compact_message_store(self):
+        for filename in ('compressed-speed-distance.fit', 'developer-types-sample.fit', 'activity-settings.fit'):
+            messages = FitFile(testfile(filename)).get_messages(with_definitions=True)
+            compact_file = FitFile(testfile(filename), compact=True)
+            compact_file.parse()
+            compact_messages = list(compact_file.get_messages(with_definitions=True))
+
+            for message, compact_message in zip(messages, compact_messages):
+                self.assertEqual(message.type, compact_message.type)
+                self.assertEqual(message.name, compact_message.name)
+                if message.type == 'definition':
+                    continue
+                self.assertEqual(message.get_values(), compact_message.get_values())
+                self.assertEqual(message.header.time_offset, compact_message.header.time_offset)
+                self.assertEqual(
+                    [(f.name, f.value, f.raw_value, f.units) for f in message],
+                    [(f.name, f.value, f.raw_value, f.units) for f in compact_message])
+                for field_data in message.fields:
+                    self.assertEqual(compact_message.get_value(field_data.def_num), message.get_value(field_data.def_num))
+            self.assertEqual(len(list(messages)), 0)
+
     def test_elemnt_bolt_developer_data_id_without_application_id(self):
         """Test that a file without application id set inside developer_data_id is parsed
         (as seen on ELEMNT BOLT with firmware version WB09-1507)"""
         FitFile(testfile('elemnt-bolt-no-application-id-inside-developer-data-id.fit')).parse()
 
+    def test_standard_units_conversions(self):
+        processor = StandardUnitsDataProcessor()
+        self.assertEqual(processor.get_conversion('heart_rate', 'bpm'), None)
+        self.assertEqual(processor.get_conversion('enhanced_speed', 'm/s').units, 'km/h')
+        self.assertEqual(processor.get_conversion('position_lat', 'semicircles').units, 'deg')
+
+        record = next(FitFile(testfile('garmin-edge-500-activity.fit'), data_processor=processor).get_messages('record'))
+        self.assertAlmostEqual(record.get_value('position_lat'), 43.71339303441346)
+        self.assertEqual(record.get('position_lat').units, 'deg')
+        self.assertAlmostEqual(record.get_value('speed'), 21.1968)
+        self.assertEqual(record.get('speed').units, 'km/h')
+
+    def test_folded_unit_conversions(self):
+        class FahrenheitMilesProcessor(StandardUnitsDataProcessor):
+            field_conversions = dict(
+                StandardUnitsDataProcessor.field_conversions,
+                temperature=UnitConversion(scale=1.8, offset=32.0, units='F'))
+            unit_conversions = dict(
+                StandardUnitsDataProcessor.unit_conversions,
+                km=UnitConversion(scale=0.621371, units='mi'))
+
+        processor = FahrenheitMilesProcessor()
+        conversion = processor.get_conversion('distance', 'm')
+        self.assertEqual(conversion.units, 'mi')
+        self.assertAlmostEqual(conversion(1609.344), 1.0, places=5)
+        self.assertAlmostEqual(processor.get_conversion('temperature', 'C')(100), 212.0)
+
+    def test_process_methods_replace_conversions(self):
+        class MilesProcessor(StandardUnitsDataProcessor):
+            def process_field_distance(self, field_data):
+                if field_data.value is not None:
+                    field_data.value /= 1609.344
+                field_data.units = 'mi'
+
+            def process_field_speed(self, field_data):
+                super(MilesProcessor, self).process_field_speed(field_data)
+                if field_data.value is not None:
+                    field_data.value /= 1.609344
+                field_data.units = 'mph'
+
+        fit_path = testfile('garmin-edge-500-activity.fit')
+        raw = next(FitFile(fit_path).get_messages('record'))
+        record = next(FitFile(fit_path, data_processor=MilesProcessor()).get_messages('record'))
+        self.assertAlmostEqual(record.get_value('distance'), raw.get_value('distance') / 1609.344)
+        self.assertEqual(record.get('distance').units, 'mi')
+        self.assertAlmostEqual(record.get_value('speed'), raw.get_value('speed') * 3.6 / 1.609344)
+        self.assertAlmostEqual(record.get_value('enhanced_speed'), raw.get_value('enhanced_speed') * 3.6 / 1.609344)
+        self.assertEqual(record.get('speed').units, 'mph')
+        self.assertAlmostEqual(record.get_value('position_lat'), 43.71339303441346)
+
+        # Processors set on the processor itself
+        processor = StandardUnitsDataProcessor()
+        processor.process_units_semicircles = lambda field_data: setattr(field_data, 'units', 'semis')
+        record = next(FitFile(fit_path, data_processor=processor).get_messages('record'))
+        self.assertEqual(record.get('position_lat').units, 'semis')
+        self.assertEqual(record.get_value('position_lat'), raw.get_value('position_lat'))
+        self.assertEqual(record.get('distance').units, 'km')
+
+    def test_processor_hooks(self):
+        fit_path = testfile('garmin-edge-500-activity.fit')
+        raw = next(FitFile(fit_path).get_messages('record'))
+
+        class HooksProcessor(StandardUnitsDataProcessor):
+            # Unit processors see the values of field processors
+            def process_units_km(self, field_data):
+                field_data.value = round(field_data.value, 1)
+                field_data.units = 'rounded km'
+
+            @staticmethod
+            def process_field_heart_rate(field_data):
+                field_data.units = 'beats'
+
+        record = next(FitFile(fit_path, data_processor=HooksProcessor()).get_messages('record'))
+        self.assertEqual(record.get_value('distance'), round(raw.get_value('distance') / 1000.0, 1))
+        self.assertEqual(record.get('distance').units, 'rounded km')
+        self.assertEqual(record.get('heart_rate').units, 'beats')
+
+        # Divided like the process_field_distance() of earlier versions
+        records = FitFile(fit_path, data_processor=StandardUnitsDataProcessor()).get_messages('record')
+        for record, raw in zip(records, FitFile(fit_path).get_messages('record')):
+            if raw.get_value('distance') is not None:
+                self.assertEqual(record.get_value('distance'), raw.get_value('distance') / 1000.0)
+
+    def test_date_time_converter(self):
+        converter = DateTimeConverter(cache_size=2)
+        # Runs of increasing values, repeats, a jump back and cache evictions
+        for value in (723842606, 723842606, 723842607, 723842900, 723842000,
+                      723842607, 723000000, 723842000, 723842610, 900000000):
+            self.assertEqual(converter(value), secs_to_dt(value))
+        self.assertEqual(len(converter._cache), 2)
+
+    def test_epoch_timestamps(self):
+        f = FitFile(generate_fitfile(), data_processor=FitFileDataProcessor(epoch_timestamps=True))
+        self.assertEqual(f.messages[0].get_value('time_created'), UTC_REFERENCE + 723842606)
+
+        # Subclasses that don't call FitFileDataProcessor.__init__()
+        class Processor(FitFileDataProcessor):
+            def __init__(self):
+                pass
+
+        f = FitFile(generate_fitfile(), data_processor=Processor())
+        self.assertEqual(f.messages[0].get_value('time_created'), secs_to_dt(723842606))
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_columns_date_time(self):
+        columns = FitFile(testfile('garmin-edge-500-activity.fit')).get_columns('record')
+        self.assertEqual(columns['timestamp'].dtype, numpy.dtype('datetime64[s]'))
+        self.assertEqual(columns['timestamp'][0].astype(datetime.datetime), datetime.datetime(2011, 9, 25, 13, 0, 22))
+        self.assertIsNone(columns.units['timestamp'])
+
+        # Relative timestamps are left as seconds
+        columns = FitFile(testfile('compressed-speed-distance.fit')).get_columns('record')
+        self.assertEqual(columns['timestamp'][0], 17217864)
+        self.assertEqual(columns.units['timestamp'], 's')
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_columns_matches_messages(self):
+        fit_path = testfile('garmin-edge-500-activity.fit')
+        records = list(FitFile(fit_path, data_processor=StandardUnitsDataProcessor()).get_messages('record'))
+        columns = FitFile(fit_path, data_processor=StandardUnitsDataProcessor()).get_columns('record')
+
+        self.assertEqual(len(columns), len(records))
+        self.assertEqual(columns.units['position_long'], 'deg')
+        for name in ('position_long', 'distance', 'speed', 'altitude', 'heart_rate', 'power'):
+            for record, value in zip(records, columns[name].tolist()):
+                if value is None:
+                    self.assertIsNone(record.get_value(name))
+                else:
+                    self.assertAlmostEqual(record.get_value(name), value)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_columns_array_fields_match_messages(self):
+        # Scaled multi-value fields (ie time_in_hr_zone, scale 1000) and
+        # localtime_into_day fields
+        class MinutesProcessor(FitFileDataProcessor):
+            field_conversions = {'time_in_hr_zone': UnitConversion(divisor=60.0, units='min')}
+
+        for filename, fields in (
+                ('garmin-edge-820-bike.fit', [('lap', 'time_in_hr_zone'), ('hrv', 'time'),
+                                              ('user_profile', 'wake_time'), ('user_profile', 'sleep_time')]),
+                ('MonitoringFile.fit', [('monitoring_info', 'cycles_to_distance')])):
+            fit_path = testfile(filename)
+            for processor in (FitFileDataProcessor(), MinutesProcessor()):
+                messages = list(FitFile(fit_path, data_processor=processor).get_messages())
+                for tables in (FitFile(fit_path, data_processor=processor).get_column_tables(),
+                               build_tables(messages, processor)):
+                    for name, field in fields:
+                        expected = [m for m in messages if m.name == name]
+                        self.assertEqual(tables[name][field].tolist(), [m.get_value(field) for m in expected])
+                        self.assertEqual(tables[name].units[field], expected[0].get(field).units)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_columns_enum_categories(self):
+        fit_path = testfile('activity-large-fenxi2-multisport.fit')
+        laps = list(FitFile(fit_path).get_messages('lap'))
+        columns = FitFile(fit_path).get_columns('lap')
+
+        # Enums are kept as codes into a table shared by all columns of the type
+        self.assertEqual(columns.columns['sport'].dtype, numpy.uint8)
+        self.assertIs(columns.categories['sport'], enum_categories(MESSAGE_TYPES[18].fields[5].type))
+        self.assertEqual(columns['sport'].tolist(), [lap.get_value('sport') for lap in laps])
+        self.assertEqual(columns.slice(2, 4)['sport'].tolist(), [lap.get_value('sport') for lap in laps[2:4]])
+        # Bit fields aren't
+        self.assertNotIn('message_index', columns.categories)
+
+        resampled = resample(columns, method='ffill', time_column='start_time')
+        self.assertIn('sport', resampled.categories)
+        self.assertEqual(set(resampled['sport'].compressed().tolist()), set(lap.get_value('sport') for lap in laps) - set([None]))
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_columns_fields(self):
+        fit_path = testfile('garmin-edge-500-activity.fit')
+        fields = ['timestamp', 'position_lat', 'position_long', 'heart_rate', 'power']
+        records = FitFile(fit_path).get_columns('record')
+        for table in (FitFile(fit_path).get_columns('record', fields=fields),
+                      FitFile(fit_path).get_column_tables(fields=fields)['record']):
+            self.assertEqual(sorted(table.columns), sorted(fields))
+            for column in fields:
+                self.assertEqual(table[column].tolist(), records[column].tolist())
+
+        chunks = list(FitFile(fit_path).get_column_chunks('record', fields=['heart_rate']))
+        self.assertEqual(set(column for chunk in chunks for column in chunk.columns), set(['heart_rate']))
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_columns_memory_budget(self):
+        fit_path = testfile('garmin-edge-500-activity.fit')
+        expected = FitFile(fit_path).get_column_tables()
+        spill_dir = tempfile.mkdtemp()
+        try:
+            # Chunks of about 100 rows
+            fitfile = FitFile(fit_path)
+            records = fitfile.get_columns('record', memory_budget=100 * 1024, spill_dir=spill_dir)
+            self.assertIsInstance(numpy.ma.getdata(records.columns['heart_rate']), numpy.memmap)
+            self.assertEqual(os.listdir(spill_dir), [])
+            # Still unparsed, its data is read from where it was spooled
+            self.assertEqual(len(list(fitfile.get_messages('record'))), len(expected['record']))
+        finally:
+            shutil.rmtree(spill_dir)
+        self.assertEqual(len(records), len(expected['record']))
+        for column, values in expected['record'].items():
+            self.assertEqual(records[column].tolist(), values.tolist())
+
+        fitfile = FitFile(fit_path)
+        fitfile.parse()
+        tables = fitfile.get_column_tables(memory_budget=100 * 1024)
+        self.assertEqual(sorted(tables), sorted(expected))
+        for name, table in expected.items():
+            self.assertEqual(sorted(tables[name].columns), sorted(table.columns))
+            for column, values in table.items():
+                self.assertEqual(tables[name][column].tolist(), values.tolist())
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_get_columns_memory_budget_is_bounded(self):
+        # About 20 MB of messages (of 100 byte arrays of 255 bytes each)
+        # followed by records, gzip compressed
+        blobs = pack('<BxBHB', 0x42, 0, 0xFF00, 100) + b''.join(pack('<3B', n, 255, 0x0D) for n in range(100))
+        records = generate_messages(
+            mesg_num=20, local_mesg_num=1, field_defs=[(253, 'uint32'), (3, 'uint8')],
+            data=[[723842606 + n, 140] for n in range(100)],
+        )
+        fit_data = blobs + (pack('B', 2) + b'\0' * 25500) * 800 + records
+        # CRCs aren't checked (they'd take longer than the rest)
+        data = pack('<2BHI4s', 12, 16, 152, len(fit_data), b'.FIT') + fit_data + pack('<H', 0)
+        compressed = gzip.compress(data)
+        # Compiled definitions and the like
+        FitFile(compressed, check_crc=False).get_columns('record', memory_budget=100 * 1024)
+
+        tracemalloc.start()
+        try:
+            records = FitFile(compressed, check_crc=False).get_columns('record', memory_budget=100 * 1024)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(records), 100)
+        # The decompressed data isn't held in memory
+        self.assertLess(peak, len(data) // 4)
+
+    @unittest.skipIf(numpy is None or shared_memory is None, 'numpy or shared_memory is not available')
+    def test_shared_tables(self):
+        fit_path = testfile('activity-settings.fit')
+        expected = map_segments(fit_path, FitFile.get_column_tables, processes=1)
+        for processes in (1, 2):
+            shared = map_shared_tables(fit_path, processes=processes)
+            self.assertEqual(len(shared), 2)
+            for tables, expected_tables in zip(shared, expected):
+                self.assertEqual(sorted(tables), sorted(expected_tables))
+                for name, table in expected_tables.items():
+                    self.assertEqual(len(tables[name]), len(table))
+                    self.assertEqual(list(tables[name].columns), list(table.columns))
+                    self.assertEqual(tables[name].units, table.units)
+                    self.assertEqual(sorted(tables[name].categories), sorted(table.categories))
+                    for column, values in table.items():
+                        self.assertEqual(tables[name][column].dtype, values.dtype)
+                        self.assertEqual(tables[name][column].tolist(), values.tolist())
+
+            # Columns outlive their released block
+            events = shared[0]['event'].columns['timestamp']
+            for tables in shared:
+                tables.release()
+            self.assertEqual(events.tolist(), expected[0]['event']['timestamp'].tolist())
+            self.assertRaises(FileNotFoundError, SharedTables, shared[0].name)
+
+    @unittest.skipIf(numpy is None or shared_memory is None, 'numpy or shared_memory is not available')
+    def test_shared_tables_freed_on_error(self):
+        # A block that fails to attach doesn't leak the others
+        names = []
+
+        def attach(name):
+            names.append(name)
+            if len(names) > 1:
+                raise FitParseError('Not a shared memory block of ColumnTables: %s' % name)
+            return SharedTables(name)
+
+        shared_module.SharedTables = attach
+        try:
+            self.assertRaises(FitParseError, map_shared_tables, testfile('activity-settings.fit'), processes=1)
+        finally:
+            shared_module.SharedTables = SharedTables
+        self.assertEqual(len(names), 2)
+        for name in names:
+            self.assertRaises(FileNotFoundError, SharedTables, name)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_bulk_decode_matches_messages(self):
+        # Compressed timestamps and accumulated components, multi-value
+        # fields, unknown messages and invalid byte arrays
+        for filename in ('compressed-speed-distance.fit', 'antfs-dump.63.fit', 'garmin-fenix-5-run.fit',
+                         'garmin-edge-500-activity.fit', 'null_compressed_speed_dist.fit',
+                         'developer-types-sample.fit'):
+            fitfile = FitFile(testfile(filename))
+            expected = build_tables(FitFile(testfile(filename)).get_messages(), fitfile._processor)
+            tables = fitfile.get_column_tables()
+
+            self.assertEqual(sorted(tables), sorted(expected))
+            for name, table in tables.items():
+                self.assertEqual(len(table), len(expected[name]))
+                self.assertEqual(list(table.keys()), list(expected[name].keys()))
+                self.assertEqual(table.units, expected[name].units)
+                for column, values in table.items():
+                    self.assertEqual(values.dtype, expected[name][column].dtype)
+                    self.assertEqual(values.tolist(), expected[name][column].tolist())
+
+            # The FitFile itself is still unparsed
+            self.assertEqual(len(fitfile.messages), len(FitFile(testfile(filename)).messages))
+
+        # Scaled multi-value fields, value by value as in the messages
+        fit_path = testfile('garmin-edge-820-bike.fit')
+        laps = list(FitFile(fit_path).get_messages('lap'))
+        self.assertEqual(FitFile(fit_path).get_columns('lap')['time_in_hr_zone'].tolist(),
+                         [m.get_value('time_in_hr_zone') for m in laps])
+        self.assertIsInstance(laps[0].get_value('time_in_hr_zone')[1], float)
+
+        # Selected by message number
+        columns = FitFile(testfile('compressed-speed-distance.fit')).get_columns(20)
+        self.assertEqual(columns.name, 20)
+        self.assertEqual(len(columns), len(list(FitFile(testfile('compressed-speed-distance.fit')).get_messages(20))))
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_resample(self):
+        ma = numpy.ma
+        table = ColumnTable('record', {
+            'timestamp': ma.MaskedArray([0, 1, 3, 4, 20, 21]),
+            'heart_rate': ma.MaskedArray([100, 110, 130, 0, 150, 151], mask=[0, 0, 0, 1, 0, 0]),
+            'activity_type': ma.MaskedArray(['running'] * 6, dtype=object),
+        }, {'timestamp': 's', 'heart_rate': 'bpm', 'activity_type': None}, 6)
+
+        resampled = resample(table)
+        self.assertEqual(resampled['timestamp'].tolist(), list(range(22)))
+        self.assertEqual(resampled['heart_rate'][:4].tolist(), [100, 110, 120, 130])
+        self.assertAlmostEqual(resampled['heart_rate'][10], 130 + 20 * 7 / 17.0)
+        self.assertEqual(resampled['activity_type'].tolist(), ['running'] * 22)
+        self.assertEqual(resampled.units['heart_rate'], 'bpm')
+
+        # Gaps longer than max_gap aren't bridged, forward fill holds values
+        # for max_gap seconds
+        resampled = resample(table, max_gap=5)
+        self.assertEqual(resampled['heart_rate'][3:6].tolist(), [130, None, None])
+        self.assertEqual(resampled['heart_rate'][20:].tolist(), [150, 151])
+        resampled = resample(table, method='ffill', max_gap=5)
+        self.assertEqual(resampled['heart_rate'][2:10].tolist(), [110, 130, 130, 130, 130, 130, 130, None])
+
+        # The same, resampled in chunks
+        records = FitFile(testfile('garmin-edge-500-activity.fit')).get_columns('record')
+        expected = resample(records, max_gap=10)
+        resampler = Resampler(max_gap=10)
+        chunks = [
+            resampler.add(ColumnTable('record', dict((k, v[n:n + 500]) for k, v in records.items()),
+                                      records.units, min(500, len(records) - n)))
+            for n in range(0, len(records), 500)
+        ] + [resampler.finish()]
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(expected))
+        for column in expected:
+            self.assertEqual(ma.concatenate([chunk[column] for chunk in chunks]).tolist(), expected[column].tolist())
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_activity_summary(self):
+        fitfile = FitFile(testfile('garmin-edge-500-activity.fit'))
+        chunks = list(fitfile.get_column_chunks(name='record', chunk_size=1000))
+        self.assertEqual([len(chunk) for chunk in chunks[:2]], [1000, 1000])
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(list(fitfile.get_messages('record'))))
+
+        report = summarize(FitFile(testfile('garmin-edge-500-activity.fit')), chunk_size=1000)
+        self.assertEqual(len(report.sessions), 1)
+        self.assertEqual(len(report.laps), 9)
+        self.assertEqual(sum(lap.records for lap in report.laps), report.total.records)
+        compared = report.total.compare()
+        self.assertAlmostEqual(*compared['distance'], places=1)
+        self.assertEqual(*compared['max_heart_rate'])
+        self.assertLess(abs(compared['avg_heart_rate'][0] - compared['avg_heart_rate'][1]), 1)
+        # Lap boundaries fall between records
+        for lap in report.laps:
+            distance, device_distance = lap.compare()['distance']
+            self.assertAlmostEqual(distance, device_distance, delta=device_distance * 0.01)
+
+        report = summarize(FitFile(testfile('Edge810-Vector-2013-08-16-15-35-10.fit')))
+        self.assertEqual(round(report.total.normalized_power), report.total.device['normalized_power'])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_activity_summary_ascent(self):
+        # Altitude noise doesn't add up to the total ascent
+        for filename in ('activity-large-fenxi2-multisport.fit', 'garmin-edge-500-activity.fit'):
+            report = summarize(FitFile(testfile(filename)))
+            for session in report.sessions:
+                ascent, device_ascent = session.compare()['total_ascent']
+                if device_ascent >= 100:
+                    self.assertAlmostEqual(ascent, device_ascent, delta=device_ascent * 0.25)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_activity_summary_speed_units(self):
+        # 1 km/h isn't moving, with the units of the speed column used
+        summary = ActivitySummary()
+        summary.add_records(ColumnTable('record', {
+            'timestamp': numpy.ma.MaskedArray(numpy.arange(10)),
+            'enhanced_speed': numpy.ma.MaskedArray(numpy.ones(10)),
+        }, {'timestamp': 's', 'enhanced_speed': 'km/h'}, 10))
+        self.assertEqual(summary.timer_time, 9)
+        self.assertEqual(summary.moving_time, 0)
+
+    @unittest.skipIf(pandas is None or pyarrow is None, 'pandas or pyarrow is not installed')
+    def test_to_arrow_and_dataframe(self):
+        messages = list(FitFile(testfile('Activity.fit')).get_messages('event'))
+        for frame in (FitFile(testfile('Activity.fit')).to_dataframe('event'),
+                      FitFile(testfile('Activity.fit')).to_arrow('event').to_pandas()):
+            self.assertEqual(len(frame), len(messages))
+            self.assertEqual(str(frame['timestamp'].dtype), 'datetime64[s]')
+            self.assertEqual(str(frame['event_type'].dtype), 'category')
+            for n, message in enumerate(messages):
+                for name, value in message.get_values().items():
+                    if value is None:
+                        self.assertTrue(pandas.isnull(frame[name][n]))
+                    else:
+                        self.assertEqual(frame[name][n], value)
+
+        table = FitFile(testfile('garmin-edge-500-activity.fit')).to_arrow('record')
+        records = FitFile(testfile('garmin-edge-500-activity.fit')).get_columns('record')
+        self.assertEqual(table.num_rows, len(records))
+        self.assertEqual(table.column('power').null_count, int(records['power'].mask.sum()))
+        self.assertEqual(table.schema.field('timestamp').type, pyarrow.timestamp('s'))
+        self.assertEqual(table.schema.field('heart_rate').metadata, {b'units': b'bpm'})
+
     # TODO:
     #  * Test Processors:
     #    - process_type_<>, process_field_<>, process_units_<>, process_message_<>
 
 
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_csv_tables_per_message_type(self):
+        exporter = TableExporter(self.out_dir, writer_class=CSVTableWriter, batch_size=100)
+        names = exporter.export(FitFile(testfile('garmin-edge-500-activity.fit')))
+        self.assertIn('record', names)
+        self.assertEqual(sorted(os.listdir(self.out_dir)), sorted(n + '.csv' for n in names))
+
+        records = list(FitFile(testfile('garmin-edge-500-activity.fit')).get_messages('record'))
+        with open(os.path.join(self.out_dir, 'record.csv')) as csv_fp:
+            rows = list(csv.DictReader(csv_fp))
+        self.assertEqual(len(rows), len(records))
+        self.assertEqual(rows[0]['heart_rate'], str(records[0].get_value('heart_rate')))
+        self.assertEqual(rows[-1]['timestamp'], str(records[-1].get_value('timestamp')))
+
+    def test_new_columns_start_new_part(self):
+        fit_data = generate_fitfile(
+            generate_messages(
+                mesg_num=20, local_mesg_num=1, field_defs=[(3, 'uint8')], data=[[140]],
+            ) + generate_messages(
+                mesg_num=20, local_mesg_num=2, field_defs=[(3, 'uint8'), (4, 'uint8')], data=[[150, 90]],
+            )
+        )
+        TableExporter(self.out_dir).export(FitFile(fit_data), name='record')
+        with open(os.path.join(self.out_dir, 'record.csv')) as csv_fp:
+            self.assertEqual(list(csv.reader(csv_fp)), [['heart_rate', 'timestamp'], ['140', '']])
+        with open(os.path.join(self.out_dir, 'record-2.csv')) as csv_fp:
+            self.assertEqual(list(csv.reader(csv_fp)), [['heart_rate', 'timestamp', 'cadence'], ['150', '', '90']])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_batches(self):
+        exporter = TableExporter(self.out_dir, writer_class=ParquetTableWriter, batch_size=2)
+        exporter.export(FitFile(testfile('garmin-edge-500-activity.fit')), name='record')
+
+        records = list(FitFile(testfile('garmin-edge-500-activity.fit')).get_messages('record'))
+        table = pyarrow.parquet.read_table(os.path.join(self.out_dir, 'record.parquet'))
+        self.assertEqual(table.num_rows, len(records))
+        self.assertEqual(table.column('heart_rate').to_pylist()[-1], records[-1].get_value('heart_rate'))
+
+    def test_export_files_same_basename(self):
+        in_dir = os.path.join(self.out_dir, 'in')
+        paths = []
+        for subdir, filename in (('a', 'garmin-edge-500-activity.fit'), ('b', 'compressed-speed-distance.fit')):
+            os.makedirs(os.path.join(in_dir, subdir))
+            paths.append(os.path.join(in_dir, subdir, 'x.fit'))
+            shutil.copy(testfile(filename), paths[-1])
+
+        out_dir = os.path.join(self.out_dir, 'out')
+        results = list(export_files(paths, out_dir, name='record', processes=1, root=in_dir))
+        self.assertEqual([error for _, _, error in results], [None, None])
+        for path, subdir in zip(paths, ('a', 'b')):
+            rows = 0
+            for filename in os.listdir(os.path.join(out_dir, subdir, 'x')):
+                with open(os.path.join(out_dir, subdir, 'x', filename)) as csv_fp:
+                    rows += len(list(csv.DictReader(csv_fp)))
+            self.assertEqual(rows, len(list(FitFile(path).get_messages('record'))))
+
+        # Without a root, colliding basenames are numbered
+        out_dir = os.path.join(self.out_dir, 'flat')
+        list(export_files(paths, out_dir, name='record', processes=1))
+        self.assertEqual(sorted(os.listdir(out_dir)), ['x', 'x-2'])
+
+    def test_ndjson(self):
+        fp = io.StringIO()
+        count = write_ndjson(FitFile(generate_fitfile()), fp, units=True)
+        self.assertEqual(count, 1)
+        line = fp.getvalue()
+        self.assertTrue(line.endswith('\n'))
+        self.assertEqual(json.loads(line), {
+            'name': 'file_id',
+            'fields': {
+                'serial_number': 558069241, 'time_created': secs_to_dt(723842606).isoformat(),
+                'manufacturer': 'garmin', 'garmin_product': 'edge500', 'type': 'activity',
+            },
+            'units': {},
+        })
+
+        # Strictly valid JSON
+        fp = io.StringIO()
+        write_ndjson(FitFile(generate_fitfile(generate_messages(
+            mesg_num=0xFF00, local_mesg_num=1, field_defs=[(0, 'float32'), (1, 'float64')],
+            data=[[float('inf'), 1.5], [float('-inf'), -1.5]],
+        ))), fp)
+
+        def reject(constant):
+            raise ValueError('Not JSON: %s' % constant)
+
+        lines = [json.loads(line, parse_constant=reject) for line in fp.getvalue().splitlines()[1:]]
+        self.assertEqual([line['fields'] for line in lines], [
+            {'unknown_0': None, 'unknown_1': 1.5}, {'unknown_0': None, 'unknown_1': -1.5},
+        ])
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = FitCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_hit_skips_decoding(self):
+        import fitparse.cache
+
+        fit_path = testfile('garmin-fenix-5-bike.fit')
+        tables = self.cache.get_column_tables(fit_path, StandardUnitsDataProcessor())
+
+        real_fitfile, fitparse.cache.FitFile = fitparse.cache.FitFile, None
+        try:
+            cached = self.cache.get_column_tables(fit_path, StandardUnitsDataProcessor())
+        finally:
+            fitparse.cache.FitFile = real_fitfile
+
+        self.assertEqual(sorted(cached), sorted(tables))
+        for name, table in tables.items():
+            self.assertEqual(len(cached[name]), len(table))
+            self.assertEqual(cached[name].units, table.units)
+            self.assertEqual(sorted(cached[name].categories), sorted(table.categories))
+            for column, values in table.items():
+                self.assertEqual(cached[name][column].dtype, values.dtype)
+                self.assertEqual(cached[name][column].tolist(), values.tolist())
+
+    def test_entries_load_without_pickle(self):
+        for filename in ('garmin-edge-820-bike.fit', 'developer-types-sample.fit', 'MonitoringFile.fit'):
+            fit_path = testfile(filename)
+            tables = self.cache.get_column_tables(fit_path)
+            key = self.cache.key(FitCache._read(fit_path), FitFileDataProcessor())
+            with numpy.load(self.cache._path(key), allow_pickle=False) as npz:
+                self.assertTrue(all(npz[name].dtype.kind != 'O' for name in npz.files))
+
+            cached = self.cache.load(key)
+            if 'user_profile' in tables:
+                # localtime_into_day columns are datetime.time objects
+                self.assertIsInstance(cached['user_profile']['wake_time'][0], datetime.time)
+            for name, table in tables.items():
+                self.assertEqual(sorted(cached[name].categories), sorted(table.categories))
+                for column, values in table.items():
+                    self.assertEqual(cached[name][column].tolist(), values.tolist())
+
+    def test_time_columns_are_cached(self):
+        values = [datetime.time(6, 30), datetime.datetime(2017, 1, 2, 3, 4, 5, 6), datetime.date(2017, 1, 2), None]
+        column = numpy.ma.MaskedArray(object_array(values), mask=[False, False, False, True])
+        self.cache.store('times', {'times': ColumnTable('times', {'value': column}, {'value': None}, 4)})
+        cached = self.cache.load('times')
+        self.assertEqual(cached['times']['value'].tolist(), values)
+
+        column = numpy.ma.MaskedArray(object_array([set()]), mask=[False])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.cache.store('sets', {'sets': ColumnTable('sets', {'value': column}, {'value': None}, 1)})
+        self.assertEqual(len(caught), 1)
+        self.assertIsNone(self.cache.load('sets'))
+        self.assertFalse(os.path.exists(self.cache._path('sets')))
+
+    def test_corrupted_entry_is_a_miss(self):
+        fit_path = testfile('Settings.fit')
+        tables = self.cache.get_column_tables(fit_path)
+        path = self.cache._path(self.cache.key(FitCache._read(fit_path), FitFileDataProcessor()))
+        with open(path, 'rb') as f:
+            data = f.read()
+        for corrupted in (data[:len(data) // 2], b'not an npz file'):
+            with open(path, 'wb') as f:
+                f.write(corrupted)
+            cached = self.cache.get_column_tables(fit_path)
+            self.assertEqual(sorted(cached), sorted(tables))
+
+    def test_key_depends_on_processor(self):
+        with open(testfile('nametest.FIT'), 'rb') as f:
+            data = f.read()
+        keys = set([
+            self.cache.key(data, FitFileDataProcessor()),
+            self.cache.key(data, FitFileDataProcessor(epoch_timestamps=True)),
+            self.cache.key(data, StandardUnitsDataProcessor()),
+            self.cache.key(data, FitFileDataProcessor(), check_crc=False),
+        ])
+        self.assertEqual(len(keys), 4)
+
+    def test_lru_eviction(self):
+        for filename in ('Settings.fit', 'Settings2.fit', 'Activity.fit'):
+            self.cache.get_column_tables(testfile(filename))
+        entries = sorted(self.cache._entries())
+        self.assertEqual(len(entries), 3)
+
+        # Touch the oldest entry, then shrink the cache to fit two entries
+        os.utime(entries[0][2], (entries[-1][0] + 10, entries[-1][0] + 10))
+        self.cache.max_size = entries[0][1] + entries[-1][1]
+        self.cache.evict()
+        remaining = [path for _, _, path in self.cache._entries()]
+        self.assertEqual(sorted(remaining), sorted([entries[0][2], entries[-1][2]]))
+
+
 if __name__ == '__main__':
     unittest.main()